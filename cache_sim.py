@@ -0,0 +1,453 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+文档缓存模拟
+按查询顺序把每个查询检索到的 top-k 文档展开为访问序列（跳过faiss的-1填充位），
+在一组缓存容量下重放 LRU、LFU、ARC、2Q、S3-FIFO、W-TinyLFU 六种替换策略，
+同时给出按访问次数的命中率和按字节（文档正文UTF-8长度）的字节命中率
+
+容量以文档数计；各 (策略, 容量) 组合可用多进程并行模拟
+
+用法:
+    python cache_sim.py --dataset nq --topk 10 --capacities 0.001 0.01 0.05 0.1 --workers 8
+"""
+
+import os
+import json
+import argparse
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import matplotlib.pyplot as plt
+import faiss
+
+from retrieval_store import add_retrieval_args, load_or_search
+
+# 配置matplotlib中文字体支持
+plt.rcParams['font.sans-serif'] = ['SimHei', 'Microsoft YaHei', 'DejaVu Sans']
+plt.rcParams['axes.unicode_minus'] = False  # 正确显示负号
+
+WIKI_DATA_PATH = os.path.join("wikipedia_data", "wikipedia_100k.json")
+DEFAULT_CAPACITIES = [0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2]  # 占语料库文档数的比例
+POLICIES = ["LRU", "LFU", "ARC", "2Q", "S3-FIFO", "TinyLFU"]
+
+
+def simulate_lru(trace, capacity):
+    """LRU: 命中移到队尾，满时淘汰队首"""
+    hits = bytearray(len(trace))
+    cache = OrderedDict()
+    move_to_end, popitem = cache.move_to_end, cache.popitem
+    for i, key in enumerate(trace):
+        if key in cache:
+            hits[i] = 1
+            move_to_end(key)
+        elif capacity > 0:
+            cache[key] = None
+            if len(cache) > capacity:
+                popitem(last=False)
+    return hits
+
+
+def simulate_lfu(trace, capacity):
+    """LFU（O(1)实现）: 淘汰缓存内访问次数最少的文档，同频按LRU"""
+    hits = bytearray(len(trace))
+    key_freq = {}
+    buckets = {}  # 频率 -> 该频率下的文档（按最近访问排序）
+    min_freq = 0
+    for i, key in enumerate(trace):
+        freq = key_freq.get(key)
+        if freq is not None:
+            hits[i] = 1
+            bucket = buckets[freq]
+            del bucket[key]
+            if not bucket:
+                del buckets[freq]
+                if min_freq == freq:
+                    min_freq = freq + 1
+            freq += 1
+            key_freq[key] = freq
+            bucket = buckets.get(freq)
+            if bucket is None:
+                bucket = buckets[freq] = OrderedDict()
+            bucket[key] = None
+        elif capacity > 0:
+            if len(key_freq) >= capacity:
+                bucket = buckets[min_freq]
+                victim, _ = bucket.popitem(last=False)
+                if not bucket:
+                    del buckets[min_freq]
+                del key_freq[victim]
+            key_freq[key] = 1
+            bucket = buckets.get(1)
+            if bucket is None:
+                bucket = buckets[1] = OrderedDict()
+            bucket[key] = None
+            min_freq = 1
+    return hits
+
+
+def simulate_arc(trace, capacity):
+    """ARC (Megiddo & Modha 2003): T1/T2 为缓存，B1/B2 为幽灵列表，自适应调整 T1 目标大小 p"""
+    hits = bytearray(len(trace))
+    if capacity <= 0:
+        return hits
+    t1, t2, b1, b2 = OrderedDict(), OrderedDict(), OrderedDict(), OrderedDict()
+    p = 0.0
+
+    def replace(in_b2):
+        if t1 and (len(t1) > p or (in_b2 and len(t1) == p)):
+            old, _ = t1.popitem(last=False)
+            b1[old] = None
+        else:
+            old, _ = t2.popitem(last=False)
+            b2[old] = None
+
+    for i, key in enumerate(trace):
+        if key in t1:
+            hits[i] = 1
+            del t1[key]
+            t2[key] = None
+        elif key in t2:
+            hits[i] = 1
+            t2.move_to_end(key)
+        elif key in b1:
+            p = min(capacity, p + max(len(b2) / len(b1), 1))
+            replace(False)
+            del b1[key]
+            t2[key] = None
+        elif key in b2:
+            p = max(0.0, p - max(len(b1) / len(b2), 1))
+            replace(True)
+            del b2[key]
+            t2[key] = None
+        else:
+            l1 = len(t1) + len(b1)
+            if l1 == capacity:
+                if len(t1) < capacity:
+                    b1.popitem(last=False)
+                    replace(False)
+                else:
+                    t1.popitem(last=False)
+            elif l1 < capacity:
+                total = l1 + len(t2) + len(b2)
+                if total >= capacity:
+                    if total == 2 * capacity:
+                        b2.popitem(last=False)
+                    replace(False)
+            t1[key] = None
+    return hits
+
+
+def simulate_2q(trace, capacity, kin_ratio=0.25, kout_ratio=0.5):
+    """2Q (Johnson & Shasha 1994): A1in 先进先出，A1out 幽灵队列，再次访问的文档进入 LRU 的 Am"""
+    hits = bytearray(len(trace))
+    if capacity <= 0:
+        return hits
+    kin = max(1, int(kin_ratio * capacity))
+    kout = max(1, int(kout_ratio * capacity))
+    am, a1in, a1out = OrderedDict(), OrderedDict(), OrderedDict()
+
+    def reclaim():
+        if len(am) + len(a1in) < capacity:
+            return
+        if len(a1in) > kin or not am:
+            old, _ = a1in.popitem(last=False)
+            a1out[old] = None
+            if len(a1out) > kout:
+                a1out.popitem(last=False)
+        else:
+            am.popitem(last=False)
+
+    for i, key in enumerate(trace):
+        if key in am:
+            hits[i] = 1
+            am.move_to_end(key)
+        elif key in a1in:
+            hits[i] = 1
+        elif key in a1out:
+            del a1out[key]
+            reclaim()
+            am[key] = None
+        else:
+            reclaim()
+            a1in[key] = None
+    return hits
+
+
+def simulate_s3fifo(trace, capacity, small_ratio=0.1):
+    """
+    S3-FIFO (Yang et al. SOSP'23): 小FIFO队列过滤只访问一次的文档，
+    在小队列中被再次访问(freq > 1)的文档进入主FIFO队列，主队列淘汰时按频率给予重新插入的机会
+    """
+    hits = bytearray(len(trace))
+    if capacity <= 0:
+        return hits
+    small_cap = max(1, int(small_ratio * capacity))
+    main_cap = max(1, capacity - small_cap)
+    small, main = deque(), deque()
+    ghost = OrderedDict()
+    freq = {}  # 驻留文档 -> 访问频率（上限3）
+
+    def evict_main():
+        while main:
+            old = main.popleft()
+            if freq[old] > 0:
+                freq[old] -= 1
+                main.append(old)
+            else:
+                del freq[old]
+                return
+
+    def evict_small():
+        while small:
+            old = small.popleft()
+            if freq[old] > 1:
+                if len(main) >= main_cap:
+                    evict_main()
+                main.append(old)
+            else:
+                del freq[old]
+                ghost[old] = None
+                if len(ghost) > main_cap:
+                    ghost.popitem(last=False)
+                return
+
+    for i, key in enumerate(trace):
+        f = freq.get(key)
+        if f is not None:
+            hits[i] = 1
+            if f < 3:
+                freq[key] = f + 1
+            continue
+        while len(freq) >= capacity:
+            if len(small) >= small_cap or not main:
+                evict_small()
+            else:
+                evict_main()
+        if key in ghost:
+            del ghost[key]
+            main.append(key)
+        else:
+            small.append(key)
+        freq[key] = 0
+    return hits
+
+
+class FrequencySketch:
+    """W-TinyLFU 使用的4位 Count-Min 频率草图，累计 sample_size 次增量后所有计数减半（老化）"""
+
+    SEEDS = (0x9E3779B97F4A7C15, 0xC2B2AE3D27D4EB4F, 0x165667B19E3779F9, 0xD6E8FEB86659FD93)
+    HALVE = bytes(v >> 1 for v in range(256))
+
+    def __init__(self, capacity, num_keys):
+        width = 16
+        while width < capacity:
+            width <<= 1
+        self.mask = width - 1
+        self.rows = [bytearray(width) for _ in self.SEEDS]
+        self.sample_size = 10 * max(capacity, 1)
+        self.additions = 0
+        # 键是文档ID，一次性用NumPy算出每个键在各行的桶下标（按 uint64 取模乘法），避免逐次哈希
+        keys = np.arange(num_keys, dtype=np.uint64)
+        with np.errstate(over="ignore"):
+            columns = [(((keys * np.uint64(seed)) >> np.uint64(32)) & np.uint64(self.mask)).tolist()
+                       for seed in self.SEEDS]
+        self.key_indexes = list(zip(*columns))
+
+    def increment(self, key):
+        for row, idx in zip(self.rows, self.key_indexes[key]):
+            if row[idx] < 15:
+                row[idx] += 1
+        self.additions += 1
+        if self.additions >= self.sample_size:
+            self.rows = [row.translate(self.HALVE) for row in self.rows]
+            self.additions //= 2
+
+    def frequency(self, key):
+        return min(row[idx] for row, idx in zip(self.rows, self.key_indexes[key]))
+
+
+def simulate_tinylfu(trace, capacity, window_ratio=0.01, protected_ratio=0.8):
+    """
+    W-TinyLFU (Einziger et al.): 1%的LRU窗口 + 分段LRU主缓存（保护段80%/试用段20%），
+    窗口淘汰的候选文档与试用段的待淘汰文档比较草图频率，频率更高者留在主缓存
+    """
+    hits = bytearray(len(trace))
+    if capacity <= 0:
+        return hits
+    window_cap = max(1, int(window_ratio * capacity))
+    main_cap = capacity - window_cap
+    protected_cap = int(protected_ratio * main_cap)
+    window, probation, protected = OrderedDict(), OrderedDict(), OrderedDict()
+    sketch = FrequencySketch(capacity, max(trace) + 1 if len(trace) else 0)
+    for i, key in enumerate(trace):
+        sketch.increment(key)
+        if key in window:
+            hits[i] = 1
+            window.move_to_end(key)
+        elif key in protected:
+            hits[i] = 1
+            protected.move_to_end(key)
+        elif key in probation:
+            hits[i] = 1
+            del probation[key]
+            protected[key] = None
+            if len(protected) > protected_cap:
+                demoted, _ = protected.popitem(last=False)
+                probation[demoted] = None
+        else:
+            window[key] = None
+            if len(window) <= window_cap:
+                continue
+            candidate, _ = window.popitem(last=False)
+            if main_cap <= 0:
+                continue
+            if len(probation) + len(protected) < main_cap:
+                probation[candidate] = None
+                continue
+            victim_list = probation if probation else protected
+            victim = next(iter(victim_list))
+            if sketch.frequency(candidate) > sketch.frequency(victim):
+                del victim_list[victim]
+                probation[candidate] = None
+    return hits
+
+
+SIMULATORS = {
+    "LRU": simulate_lru,
+    "LFU": simulate_lfu,
+    "ARC": simulate_arc,
+    "2Q": simulate_2q,
+    "S3-FIFO": simulate_s3fifo,
+    "TinyLFU": simulate_tinylfu,
+}
+
+_WORKER_STATE = {}
+
+
+def _init_worker(state):
+    """工作进程初始化: 共享数据（如访问序列）每个进程只传递一次"""
+    _WORKER_STATE.clear()
+    _WORKER_STATE.update(state)
+
+
+def worker_state():
+    """当前进程中由 map_with_shared_state 传入的共享数据"""
+    return _WORKER_STATE
+
+
+def map_with_shared_state(fn, jobs, state, workers=1):
+    """
+    对每个任务执行 fn(job)，fn 通过 worker_state() 读取共享数据；
+    workers > 1 时用进程池并行，state 经进程池初始化函数传给每个进程一次而不是随每个任务传递
+    """
+    jobs = list(jobs)
+    if workers > 1 and len(jobs) > 1:
+        with ProcessPoolExecutor(max_workers=min(workers, len(jobs)), initializer=_init_worker,
+                                 initargs=(state,)) as executor:
+            return list(executor.map(fn, jobs))
+    _init_worker(state)
+    return [fn(job) for job in jobs]
+
+
+def _run_job(job):
+    policy, capacity = job
+    trace, trace_sizes = _WORKER_STATE["trace"], _WORKER_STATE["trace_sizes"]
+    hits = np.frombuffer(SIMULATORS[policy](trace, capacity), dtype=np.uint8).astype(bool)
+    return {"policy": policy, "capacity": capacity,
+            "hit_ratio": float(hits.mean()) if len(hits) else 0.0,
+            "byte_hit_ratio": float(trace_sizes[hits].sum() / trace_sizes.sum()) if len(hits) else 0.0}
+
+
+def build_trace(indices):
+    """按查询顺序展开检索结果为访问序列（跳过-1填充位）"""
+    flat = np.asarray(indices).ravel()
+    return flat[flat >= 0].astype(np.int64)
+
+
+def load_doc_sizes(ntotal, corpus_path=WIKI_DATA_PATH, log=print):
+    """文档大小（UTF-8字节数）；找不到语料库时所有文档大小视为相同"""
+    if not os.path.exists(corpus_path):
+        log(f"未找到语料库 {corpus_path}，字节命中率按等长文档计算")
+        return np.ones(ntotal, dtype=np.int64)
+    with open(corpus_path, "r", encoding="utf-8") as f:
+        texts = json.load(f)["text"]
+    sizes = np.ones(ntotal, dtype=np.int64)
+    n = min(ntotal, len(texts))
+    sizes[:n] = [len(text.encode("utf-8")) for text in texts[:n]]
+    return sizes
+
+
+def run_simulations(trace, doc_sizes, capacities, policies=POLICIES, workers=1):
+    """对每个 (策略, 容量) 模拟并返回结果列表"""
+    trace_list = trace.tolist()
+    trace_sizes = doc_sizes[trace]
+    jobs = [(policy, capacity) for capacity in capacities for policy in policies]
+    return map_with_shared_state(_run_job, jobs, {"trace": trace_list, "trace_sizes": trace_sizes}, workers)
+
+
+def write_cache_report(path, dataset_name, topk, trace, results, capacities, policies):
+    """保存命中率表（每行一个容量，每列一个策略）"""
+    num_distinct = len(np.unique(trace))
+    lines = [f"文档缓存模拟 - {dataset_name.upper()} Top-{topk}",
+             f"访问次数: {len(trace)}, 不同文档数: {num_distinct}, "
+             f"无限容量命中率上限: {(1 - num_distinct / len(trace)) * 100:.2f}%"]
+    table = {(r["policy"], r["capacity"]): r for r in results}
+    for metric, label in (("hit_ratio", "命中率(%)"), ("byte_hit_ratio", "字节命中率(%)")):
+        lines.append(f"\n{label}")
+        lines.append(f"{'容量(文档数)':<14}" + "".join(f"{p:>10}" for p in policies))
+        for capacity in capacities:
+            lines.append(f"{capacity:<14}" + "".join(f"{table[(p, capacity)][metric] * 100:>10.2f}" for p in policies))
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("\n".join(lines) + "\n")
+    for line in lines:
+        print(line)
+
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description="文档缓存模拟")
+    add_retrieval_args(parser)
+    parser.add_argument("--capacities", type=float, nargs="+", default=DEFAULT_CAPACITIES,
+                        help="缓存容量: <1 表示占语料库文档数的比例，>=1 表示文档数")
+    parser.add_argument("--policies", type=str, nargs="+", default=POLICIES, choices=POLICIES, help="要模拟的替换策略")
+    parser.add_argument("--workers", type=int, default=0, help="并行进程数，0表示CPU核数 (默认: 0)")
+    parser.add_argument("--corpus", type=str, default=WIKI_DATA_PATH, help="语料库JSON（用于计算字节命中率）")
+    args = parser.parse_args()
+
+    dataset_name = args.dataset.lower()
+    topk = args.topk
+    print(f"加载索引 {args.index}...")
+    index = faiss.read_index(args.index)
+    _, _, indices = load_or_search(args.index, dataset_name, topk, index)
+
+    trace = build_trace(indices)
+    doc_sizes = load_doc_sizes(index.ntotal, args.corpus)
+    capacities = sorted({int(c * index.ntotal) if c < 1 else int(c) for c in args.capacities} - {0})
+    workers = args.workers or os.cpu_count() or 1
+    print(f"模拟 {len(args.policies)} 种策略 x {len(capacities)} 种容量，访问序列长度 {len(trace)}...")
+    results = run_simulations(trace, doc_sizes, capacities, args.policies, workers)
+
+    report_path = f"cache_sim_{dataset_name}_top{topk}.txt"
+    write_cache_report(report_path, dataset_name, topk, trace, results, capacities, args.policies)
+    with open(f"cache_sim_{dataset_name}_top{topk}.json", "w", encoding="utf-8") as f:
+        json.dump({"num_accesses": int(len(trace)), "results": results}, f, ensure_ascii=False, indent=2)
+
+    plot_path = f"cache_sim_{dataset_name}_top{topk}.png"
+    plt.figure(figsize=(10, 6))
+    for policy in args.policies:
+        ratios = [r["hit_ratio"] * 100 for capacity in capacities for r in results
+                  if r["policy"] == policy and r["capacity"] == capacity]
+        plt.plot(capacities, ratios, marker='o', label=policy)
+    plt.xscale('log')
+    plt.title(f"缓存命中率 vs 容量 - {dataset_name.upper()} Top-{topk}")
+    plt.xlabel("缓存容量 (文档数)")
+    plt.ylabel("命中率 (%)")
+    plt.legend()
+    plt.grid(True)
+    plt.savefig(plot_path)
+    print(f"缓存模拟结果保存到 {report_path}，命中率曲线保存为 {plot_path}")
+
+
+if __name__ == "__main__":
+    main()
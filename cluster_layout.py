@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+按聚类重排语料存储布局
+文档ID沿用Wikipedia导出顺序，与嵌入空间的局部性无关。本脚本:
+1. 用 faiss k-means 对 doc_embeddings_100k.npy 聚类，按簇的总检索频率降序排列簇（热门簇在前），
+   簇内按文档检索频率降序（同频按ID）
+2. 按新顺序重写嵌入文件、语料JSON和HNSW索引（图结构不变，只对节点重新编号并搬移邻居表和向量），
+   并保存新旧ID映射 id_map.npz (new_to_old / old_to_new / cluster)
+3. 与原布局对比: 单查询检索延迟、检索结果一致性、mmap页级缺页（页大小4KB），以及
+   HNSW检索过程访问向量的缓存行（64字节）缺失和TLB缺失（均为LRU模型）。
+   向量不小于一个缓存行时各向量独占缓存行，缓存行缺失与布局无关，布局的局部性主要体现在页和TLB上
+
+使用新布局时，检索结果中的文档ID需经 new_to_old 映射回原ID（或直接配合重写后的语料使用）
+
+用法:
+    python cluster_layout.py --datasets nq triviaqa --topk 10 --nlist 256 --out_dir layout_cluster
+"""
+
+import os
+import json
+import argparse
+import numpy as np
+import faiss
+
+from retrieval_store import add_retrieval_args, load_or_search
+from cache_sim import load_doc_sizes, WIKI_DATA_PATH
+from page_io_sim import (kmeans_assign, positions_from_order, build_accesses, simulate_layouts, EMBEDDINGS_PATH,
+                         NPY_HEADER_BYTES)
+from latency_benchmark import latency_summary, time_calls
+
+CACHE_LINE_BYTES = 64
+TLB_PAGE_BYTES = 4096
+DEFAULT_OUT_DIR = "layout_cluster"
+
+
+def hot_cluster_order(assign, doc_freq):
+    """
+    存储顺序（新位置 -> 原文档ID）: 簇按总检索频率降序（同频按簇号），
+    簇内按文档检索频率降序（同频按ID）；同时返回每个簇的总检索频率
+    """
+    cluster_freq = np.bincount(assign, weights=doc_freq, minlength=int(assign.max()) + 1).astype(np.int64)
+    clusters = np.arange(len(cluster_freq))
+    cluster_rank = np.empty(len(cluster_freq), dtype=np.int64)
+    cluster_rank[np.lexsort((clusters, -cluster_freq))] = clusters
+    docs = np.arange(len(assign), dtype=np.int64)
+    return np.lexsort((docs, -doc_freq, cluster_rank[assign])), cluster_freq
+
+
+def permute_hnsw(index, order):
+    """
+    按新顺序重新编号 IndexHNSWFlat: 图结构不变，节点 order[j] 变为节点 j，
+    层级、邻居表偏移、邻居表（邻居ID同样重新编号）、入口节点和存储的向量一并搬移
+    """
+    hnsw = index.hnsw
+    positions = positions_from_order(order)
+    levels = faiss.vector_to_array(hnsw.levels)
+    offsets = faiss.vector_to_array(hnsw.offsets).astype(np.int64)
+    neighbors = faiss.vector_to_array(hnsw.neighbors)
+
+    sizes = np.diff(offsets)[order]
+    new_offsets = np.zeros(len(order) + 1, dtype=np.int64)
+    np.cumsum(sizes, out=new_offsets[1:])
+    gather = np.repeat(offsets[:-1][order], sizes) + (np.arange(new_offsets[-1]) - np.repeat(new_offsets[:-1], sizes))
+    moved = neighbors[gather]
+    new_neighbors = np.where(moved >= 0, positions[np.maximum(moved, 0)], -1).astype(np.int32)
+
+    new_index = faiss.clone_index(index)
+    new_hnsw = new_index.hnsw
+    faiss.copy_array_to_vector(levels[order].astype(np.int32), new_hnsw.levels)
+    faiss.copy_array_to_vector(new_offsets.astype(np.uint64), new_hnsw.offsets)
+    faiss.copy_array_to_vector(new_neighbors, new_hnsw.neighbors)
+    new_hnsw.entry_point = int(positions[hnsw.entry_point])
+    storage = faiss.downcast_index(new_index.storage)
+    vectors = index.reconstruct_n(0, index.ntotal)
+    faiss.copy_array_to_vector(np.ascontiguousarray(vectors[order]).view(np.uint8).ravel(), storage.codes)
+    return new_index
+
+
+def write_layout(out_dir, order, assign, vectors, texts, new_index, embeddings_name, corpus_name, index_name, log=print):
+    """按新顺序写出嵌入文件、语料JSON、HNSW索引和ID映射"""
+    os.makedirs(out_dir, exist_ok=True)
+    np.save(os.path.join(out_dir, embeddings_name), np.ascontiguousarray(vectors[order]))
+    if texts is not None:
+        with open(os.path.join(out_dir, corpus_name), "w", encoding="utf-8") as f:
+            json.dump({"text": [texts[i] for i in order]}, f, ensure_ascii=False)
+    else:
+        log("未找到语料库，跳过重写语料文件")
+    faiss.write_index(new_index, os.path.join(out_dir, index_name))
+    np.savez(os.path.join(out_dir, "id_map.npz"), new_to_old=order, old_to_new=positions_from_order(order),
+             cluster=assign[order])
+    log(f"新布局写入 {out_dir}")
+
+
+def benchmark_layout(index, new_index, order, query_embs, indices, topk, doc_sizes, header_bytes,
+                     cache_mb, llc_mb, tlb_entries=1536, log=print):
+    """对比原布局和新布局的检索延迟、结果一致性、页级缺页和缓存行缺失"""
+    from hnsw_traversal import HNSWGraph, traverse
+
+    query_embs = np.ascontiguousarray(query_embs, dtype=np.float32)
+    result = {}
+    for name, idx in (("original", index), ("cluster", new_index)):
+        result[f"{name}_latency_ms"] = latency_summary(time_calls(lambda q: idx.search(q[None, :], topk), query_embs))
+    _, original_ids = index.search(query_embs, topk)
+    _, new_ids = new_index.search(query_embs, topk)
+    mapped = np.where(new_ids >= 0, order[np.maximum(new_ids, 0)], -1)
+    result["identical_results"] = float(np.mean(np.all(mapped == original_ids, axis=1)))
+
+    log(f"重放 {len(query_embs)} 个查询的HNSW检索过程...")
+    sequences = traverse(HNSWGraph(index), query_embs, topk, record_sequences=True)["sequences"]
+    layouts = {"original": np.arange(index.ntotal, dtype=np.int64), "cluster": positions_from_order(order)}
+    vector_bytes = index.d * 4
+    # mmap页级: 检索访问的节点向量 + top-k文档的向量和正文
+    files, docs = build_accesses(indices[:len(query_embs)], sequences)
+    result["page_faults"] = simulate_layouts(files, docs, layouts, vector_bytes, header_bytes, doc_sizes,
+                                             [4096], cache_mb, log=log)
+    # 缓存行和TLB: 只看检索过程在内存中访问的向量（IndexFlat存储无文件头）
+    visits = np.concatenate(sequences) if sequences else np.empty(0, dtype=np.int64)
+    visit_files = np.zeros(len(visits), dtype=np.int8)
+    result["cache_line_misses"] = simulate_layouts(visit_files, visits, layouts, vector_bytes, 0, doc_sizes,
+                                                   [CACHE_LINE_BYTES], llc_mb, log=log)
+    result["tlb_misses"] = simulate_layouts(visit_files, visits, layouts, vector_bytes, 0, doc_sizes,
+                                            [TLB_PAGE_BYTES], [tlb_entries * TLB_PAGE_BYTES / 2 ** 20], log=log)
+    return result
+
+
+def write_benchmark_report(path, topk, nlist, cluster_freq, results):
+    """保存各数据集上原布局与新布局的对比"""
+    ordered = np.sort(cluster_freq)[::-1]
+    total = ordered.sum()
+    lines = [f"聚类布局对比 - Top-{topk}, {nlist} 个簇"]
+    if total:
+        lines.append(f"最热门10%的簇占检索次数: {ordered[:max(1, len(ordered) // 10)].sum() / total * 100:.2f}%")
+    for dataset_name, r in results.items():
+        lines.append(f"\n[{dataset_name.upper()}] 结果一致的查询比例: {r['identical_results'] * 100:.2f}%")
+        for name in ("original", "cluster"):
+            lat = r[f"{name}_latency_ms"]
+            lines.append(f"{name:<10} 单查询检索延迟(ms): 均值 {lat['mean']:.3f}, p50 {lat['p50']:.3f}, p95 {lat['p95']:.3f}")
+        for key, label in (("page_faults", "4KB页缺页"), ("cache_line_misses", "64B缓存行缺失"),
+                           ("tlb_misses", "TLB缺失")):
+            for row in r[key]:
+                lines.append(f"{row['layout']:<10} {label} (缓存 {row['cache_mb']:g}MB): {row['faults']} / {row['page_accesses']} "
+                             f"({row['fault_rate'] * 100:.2f}%)")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("\n".join(lines) + "\n")
+    for line in lines:
+        print(line)
+
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description="按聚类重排语料存储布局")
+    add_retrieval_args(parser, multi_dataset=True)
+    parser.add_argument("--embeddings", type=str, default=EMBEDDINGS_PATH, help="文档嵌入 .npy 文件")
+    parser.add_argument("--corpus", type=str, default=WIKI_DATA_PATH, help="语料库JSON")
+    parser.add_argument("--nlist", type=int, default=256, help="聚类数 (默认: 256)")
+    parser.add_argument("--niter", type=int, default=20, help="k-means迭代次数 (默认: 20)")
+    parser.add_argument("--seed", type=int, default=1234, help="k-means随机种子 (默认: 1234)")
+    parser.add_argument("--out_dir", type=str, default=DEFAULT_OUT_DIR, help="新布局输出目录")
+    parser.add_argument("--sample", type=int, default=1000, help="每个数据集用于基准测试的查询数 (默认: 1000)")
+    parser.add_argument("--cache_mb", type=float, nargs="+", default=[16, 64], help="页缓存大小（MB）")
+    parser.add_argument("--llc_mb", type=float, nargs="+", default=[1, 8, 32], help="CPU缓存大小（MB）")
+    parser.add_argument("--tlb_entries", type=int, default=1536, help="TLB条目数（4KB页，默认: 1536）")
+    args = parser.parse_args()
+
+    topk = args.topk
+    print(f"加载索引 {args.index}...")
+    index = faiss.read_index(args.index)
+    if os.path.exists(args.embeddings):
+        vectors = np.load(args.embeddings, mmap_mode="r")
+        header_bytes = int(vectors.offset)
+    else:
+        print(f"未找到嵌入文件 {args.embeddings}，从索引重建向量")
+        vectors = index.reconstruct_n(0, index.ntotal)
+        header_bytes = NPY_HEADER_BYTES
+    texts = None
+    if os.path.exists(args.corpus):
+        with open(args.corpus, "r", encoding="utf-8") as f:
+            texts = json.load(f)["text"]
+    doc_sizes = load_doc_sizes(index.ntotal, args.corpus)
+
+    doc_freq = np.zeros(index.ntotal, dtype=np.int64)
+    retrievals = {}
+    for dataset_name in args.datasets:
+        query_embs, _, indices = load_or_search(args.index, dataset_name, topk, index)
+        flat = np.asarray(indices).ravel()
+        doc_freq += np.bincount(flat[flat >= 0], minlength=index.ntotal)
+        retrievals[dataset_name] = (query_embs, indices)
+
+    print(f"k-means 聚类 ({args.nlist} 个簇)...")
+    assign = kmeans_assign(vectors, args.nlist, args.niter, args.seed)
+    order, cluster_freq = hot_cluster_order(assign, doc_freq)
+    new_index = permute_hnsw(index, order)
+    write_layout(args.out_dir, order, assign, vectors, texts, new_index, os.path.basename(args.embeddings),
+                 os.path.basename(args.corpus), os.path.basename(args.index))
+
+    results = {}
+    for dataset_name, (query_embs, indices) in retrievals.items():
+        print(f"基准测试 {dataset_name}...")
+        results[dataset_name] = benchmark_layout(index, new_index, order, query_embs[:args.sample], indices, topk,
+                                                 doc_sizes, header_bytes, args.cache_mb, args.llc_mb,
+                                                 args.tlb_entries)
+
+    report_path = f"cluster_layout_benchmark_top{topk}.txt"
+    write_benchmark_report(report_path, topk, args.nlist, cluster_freq, results)
+    with open(f"cluster_layout_benchmark_top{topk}.json", "w", encoding="utf-8") as f:
+        json.dump({"args": vars(args), "results": results}, f, ensure_ascii=False, indent=2)
+    print(f"布局对比结果保存到 {report_path}")
+
+
+if __name__ == "__main__":
+    main()
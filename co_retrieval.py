@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+文档共同检索矩阵
+统计"文档A和文档B出现在同一个查询的top-k中"的次数（不要求相邻，不区分先后），
+按行块向量化生成每个列表内的全部文档对，聚合为对称的CSR稀疏矩阵（32位计数）:
+- indptr[a]:indptr[a+1] 为文档a的共同检索邻居，indices 为邻居ID（行内升序），data 为共同检索次数
+- 分区模式: 按文档ID区间把文档对溢写到磁盘，逐区聚合后写入mmap文件，内存只与单个分区相关
+
+用于预取和数据共置（co-location）决策
+
+用法:
+    python co_retrieval.py --dataset nq --topk 10
+    python co_retrieval.py --dataset nq --topk 32 --partitions 16   # 内存受限模式
+"""
+
+import os
+import glob
+import shutil
+import argparse
+import numpy as np
+import faiss
+
+from retrieval_store import add_retrieval_args, prepare_retrieval, iter_retrieval_chunks
+from ngram_stats import reduce_counts
+
+CO_RETRIEVAL_DIR = "co_retrieval_cache"
+NUM_TOP_PAIRS = 20
+
+
+def pair_keys(chunk, id_bound):
+    """
+    生成行块内每个列表的全部文档对，返回对称存储的键 row * id_bound + col（两个方向各一个），
+    跳过faiss的-1填充位和自身对
+    """
+    chunk = np.asarray(chunk, dtype=np.int64)
+    first, second = np.triu_indices(chunk.shape[1], 1)
+    a = chunk[:, first].ravel()
+    b = chunk[:, second].ravel()
+    valid = (a >= 0) & (b >= 0) & (a != b)
+    a, b = a[valid], b[valid]
+    return np.concatenate((a * id_bound + b, b * id_bound + a))
+
+
+class CoRetrievalMatrix:
+    """对称CSR共同检索矩阵（data为uint32计数）"""
+
+    def __init__(self, indptr, indices, data, doc_freq):
+        self.indptr = indptr
+        self.indices = indices
+        self.data = data
+        self.doc_freq = doc_freq
+
+    @property
+    def num_docs(self):
+        return len(self.indptr) - 1
+
+    @property
+    def nnz(self):
+        return int(self.indptr[-1])
+
+    @property
+    def num_pairs(self):
+        """不同文档对数（对称存储的一半）"""
+        return self.nnz // 2
+
+    def nbytes(self):
+        return int(self.indptr.nbytes + self.indices.nbytes + self.data.nbytes)
+
+    def neighbors(self, doc, num=10):
+        """文档的共同检索邻居，按次数降序返回 (邻居ID, 次数)"""
+        start, end = int(self.indptr[doc]), int(self.indptr[doc + 1])
+        cols = np.asarray(self.indices[start:end])
+        counts = np.asarray(self.data[start:end])
+        order = np.argsort(-counts.astype(np.int64), kind="stable")[:num]
+        return cols[order], counts[order]
+
+    def pair_count(self, a, b):
+        """文档对 (a, b) 的共同检索次数"""
+        start, end = int(self.indptr[a]), int(self.indptr[a + 1])
+        pos = start + int(np.searchsorted(self.indices[start:end], b))
+        return int(self.data[pos]) if pos < end and self.indices[pos] == b else 0
+
+    def top_pairs(self, num=NUM_TOP_PAIRS):
+        """共同检索次数最多的文档对 [(a, b, 次数), ...]（a < b）"""
+        rows = np.repeat(np.arange(self.num_docs, dtype=np.int64), np.diff(self.indptr))
+        upper = np.flatnonzero(np.asarray(self.indices) > rows)
+        counts = np.asarray(self.data)[upper].astype(np.int64)
+        candidates = np.arange(len(counts))
+        if len(counts) > num:
+            # 同次数的文档对按 (a, b) 升序取，保证结果确定
+            threshold = np.partition(counts, len(counts) - num)[len(counts) - num]
+            above = np.flatnonzero(counts > threshold)
+            candidates = np.concatenate((above, np.flatnonzero(counts == threshold)[:num - len(above)]))
+        candidates = candidates[np.lexsort((candidates, -counts[candidates]))]
+        return [(int(rows[upper[i]]), int(self.indices[upper[i]]), int(counts[i])) for i in candidates]
+
+    def save(self, out_dir):
+        """保存为 indptr/indices/data/doc_freq 四个.npy文件"""
+        os.makedirs(out_dir, exist_ok=True)
+        for name in ("indptr", "indices", "data", "doc_freq"):
+            array = getattr(self, name)
+            path = os.path.join(out_dir, f"{name}.npy")
+            if isinstance(array, np.memmap) and os.path.abspath(array.filename) == os.path.abspath(path):
+                array.flush()
+            else:
+                np.save(path, array)
+
+    @classmethod
+    def load(cls, out_dir, mmap_mode="r"):
+        arrays = [np.load(os.path.join(out_dir, f"{name}.npy"), mmap_mode=mmap_mode)
+                  for name in ("indptr", "indices", "data", "doc_freq")]
+        return cls(*arrays)
+
+
+def _to_csr(keys, counts, id_bound):
+    """把（已排序去重的）键拆成行号、列（int32）和计数（uint32）"""
+    rows = keys // id_bound
+    cols = (keys % id_bound).astype(np.int32)
+    return rows, cols, counts.astype(np.uint32)
+
+
+def _build_in_memory(chunks, id_bound, doc_freq):
+    """所有文档对在内存中聚合"""
+    keys = np.empty(0, dtype=np.int64)
+    counts = np.empty(0, dtype=np.int64)
+    pending_keys, pending_counts, pending_size = [], [], 0
+    for chunk in chunks:
+        doc_freq += np.bincount(np.asarray(chunk).ravel() + 1, minlength=id_bound + 1)[1:]
+        chunk_keys, chunk_counts = np.unique(pair_keys(chunk, id_bound), return_counts=True)
+        pending_keys.append(chunk_keys)
+        pending_counts.append(chunk_counts)
+        pending_size += len(chunk_keys)
+        # 待合并部分超过已聚合部分时再合并，摊还合并开销
+        if pending_size > max(len(keys), 1 << 20):
+            keys, counts = reduce_counts(np.concatenate([keys] + pending_keys),
+                                         np.concatenate([counts] + pending_counts))
+            pending_keys, pending_counts, pending_size = [], [], 0
+    if pending_keys:
+        keys, counts = reduce_counts(np.concatenate([keys] + pending_keys), np.concatenate([counts] + pending_counts))
+    rows, cols, data = _to_csr(keys, counts, id_bound)
+    indptr = np.zeros(id_bound + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=id_bound), out=indptr[1:])
+    return CoRetrievalMatrix(indptr, cols, data, doc_freq)
+
+
+def _build_partitioned(chunks, id_bound, doc_freq, num_partitions, out_dir, log=print):
+    """
+    内存受限模式: 每个行块的文档对按行（文档ID区间）分区溢写到磁盘，
+    再逐个分区聚合并顺序写入mmap的CSR数组
+    """
+    spill_dir = os.path.join(out_dir, "spill")
+    os.makedirs(spill_dir, exist_ok=True)
+    rows_per_part = -(-id_bound // num_partitions)
+    for chunk_id, chunk in enumerate(chunks):
+        doc_freq += np.bincount(np.asarray(chunk).ravel() + 1, minlength=id_bound + 1)[1:]
+        keys, counts = np.unique(pair_keys(chunk, id_bound), return_counts=True)
+        # 键已排序，按行区间切分即可
+        bounds = np.searchsorted(keys, np.arange(1, num_partitions) * rows_per_part * id_bound)
+        for part, (key_part, count_part) in enumerate(zip(np.split(keys, bounds), np.split(counts, bounds))):
+            if len(key_part):
+                np.save(os.path.join(spill_dir, f"keys_{part:04d}_{chunk_id:06d}.npy"), key_part)
+                np.save(os.path.join(spill_dir, f"counts_{part:04d}_{chunk_id:06d}.npy"), count_part)
+
+    row_counts = np.zeros(id_bound, dtype=np.int64)
+    part_sizes = []
+    for part in range(num_partitions):
+        key_files = sorted(glob.glob(os.path.join(spill_dir, f"keys_{part:04d}_*.npy")))
+        count_files = sorted(glob.glob(os.path.join(spill_dir, f"counts_{part:04d}_*.npy")))
+        if key_files:
+            keys, counts = reduce_counts(np.concatenate([np.load(p) for p in key_files]),
+                                         np.concatenate([np.load(p) for p in count_files]))
+        else:
+            keys, counts = np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+        rows, cols, data = _to_csr(keys, counts, id_bound)
+        row_counts += np.bincount(rows, minlength=id_bound)
+        np.save(os.path.join(spill_dir, f"cols_{part:04d}.npy"), cols)
+        np.save(os.path.join(spill_dir, f"data_{part:04d}.npy"), data)
+        for path in key_files + count_files:
+            os.remove(path)
+        part_sizes.append(len(cols))
+        log(f"  分区 {part + 1}/{num_partitions}: {len(cols)} 个非零元")
+
+    indptr = np.zeros(id_bound + 1, dtype=np.int64)
+    np.cumsum(row_counts, out=indptr[1:])
+    nnz = int(indptr[-1])
+    indices = np.lib.format.open_memmap(os.path.join(out_dir, "indices.npy"), mode="w+", dtype=np.int32, shape=(nnz,))
+    data = np.lib.format.open_memmap(os.path.join(out_dir, "data.npy"), mode="w+", dtype=np.uint32, shape=(nnz,))
+    offset = 0
+    for part, size in enumerate(part_sizes):
+        indices[offset:offset + size] = np.load(os.path.join(spill_dir, f"cols_{part:04d}.npy"))
+        data[offset:offset + size] = np.load(os.path.join(spill_dir, f"data_{part:04d}.npy"))
+        offset += size
+    shutil.rmtree(spill_dir)
+    return CoRetrievalMatrix(indptr, indices, data, doc_freq)
+
+
+def build_co_retrieval(chunks, id_bound, num_partitions=1, out_dir=None, log=print):
+    """
+    从检索结果行块流构建共同检索矩阵
+    num_partitions > 1 时启用内存受限模式（需要 out_dir 存放溢写文件和最终的mmap数组）
+    """
+    doc_freq = np.zeros(id_bound, dtype=np.int64)
+    if num_partitions <= 1:
+        return _build_in_memory(chunks, id_bound, doc_freq)
+    if out_dir is None:
+        raise ValueError("内存受限模式需要指定 out_dir")
+    return _build_partitioned(chunks, id_bound, doc_freq, num_partitions, out_dir, log)
+
+
+def write_co_retrieval_stats(path, dataset_name, topk, matrix, num_top=NUM_TOP_PAIRS, num_hot=10):
+    """保存热门文档对和热门文档的共同检索邻居（含条件概率 P(B|A) = 共同次数 / A的检索次数）"""
+    lines = [f"共同检索统计 - {dataset_name.upper()} Top-{topk}",
+             f"不同文档对数: {matrix.num_pairs}, CSR非零元: {matrix.nnz}, 占用 {matrix.nbytes() / 1024 ** 2:.2f} MB",
+             f"\n共同检索次数 Top-{num_top} 文档对:"]
+    for rank, (a, b, count) in enumerate(matrix.top_pairs(num_top), 1):
+        lines.append(f"Rank {rank}: Doc {a} & Doc {b} - {count} 次")
+    lines.append(f"\n检索频率 Top-{num_hot} 文档的共同检索邻居:")
+    doc_freq = np.asarray(matrix.doc_freq)
+    for doc in np.argsort(-doc_freq, kind="stable")[:num_hot]:
+        cols, counts = matrix.neighbors(int(doc), 5)
+        neighbors = ", ".join(f"{c}({n}次, {n / doc_freq[doc] * 100:.1f}%)" for c, n in zip(cols, counts))
+        lines.append(f"Doc {doc} (检索 {doc_freq[doc]} 次): {neighbors}")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("\n".join(lines) + "\n")
+    for line in lines:
+        print(line)
+
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description="文档共同检索矩阵")
+    add_retrieval_args(parser)
+    parser.add_argument("--partitions", type=int, default=1,
+                        help="按文档ID区间分区数，>1 时启用内存受限模式 (默认: 1，全部在内存中)")
+    parser.add_argument("--num_top", type=int, default=NUM_TOP_PAIRS, help="输出的热门文档对数 (默认: 20)")
+    args = parser.parse_args()
+
+    dataset_name = args.dataset.lower()
+    topk = args.topk
+    print(f"加载索引 {args.index}...")
+    index = faiss.read_index(args.index)
+    store_dir, _ = prepare_retrieval(args.index, dataset_name, topk, index)
+
+    out_dir = os.path.join(CO_RETRIEVAL_DIR, f"{os.path.basename(store_dir)}_top{topk}")
+    print(f"构建共同检索矩阵 (分区数 {args.partitions})...")
+    matrix = build_co_retrieval(iter_retrieval_chunks(store_dir, topk), index.ntotal,
+                                num_partitions=args.partitions, out_dir=out_dir)
+    matrix.save(out_dir)
+    print(f"共同检索矩阵保存到 {out_dir}")
+
+    stats_path = f"co_retrieval_stats_{dataset_name}_top{topk}.txt"
+    write_co_retrieval_stats(stats_path, dataset_name, topk, matrix, args.num_top)
+    print(f"共同检索统计保存到 {stats_path}")
+
+
+if __name__ == "__main__":
+    main()
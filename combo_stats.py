@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+向量化文章组合统计
+每个查询的 top-k 结果视为一个组合:
+- 有序组合: 整行按检索顺序作为键（定长字节键，等价于 tuple(row)）
+- 无序组合: 行内排序、去重后作为键（等价于 frozenset(row)）
+键是整行的定长字节视图，排序+游程计数得到精确频率，不依赖哈希，因此没有碰撞；
+支持按行分块流式统计，并能还原出热门组合对应的文档ID
+
+用法:
+    from combo_stats import combo_frequency_table, top_combos
+    keys, freqs, total = combo_frequency_table(indices, ordered=False)
+"""
+
+import numpy as np
+
+DEFAULT_CHUNK_ROWS = 262144
+PAD_ID = np.iinfo(np.int32).max  # 无序组合中被去掉的重复元素用该值占位（排在行尾）
+
+
+def _row_keys(rows):
+    """把 (m, k) 的int32矩阵每行视为一个定长字节键"""
+    rows = np.ascontiguousarray(rows, dtype=np.int32)
+    return rows.view(np.dtype((np.void, rows.dtype.itemsize * rows.shape[1]))).ravel()
+
+
+def ordered_keys(indices):
+    """有序组合键: 保留检索顺序"""
+    return _row_keys(indices)
+
+
+def unordered_keys(indices):
+    """无序组合键: 行内排序，重复元素（如多个-1填充）替换为 PAD_ID 后再排序，与 frozenset 语义一致"""
+    rows = np.sort(np.asarray(indices, dtype=np.int32), axis=1)
+    if rows.shape[1] > 1:
+        duplicate = np.zeros(rows.shape, dtype=bool)
+        duplicate[:, 1:] = rows[:, 1:] == rows[:, :-1]
+        if duplicate.any():
+            rows[duplicate] = PAD_ID
+            rows.sort(axis=1)
+    return _row_keys(rows)
+
+
+def decode_combo(key, k, ordered=True):
+    """把组合键还原为文档ID元组（无序组合去掉占位元素）"""
+    row = np.frombuffer(key.tobytes(), dtype=np.int32, count=k)
+    if not ordered:
+        row = row[row != PAD_ID]
+    return tuple(int(d) for d in row)
+
+
+def _reduce(keys, counts, first_seen):
+    """按键排序合并: 计数累加，首次出现位置取最小"""
+    order = np.argsort(keys, kind="stable")
+    sorted_keys = keys[order]
+    starts = np.concatenate(([0], np.flatnonzero(sorted_keys[1:] != sorted_keys[:-1]) + 1))
+    return (sorted_keys[starts], np.add.reduceat(counts[order], starts),
+            np.minimum.reduceat(first_seen[order], starts))
+
+
+def count_combos_chunks(chunks, ordered=True):
+    """
+    流式统计组合频率: chunks 为检索结果矩阵的行块（如 retrieval_store.iter_retrieval_chunks 的输出）
+    返回 (keys, counts, first_seen, total)，first_seen 为每个组合首次出现的查询序号
+    """
+    make_keys = ordered_keys if ordered else unordered_keys
+    keys = counts = first_seen = None
+    total = 0
+    for chunk in chunks:
+        if len(chunk) == 0:
+            continue
+        chunk_keys, chunk_first, chunk_counts = np.unique(make_keys(chunk), return_index=True, return_counts=True)
+        chunk_first = chunk_first.astype(np.int64) + total
+        total += len(chunk)
+        if keys is None:
+            keys, counts, first_seen = chunk_keys, chunk_counts.astype(np.int64), chunk_first
+        else:
+            keys, counts, first_seen = _reduce(np.concatenate((keys, chunk_keys)),
+                                               np.concatenate((counts, chunk_counts)),
+                                               np.concatenate((first_seen, chunk_first)))
+    if keys is None:
+        return None, np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), 0
+    return keys, counts, first_seen, total
+
+
+def combo_frequency_table(indices, ordered=True, chunk_rows=DEFAULT_CHUNK_ROWS):
+    """
+    统计组合频率，返回 (keys, freqs, total)
+    按频率降序排列，同频按首次出现顺序（与 Counter 插入顺序+稳定排序一致）；total 为查询数
+    """
+    indices = np.asarray(indices)
+    chunks = (indices[start:start + chunk_rows] for start in range(0, len(indices), chunk_rows))
+    keys, counts, first_seen, total = count_combos_chunks(chunks, ordered)
+    if keys is None:
+        return keys, counts, total
+    order = np.lexsort((first_seen, -counts))
+    return keys[order], counts[order], total
+
+
+def top_combos(keys, freqs, k, ordered=True, num=10):
+    """前 num 个热门组合，返回 [(文档ID元组, 次数), ...]"""
+    if keys is None:
+        return []
+    return [(decode_combo(key, k, ordered), int(freq)) for key, freq in zip(keys[:num], freqs[:num])]
+
+
+def write_top_combos(path, combos, title):
+    """保存热门组合及其文档ID"""
+    with open(path, "w") as f:
+        f.write(title + "\n")
+        for rank, (doc_ids, freq) in enumerate(combos, 1):
+            f.write(f"Rank {rank}: {freq} 次 - Docs {list(doc_ids)}\n")
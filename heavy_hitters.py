@@ -0,0 +1,358 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+流式热点草图（文档 / 相邻n-gram / 组合）
+精确计数的内存随不同对象数增长，k较大时组合和n-gram数量会爆炸。这里按行块流式处理检索结果:
+- Misra-Gries（可合并版本，等价于Space-Saving）用固定数量的计数器保留热门对象，
+  估计值为下界，误差不超过 (N - 计数器总和) / (capacity + 1)
+- Count-Min 用 depth x width 的计数表给出任意对象的点估计，为上界，
+  以概率 1 - delta 误差不超过 eps * N
+
+脚本模式在保存的检索结果上逐块构建草图，并与精确计数对比，验证误差界
+
+用法:
+    python heavy_hitters.py --dataset nq --topk 10 --capacity 2000 --eps 1e-4 --delta 0.01
+"""
+
+import math
+import argparse
+import numpy as np
+import faiss
+
+from retrieval_store import add_retrieval_args, prepare_retrieval, iter_retrieval_chunks
+from hotness_stats import doc_frequency_table
+from ngram_stats import key_width, sliding_windows, pack_ngrams, unpack_ngrams, count_ngrams, reduce_counts
+from combo_stats import ordered_keys, unordered_keys, decode_combo, combo_frequency_table
+
+DEFAULT_CAPACITY = 2000
+DEFAULT_EPS = 1e-4
+DEFAULT_DELTA = 0.01
+NGRAM_SIZES = [2, 3, 4]
+
+_MIX1 = np.uint64(0xBF58476D1CE4E5B9)
+_MIX2 = np.uint64(0x94D049BB133111EB)
+
+
+def _splitmix64(x):
+    """splitmix64 终结函数，把uint64打散成均匀的64位哈希"""
+    with np.errstate(over="ignore"):
+        x = (x ^ (x >> np.uint64(30))) * _MIX1
+        x = (x ^ (x >> np.uint64(27))) * _MIX2
+        return x ^ (x >> np.uint64(31))
+
+
+def fingerprint(keys):
+    """把整数键或定长字节键映射为uint64指纹（整数键保持单射）"""
+    if keys.dtype.kind in "iu":
+        return keys.astype(np.int64).view(np.uint64)
+    if len(keys) == 0:
+        return np.zeros(0, dtype=np.uint64)
+    words = np.frombuffer(np.ascontiguousarray(keys).tobytes(), dtype=np.uint32).reshape(len(keys), -1)
+    h = np.zeros(len(keys), dtype=np.uint64)
+    with np.errstate(over="ignore"):
+        for j in range(words.shape[1]):
+            h = _splitmix64(h + words[:, j].astype(np.uint64) + np.uint64(j + 1))
+    return h
+
+
+class MisraGries:
+    """
+    可合并的 Misra-Gries 热点摘要，最多保留 capacity 个计数器
+    每批先在批内精确聚合，再与摘要合并；超出容量时所有计数减去第 capacity+1 大的计数
+    """
+
+    def __init__(self, capacity=DEFAULT_CAPACITY):
+        self.capacity = capacity
+        self.keys = None
+        self.counts = np.empty(0, dtype=np.int64)
+        self.total = 0
+
+    def update(self, keys, counts=None):
+        """加入一批对象（counts 为空时每个对象计1次）"""
+        if len(keys) == 0:
+            return
+        if counts is None:
+            keys, counts = np.unique(keys, return_counts=True)
+        counts = counts.astype(np.int64)
+        self.total += int(counts.sum())
+        if self.keys is not None:
+            keys, counts = reduce_counts(np.concatenate((self.keys, keys)), np.concatenate((self.counts, counts)))
+        if len(keys) > self.capacity:
+            threshold = np.partition(counts, len(counts) - self.capacity - 1)[len(counts) - self.capacity - 1]
+            counts = counts - threshold
+            keep = counts > 0
+            keys, counts = keys[keep], counts[keep]
+        self.keys, self.counts = keys, counts
+
+    @property
+    def error_bound(self):
+        """估计值与真实值之差的上界"""
+        return (self.total - int(self.counts.sum())) / (self.capacity + 1)
+
+    def top(self, num=None):
+        """按估计计数降序返回 (keys, counts)；所有计数器都被减为0时返回空数组"""
+        if self.keys is None:
+            return None, self.counts
+        order = np.argsort(-self.counts, kind="stable")[:num]
+        return self.keys[order], self.counts[order]
+
+    def estimate(self, keys):
+        """查询一组键的估计计数（不在摘要中的为0）"""
+        if self.keys is None or len(self.keys) == 0 or len(keys) == 0:
+            return np.zeros(len(keys), dtype=np.int64)
+        pos = np.clip(np.searchsorted(self.keys, keys), 0, len(self.keys) - 1)
+        found = self.keys[pos] == keys
+        return np.where(found, self.counts[pos], 0)
+
+    def nbytes(self):
+        """摘要占用的字节数"""
+        return 0 if self.keys is None else int(self.keys.nbytes + self.counts.nbytes)
+
+
+class CountMinSketch:
+    """Count-Min 草图: width = 2^ceil(log2(e/eps))，depth = ceil(ln(1/delta))"""
+
+    def __init__(self, eps=DEFAULT_EPS, delta=DEFAULT_DELTA, seed=0):
+        self.eps = eps
+        self.delta = delta
+        self.log_width = max(1, math.ceil(math.log2(math.e / eps)))
+        self.width = 1 << self.log_width
+        self.depth = max(1, math.ceil(math.log(1 / delta)))
+        rng = np.random.default_rng(seed)
+        self.seeds = rng.integers(1, 2 ** 63, size=self.depth, dtype=np.int64).view(np.uint64) | np.uint64(1)
+        self.table = np.zeros((self.depth, self.width), dtype=np.int64)
+        self.total = 0
+
+    def _buckets(self, fingerprints, row):
+        with np.errstate(over="ignore"):
+            return (_splitmix64(fingerprints ^ self.seeds[row]) >> np.uint64(64 - self.log_width)).astype(np.int64)
+
+    def update(self, fingerprints, counts=None):
+        """加入一批指纹（counts 为空时每个计1次）"""
+        if len(fingerprints) == 0:
+            return
+        weights = None if counts is None else counts.astype(np.float64)
+        self.total += len(fingerprints) if counts is None else int(counts.sum())
+        for row in range(self.depth):
+            self.table[row] += np.bincount(self._buckets(fingerprints, row), weights=weights,
+                                           minlength=self.width).astype(np.int64)
+
+    def query(self, fingerprints):
+        """点估计（上界）"""
+        estimates = np.full(len(fingerprints), np.iinfo(np.int64).max, dtype=np.int64)
+        for row in range(self.depth):
+            estimates = np.minimum(estimates, self.table[row][self._buckets(fingerprints, row)])
+        return estimates
+
+    @property
+    def error_bound(self):
+        """以概率 1 - delta 成立的误差上界 eps * N"""
+        return self.eps * self.total
+
+    def nbytes(self):
+        return int(self.table.nbytes)
+
+
+class StreamSketch:
+    """
+    对某一类对象（doc / ngram / ordered / unordered）同时维护 Misra-Gries 和 Count-Min，
+    逐块消费检索结果矩阵的行块
+    """
+
+    def __init__(self, kind, id_bound, n=None, capacity=DEFAULT_CAPACITY, eps=DEFAULT_EPS,
+                 delta=DEFAULT_DELTA, seed=0):
+        self.kind = kind
+        self.n = n
+        self.width = key_width(id_bound)
+        self.k = None
+        self.heavy = MisraGries(capacity)
+        self.cms = CountMinSketch(eps, delta, seed)
+
+    @property
+    def name(self):
+        return f"{self.n}-gram" if self.kind == "ngram" else self.kind
+
+    def extract_keys(self, chunk):
+        """从行块中取出该类对象的键"""
+        chunk = np.asarray(chunk)
+        self.k = chunk.shape[1]
+        if self.kind == "doc":
+            return chunk.ravel().astype(np.int64)
+        if self.kind == "ngram":
+            return pack_ngrams(sliding_windows(chunk, self.n), self.width)
+        if self.kind == "ordered":
+            return ordered_keys(chunk)
+        return unordered_keys(chunk)
+
+    def update(self, chunk):
+        keys, counts = np.unique(self.extract_keys(chunk), return_counts=True)
+        self.heavy.update(keys, counts)
+        self.cms.update(fingerprint(keys), counts)
+
+    def decode(self, key):
+        """把键还原为可读的文档ID（元组）"""
+        if self.kind == "doc":
+            return int(key)
+        if self.kind == "ngram":
+            return tuple(int(d) for d in unpack_ngrams(np.array([key]), self.n, self.width)[0])
+        return decode_combo(key, self.k, ordered=self.kind == "ordered")
+
+    def top(self, num=10):
+        """[(对象, MG下界, CM上界), ...]"""
+        keys, counts = self.heavy.top(num)
+        if keys is None or len(keys) == 0:
+            return []
+        upper = self.cms.query(fingerprint(keys))
+        return [(self.decode(key), int(c), int(u)) for key, c, u in zip(keys, counts, upper)]
+
+    def nbytes(self):
+        return self.heavy.nbytes() + self.cms.nbytes()
+
+
+def build_sketches(chunks, id_bound, capacity=DEFAULT_CAPACITY, eps=DEFAULT_EPS, delta=DEFAULT_DELTA,
+                   ngram_sizes=NGRAM_SIZES):
+    """在行块流上一次性构建文档、各n-gram、有序/无序组合的草图"""
+    sketches = [StreamSketch("doc", id_bound, capacity=capacity, eps=eps, delta=delta)]
+    sketches += [StreamSketch("ngram", id_bound, n=n, capacity=capacity, eps=eps, delta=delta) for n in ngram_sizes]
+    sketches += [StreamSketch(kind, id_bound, capacity=capacity, eps=eps, delta=delta)
+                 for kind in ("ordered", "unordered")]
+    for chunk in chunks:
+        for sketch in sketches:
+            sketch.update(chunk)
+    return sketches
+
+
+def exact_counts(sketch, indices, id_bound):
+    """与草图同一键格式的精确计数 (keys, counts)，按频率降序"""
+    if sketch.kind == "doc":
+        keys, counts, _ = doc_frequency_table(indices)
+        return keys, counts
+    if sketch.kind == "ngram":
+        keys, counts, _ = count_ngrams(indices, sketch.n, id_bound)
+        order = np.argsort(-counts, kind="stable")
+        return keys[order], counts[order]
+    keys, counts, _ = combo_frequency_table(indices, ordered=sketch.kind == "ordered")
+    return keys, counts
+
+
+def validate_sketch(sketch, exact_keys, exact_freqs, num_top=100):
+    """对比草图与精确计数: 热门召回率、Misra-Gries/Count-Min 误差及其理论界"""
+    num_top = min(num_top, len(exact_keys))
+    sketch_keys, _ = sketch.heavy.top(num_top)
+    true_top = {bytes(np.asarray(k).tobytes()) for k in exact_keys[:num_top]}
+    found = {bytes(np.asarray(k).tobytes()) for k in sketch_keys} if sketch_keys is not None else set()
+    mg_estimates = sketch.heavy.estimate(exact_keys[:num_top])
+    mg_errors = exact_freqs[:num_top] - mg_estimates
+    cms_errors = sketch.cms.query(fingerprint(exact_keys)) - exact_freqs
+    return {
+        "num_distinct": len(exact_keys),
+        "total": sketch.heavy.total,
+        "recall": len(true_top & found) / num_top if num_top else 1.0,
+        "mg_max_error": int(mg_errors.max()) if num_top else 0,
+        "mg_bound": sketch.heavy.error_bound,
+        "mg_violations": int(np.count_nonzero((mg_errors > sketch.heavy.error_bound) | (mg_errors < 0))),
+        "cms_max_error": int(cms_errors.max()) if len(cms_errors) else 0,
+        "cms_mean_error": float(cms_errors.mean()) if len(cms_errors) else 0.0,
+        "cms_bound": sketch.cms.error_bound,
+        "cms_within_bound": float(np.mean(cms_errors <= sketch.cms.error_bound)) if len(cms_errors) else 1.0,
+        "cms_negative": int(np.count_nonzero(cms_errors < 0)),
+        "sketch_bytes": sketch.nbytes(),
+        "exact_bytes": int(exact_keys.nbytes + exact_freqs.nbytes)
+    }
+
+
+def synthetic_retrievals(num_queries=3000, topk=10, num_docs=5000, zipf_s=1.0, seed=0):
+    """Zipf热度的合成检索结果（每行文档不重复），用于自检"""
+    rng = np.random.default_rng(seed)
+    weights = 1.0 / np.arange(1, num_docs + 1) ** zipf_s
+    weights /= weights.sum()
+    return np.array([rng.choice(num_docs, topk, replace=False, p=weights) for _ in range(num_queries)])
+
+
+def self_check(capacity=DEFAULT_CAPACITY, eps=DEFAULT_EPS, delta=DEFAULT_DELTA, chunk_size=500, num_top=100):
+    """
+    在不同对象数远多于 capacity 的合成检索结果上构建草图并与精确计数对比:
+    组合几乎都只出现一次，摘要会出现所有计数同时减为0的情况。
+    要求 Misra-Gries 不越界、Count-Min 不低估，返回 [(草图, 对比结果), ...]
+    """
+    indices = synthetic_retrievals()
+    id_bound = int(indices.max()) + 1
+    chunks = (indices[start:start + chunk_size] for start in range(0, len(indices), chunk_size))
+    sketches = build_sketches(chunks, id_bound, capacity, eps, delta)
+    results = []
+    for sketch in sketches:
+        exact_keys, exact_freqs = exact_counts(sketch, indices, id_bound)
+        r = validate_sketch(sketch, exact_keys, exact_freqs, num_top)
+        assert r["mg_violations"] == 0, f"{sketch.name}: Misra-Gries 估计超出误差界"
+        assert r["cms_negative"] == 0, f"{sketch.name}: Count-Min 出现低估"
+        sketch.top(5)
+        results.append((sketch, r))
+    assert any(r["num_distinct"] > capacity for _, r in results), "合成数据的不同对象数未超过容量"
+    return results
+
+
+def write_report(path, dataset_name, topk, sketches, results, num_top, delta):
+    """保存草图对比结果"""
+    lines = [f"流式热点草图验证 - {dataset_name.upper()} Top-{topk}",
+             f"(Misra-Gries 计数器 {sketches[0].heavy.capacity} 个; Count-Min {sketches[0].cms.depth} x "
+             f"{sketches[0].cms.width}, eps={sketches[0].cms.eps}, delta={delta})"]
+    for sketch, r in zip(sketches, results):
+        lines.append(f"\n[{sketch.name}] 总次数 {r['total']}, 不同对象 {r['num_distinct']}")
+        lines.append(f"  Top-{num_top} 召回率: {r['recall'] * 100:.2f}%")
+        lines.append(f"  Misra-Gries 最大低估 {r['mg_max_error']} (误差界 {r['mg_bound']:.1f}, 越界 {r['mg_violations']} 个)")
+        lines.append(f"  Count-Min 最大高估 {r['cms_max_error']}, 平均高估 {r['cms_mean_error']:.3f} "
+                     f"(误差界 {r['cms_bound']:.1f}, 界内比例 {r['cms_within_bound'] * 100:.2f}%, 低估 {r['cms_negative']} 个)")
+        lines.append(f"  内存: 草图 {r['sketch_bytes'] / 1024:.1f} KB, 精确计数 {r['exact_bytes'] / 1024:.1f} KB")
+        for rank, (item, lower, upper) in enumerate(sketch.top(5), 1):
+            lines.append(f"  Rank {rank}: {item} - 估计 {lower}~{upper} 次")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("\n".join(lines) + "\n")
+    for line in lines:
+        print(line)
+
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description="流式热点草图（文档/n-gram/组合）")
+    add_retrieval_args(parser)
+    parser.add_argument("--capacity", type=int, default=DEFAULT_CAPACITY, help="Misra-Gries 计数器数量 (默认: 2000)")
+    parser.add_argument("--eps", type=float, default=DEFAULT_EPS, help="Count-Min 相对误差 eps (默认: 1e-4)")
+    parser.add_argument("--delta", type=float, default=DEFAULT_DELTA, help="Count-Min 失败概率 delta (默认: 0.01)")
+    parser.add_argument("--num_top", type=int, default=100, help="验证召回率的热门对象数 (默认: 100)")
+    parser.add_argument("--self_check", action="store_true",
+                        help="在不同对象数多于 capacity 的合成数据上对比精确计数后退出（不需要索引）")
+    args = parser.parse_args()
+
+    if args.self_check:
+        for sketch, r in self_check(args.capacity, args.eps, args.delta, num_top=args.num_top):
+            print(f"[{sketch.name}] 不同对象 {r['num_distinct']}, 召回率 {r['recall'] * 100:.2f}%, "
+                  f"MG最大低估 {r['mg_max_error']} (界 {r['mg_bound']:.1f}), CM最大高估 {r['cms_max_error']}")
+        print("自检通过")
+        return
+
+    dataset_name = args.dataset.lower()
+    topk = args.topk
+    print(f"加载索引 {args.index}...")
+    index = faiss.read_index(args.index)
+    store_dir, _ = prepare_retrieval(args.index, dataset_name, topk, index)
+
+    # 草图只看到逐块读取的数据流
+    print("逐块构建草图...")
+    sketches = build_sketches(iter_retrieval_chunks(store_dir, topk), index.ntotal,
+                              args.capacity, args.eps, args.delta)
+
+    # 精确计数仅用于验证
+    print("计算精确计数并对比...")
+    indices = np.concatenate([np.asarray(chunk) for chunk in iter_retrieval_chunks(store_dir, topk)])
+    results = []
+    for sketch in sketches:
+        exact_keys, exact_freqs = exact_counts(sketch, indices, index.ntotal)
+        results.append(validate_sketch(sketch, exact_keys, exact_freqs, args.num_top))
+
+    report_path = f"heavy_hitters_{dataset_name}_top{topk}.txt"
+    write_report(report_path, dataset_name, topk, sketches, results, args.num_top, args.delta)
+    print(f"草图验证结果保存到 {report_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+向量化HNSW图结构统计
+用 faiss.rev_swig_ptr 直接取得 hnsw.levels / offsets / neighbors / cum_nneighbor_per_level 的零拷贝NumPy视图
+（视图不持有索引，索引对象必须在使用期间保持存活），
+再用 np.bincount / cumsum 得到层级直方图、各层节点数、高层节点比例和热门文档的层级分布，
+取代原先对每一层都扫描一遍全部节点的 sum(1 for l in levels if l >= level)
+
+说明: faiss中 levels[i] 为节点i所在的层数（第0层计为1），节点i出现在第 0..levels[i]-1 层。
+统计函数统一使用层下标 layers = levels - 1（node_layers / hnsw_layers），
+节点出现在第 0..layers[i] 层，"高层节点"指 layers >= 1（至少出现在第1层）的节点
+"""
+
+import numpy as np
+import faiss
+
+
+def swig_view(vector):
+    """faiss C++ vector 的零拷贝NumPy视图"""
+    if vector.size() == 0:
+        return np.empty(0, dtype=faiss.vector_to_array(vector).dtype)
+    return faiss.rev_swig_ptr(vector.data(), vector.size())
+
+
+def hnsw_views(index):
+    """
+    HNSW图结构数组的零拷贝视图: (levels, offsets, neighbors, cum_nneighbor_per_level)
+    offsets 以 int64 重新解释（值远小于 2^63），其余保持faiss原始类型
+    """
+    hnsw = index.hnsw
+    levels = swig_view(hnsw.levels)
+    offsets = swig_view(hnsw.offsets).view(np.int64)
+    neighbors = swig_view(hnsw.neighbors)
+    cum_nneighbor_per_level = swig_view(hnsw.cum_nneighbor_per_level)
+    return levels, offsets, neighbors, cum_nneighbor_per_level
+
+
+def node_layers(levels):
+    """faiss原始 levels 转为层下标: 节点所在的最高层（第0层为0）"""
+    return np.asarray(levels, dtype=np.int32) - 1
+
+
+def hnsw_layers(index):
+    """直接从HNSW索引取每个节点的最高层下标，见 node_layers"""
+    return node_layers(hnsw_views(index)[0])
+
+
+def level_histogram(layers, max_level=None):
+    """hist[v] 为最高层下标为 v 的节点数，长度至少为 max_level + 1"""
+    minlength = max_level + 1 if max_level is not None else 0
+    return np.bincount(np.asarray(layers), minlength=minlength)
+
+
+def level_node_counts(layers, max_level):
+    """
+    counts[level] = 出现在第 level 层的节点数，即 layers >= level 的节点数（level 取 0..max_level，
+    max_level 同 hnsw.max_level），由直方图的逆序累加一次得到
+    """
+    hist = level_histogram(layers, max_level)
+    at_or_above = np.cumsum(hist[::-1])[::-1]
+    return at_or_above[:max_level + 1]
+
+
+def high_level_stats(layers):
+    """高层节点（layers >= 1）数及其占全部节点的百分比"""
+    total = len(layers)
+    if total == 0:
+        return 0, 0
+    count = total - int(level_histogram(layers)[0])
+    return count, count / total * 100
+
+
+def hot_level_distribution(layers, doc_ids):
+    """
+    一组（热门）文档的层级分布: 返回 (最高层下标的节点数直方图, 高层节点个数, 占比百分比)
+    """
+    hot_layers = np.asarray(layers)[np.asarray(doc_ids, dtype=np.int64)]
+    if hot_layers.size == 0:
+        return np.zeros(0, dtype=np.int64), 0, 0
+    hist = level_histogram(hot_layers)
+    count = int(hot_layers.size - hist[0])
+    return hist, count, count / hot_layers.size * 100
+
+
+def num_layers(layers):
+    """图的层数: 最高层下标 + 1"""
+    return int(np.max(layers)) + 1 if len(layers) else 0
+
+
+def layer_degrees(layers, offsets, neighbors, cum_nneighbor_per_level, chunk_size=65536):
+    """
+    按层计算每个节点的出度和入度（只计有效邻居，不计 -1 填充位）
+    返回按层的列表 [(nodes, out_degree, in_degree), ...]，第l项对应第l层（从0开始）:
+    nodes 为出现在该层的节点ID（升序，第0层即全部节点，下标就是 doc_id），
+    out_degree / in_degree 为与 nodes 对齐的 int32 数组，高层只保存该层的节点，不为全部 ntotal 分配空间。
+    节点按 chunk_size 分块取出邻居矩阵（邻居矩阵的内存随块大小而非图规模增长），
+    各块的有效邻居收集后每层只做一次 bincount 得到入度，每条边只处理一次
+    """
+    layers = np.asarray(layers)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    cum = np.asarray(cum_nneighbor_per_level, dtype=np.int64)
+    result = []
+    for layer in range(num_layers(layers)):
+        nodes = np.flatnonzero(layers >= layer)
+        out_degree = np.zeros(len(nodes), dtype=np.int32)
+        targets = []
+        slot_range = np.arange(cum[layer], cum[layer + 1], dtype=np.int64)
+        for start in range(0, len(nodes), chunk_size):
+            chunk = nodes[start:start + chunk_size]
+            adj = neighbors[offsets[chunk][:, None] + slot_range]
+            valid = adj >= 0
+            out_degree[start:start + len(chunk)] = valid.sum(axis=1)
+            targets.append(adj[valid])
+        targets = np.concatenate(targets) if targets else np.zeros(0, dtype=np.int64)
+        # 第0层 nodes 即 0..ntotal-1；高层的邻居必在该层，按 nodes 查位置
+        if layer > 0:
+            targets = np.searchsorted(nodes, targets)
+        in_degree = np.bincount(targets, minlength=len(nodes)).astype(np.int32)
+        result.append((nodes, out_degree, in_degree))
+    return result
+
+
+def hnsw_degrees(index, chunk_size=65536):
+    """直接从HNSW索引计算按层出度/入度，见 layer_degrees"""
+    levels, offsets, neighbors, cum_nneighbor_per_level = hnsw_views(index)
+    return layer_degrees(node_layers(levels), offsets, neighbors, cum_nneighbor_per_level, chunk_size)
+
+
+def total_out_degree(layer_stats):
+    """每个节点各层出度之和，按 doc_id 对齐（layer_stats 为 layer_degrees 的返回值）"""
+    if not layer_stats:
+        return np.zeros(0, dtype=np.int64)
+    total = layer_stats[0][1].astype(np.int64)
+    for nodes, out_degree, _ in layer_stats[1:]:
+        total[nodes] += out_degree
+    return total
+
+
+def layer_degree_summary(layer_stats):
+    """每层的节点数、平均出度、最大入度、入度为0的节点数（即该层不可由邻边到达的节点）"""
+    summary = []
+    for layer, (nodes, out_degree, in_degree) in enumerate(layer_stats):
+        count = len(nodes)
+        summary.append({
+            "layer": layer,
+            "nodes": count,
+            "avg_out_degree": float(out_degree.mean()) if count else 0.0,
+            "avg_in_degree": float(in_degree.mean()) if count else 0.0,
+            "max_in_degree": int(in_degree.max()) if count else 0,
+            "zero_in_degree": int(np.count_nonzero(in_degree == 0)),
+        })
+    return summary
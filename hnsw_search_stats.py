@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+HNSW检索过程统计
+通过 faiss.cvar.hnsw_stats 采集检索时的距离计算次数(ndis)和跳数(nhops)，
+按批次或逐查询记录，并按数据集/top-k汇总、按查询结果是否命中热门文档拆分，
+用于判断"热门查询是否也是低开销查询"
+
+说明: faiss每访问一个节点就计算一次距离，因此 ndis 即访问的节点数
+
+用法:
+    python hnsw_search_stats.py --dataset nq --topk 10
+"""
+
+import argparse
+import numpy as np
+import faiss
+
+from retrieval_store import add_retrieval_args, load_or_search
+from hotness_stats import hot_doc_mask  # 与各分析脚本一致: 频率前10%的文档为热门文档
+
+
+def collect_search_stats(index, query_embs, topk, batch_size=256, per_query=True):
+    """
+    检索并采集HNSW统计，返回 (indices, stats)
+    per_query=True 时逐条检索（单线程），得到每个查询的 ndis/nhops；
+    否则按批次检索，只得到每批的合计值
+    """
+    hnsw_stats = faiss.cvar.hnsw_stats
+    query_embs = np.ascontiguousarray(query_embs, dtype=np.float32)
+    nq = query_embs.shape[0]
+    step = 1 if per_query else batch_size
+    num_steps = (nq + step - 1) // step
+    ndis = np.zeros(num_steps, dtype=np.int64)
+    nhops = np.zeros(num_steps, dtype=np.int64)
+    indices = np.empty((nq, topk), dtype=np.int64)
+
+    main_threads = faiss.omp_get_max_threads()
+    if per_query:
+        faiss.omp_set_num_threads(1)  # 单查询无需并行，避免OpenMP调度开销
+    try:
+        for i, start in enumerate(range(0, nq, step)):
+            end = min(start + step, nq)
+            hnsw_stats.reset()
+            _, indices[start:end] = index.search(query_embs[start:end], topk)
+            ndis[i] = hnsw_stats.ndis
+            nhops[i] = hnsw_stats.nhops
+    finally:
+        faiss.omp_set_num_threads(main_threads)
+
+    stats = {"ndis": ndis, "nhops": nhops, "per_query": per_query, "batch_size": step}
+    return indices, stats
+
+
+def summarize(values):
+    """均值和分位数汇总"""
+    if len(values) == 0:
+        return {"count": 0, "mean": 0.0, "p50": 0.0, "p95": 0.0, "p99": 0.0, "max": 0}
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {"count": len(values), "mean": float(np.mean(values)), "p50": p50, "p95": p95, "p99": p99,
+            "max": int(np.max(values))}
+
+
+def hot_breakdown(indices, stats, hot_mask):
+    """按查询结果中热门文档占比，将逐查询统计拆分为 热门查询 / 非热门查询"""
+    valid = indices >= 0
+    hot_fraction = (hot_mask[np.where(valid, indices, 0)] & valid).sum(axis=1) / np.maximum(valid.sum(axis=1), 1)
+    top1_hot = hot_mask[np.maximum(indices[:, 0], 0)] & (indices[:, 0] >= 0)
+    groups = {
+        "top1热门": top1_hot,
+        "top1非热门": ~top1_hot,
+        "多数结果热门(>=50%)": hot_fraction >= 0.5,
+        "多数结果非热门(<50%)": hot_fraction < 0.5
+    }
+    breakdown = {}
+    for name, mask in groups.items():
+        breakdown[name] = {"ndis": summarize(stats["ndis"][mask]), "nhops": summarize(stats["nhops"][mask])}
+    # 热门文档占比与检索开销的相关系数
+    if np.std(hot_fraction) > 0 and np.std(stats["ndis"]) > 0:
+        corr = float(np.corrcoef(hot_fraction, stats["ndis"])[0, 1])
+    else:
+        corr = float("nan")
+    return breakdown, corr
+
+
+def write_search_stats(path, dataset_name, topk, index, stats, breakdown=None, corr=None):
+    """保存统计文本（格式与其他统计输出一致）"""
+    unit = "每查询" if stats["per_query"] else f"每批({stats['batch_size']}个查询)"
+    lines = [f"HNSW检索统计 - {dataset_name.upper()} Top-{topk} (efSearch={index.hnsw.efSearch})"]
+    for key, label in (("ndis", "距离计算次数/访问节点数"), ("nhops", "跳数")):
+        s = summarize(stats[key])
+        lines.append(f"{unit}{label}: 均值 {s['mean']:.2f}, P50 {s['p50']:.1f}, P95 {s['p95']:.1f}, "
+                     f"P99 {s['p99']:.1f}, 最大 {s['max']}")
+    lines.append(f"总距离计算次数: {int(stats['ndis'].sum())}")
+    lines.append(f"总跳数: {int(stats['nhops'].sum())}")
+    if breakdown is not None:
+        lines.append("\n按是否命中热门文档(Top 10%)拆分:")
+        for name, group in breakdown.items():
+            nd, nh = group["ndis"], group["nhops"]
+            lines.append(f"{name}: 查询数 {nd['count']}, 平均距离计算 {nd['mean']:.2f} (P95 {nd['p95']:.1f}), "
+                         f"平均跳数 {nh['mean']:.2f} (P95 {nh['p95']:.1f})")
+        lines.append(f"\n热门文档占比与距离计算次数的相关系数: {corr:.4f}")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("\n".join(lines) + "\n")
+    for line in lines:
+        print(line)
+
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description="HNSW检索过程统计")
+    add_retrieval_args(parser)
+    parser.add_argument("--batch_mode", action="store_true", help="只按批次统计（更快，但无法按查询拆分）")
+    parser.add_argument("--batch_size", type=int, default=256, help="批次模式的批次大小 (默认: 256)")
+    args = parser.parse_args()
+
+    dataset_name = args.dataset.lower()
+    topk = args.topk
+    print(f"加载索引 {args.index}...")
+    index = faiss.read_index(args.index)
+    # 热门文档以保存的检索结果定义，与频率统计脚本保持一致
+    query_embs, _, stored_indices = load_or_search(args.index, dataset_name, topk, index)
+    hot_mask = hot_doc_mask(stored_indices, index.ntotal)
+
+    indices, stats = collect_search_stats(index, query_embs, topk, batch_size=args.batch_size,
+                                          per_query=not args.batch_mode)
+
+    breakdown, corr = (None, None)
+    if stats["per_query"]:
+        breakdown, corr = hot_breakdown(indices, stats, hot_mask)
+    stats_path = f"hnsw_search_stats_{dataset_name}_top{topk}.txt"
+    write_search_stats(stats_path, dataset_name, topk, index, stats, breakdown, corr)
+    np.savez_compressed(f"hnsw_search_stats_{dataset_name}_top{topk}.npz",
+                        ndis=stats["ndis"], nhops=stats["nhops"], per_query=stats["per_query"])
+    print(f"HNSW检索统计保存到 {stats_path}")
+
+
+if __name__ == "__main__":
+    main()
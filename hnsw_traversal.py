@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+HNSW检索路径重放（NumPy实现）
+从已加载的faiss索引读取 hnsw.levels / offsets / neighbors，用NumPy重放检索过程:
+上层贪心下降（对整个查询集向量化）+ 第0层 efSearch 束搜索（逐查询，邻居距离向量化），
+记录每个节点被访问（计算距离）的次数和每层跳数，并与faiss的检索结果核对。
+与只统计返回文档的热度分析不同，这里得到的是检索过程真实的内存访问热度图。
+
+说明: faiss中 levels[i] 为节点i所在的层数（第0层计为1），节点i出现在第 0..levels[i]-1 层
+
+用法:
+    python hnsw_traversal.py --dataset nq --topk 10
+"""
+
+import argparse
+import numpy as np
+import faiss
+
+from retrieval_engine import load_query_embeddings
+from hnsw_graph_stats import hnsw_views
+
+
+class HNSWGraph:
+    """faiss HNSW图结构的NumPy视图"""
+
+    def __init__(self, index, vectors=None):
+        hnsw = index.hnsw
+        self.index = index  # 零拷贝视图不持有索引，保留引用使其存活
+        self.levels, self.offsets, self.neighbors, cum_nneighbor_per_level = hnsw_views(index)
+        self.cum_nneighbor_per_level = cum_nneighbor_per_level.astype(np.int64)
+        self.entry_point = int(hnsw.entry_point)
+        self.max_level = int(hnsw.max_level)
+        self.ef_search = int(hnsw.efSearch)
+        self.check_relative_distance = bool(hnsw.check_relative_distance)
+        self.ntotal = index.ntotal
+        self.vectors = vectors if vectors is not None else index.reconstruct_n(0, index.ntotal)
+
+    def neighbor_slots(self, nodes, level):
+        """返回 nodes 在 level 层的邻居矩阵 (len(nodes), 该层最大邻居数)，-1 表示空位"""
+        begin = self.cum_nneighbor_per_level[level]
+        end = self.cum_nneighbor_per_level[level + 1]
+        slots = self.offsets[nodes][:, None] + np.arange(begin, end)
+        return self.neighbors[slots]
+
+    def neighbors_of(self, node, level):
+        """返回单个节点在 level 层的有效邻居（faiss遇到第一个-1即停止）"""
+        begin = self.offsets[node] + self.cum_nneighbor_per_level[level]
+        end = self.offsets[node] + self.cum_nneighbor_per_level[level + 1]
+        nb = self.neighbors[begin:end]
+        stop = np.flatnonzero(nb < 0)
+        return nb[:stop[0]] if len(stop) else nb
+
+
+def l2_sqr(vectors, query):
+    """查询与一组向量的L2平方距离"""
+    diff = vectors - query
+    return np.einsum("ij,ij->i", diff, diff)
+
+
+def greedy_descent(graph, query_embs, chunk_size=512):
+    """
+    对整个查询集向量化执行上层贪心下降（与faiss greedy_update_nearest语义一致）
+    返回 (第0层入口节点, 入口距离, 每层跳数矩阵 (nq, max_level+1), 每层节点访问计数)
+    """
+    nq = query_embs.shape[0]
+    nearest = np.full(nq, graph.entry_point, dtype=np.int64)
+    d_nearest = np.empty(nq, dtype=np.float32)
+    hops = np.zeros((nq, graph.max_level + 1), dtype=np.int32)
+    visit_counts = {level: np.zeros(graph.ntotal, dtype=np.int64) for level in range(graph.max_level + 1)}
+
+    for start in range(0, nq, chunk_size):
+        q = query_embs[start:start + chunk_size]
+        diff = graph.vectors[graph.entry_point] - q
+        d_nearest[start:start + len(q)] = np.einsum("ij,ij->i", diff, diff)
+    visit_counts[graph.max_level][graph.entry_point] += nq
+
+    for level in range(graph.max_level, 0, -1):
+        active = np.arange(nq)
+        while len(active):
+            changed_list = []
+            for start in range(0, len(active), chunk_size):
+                rows = active[start:start + chunk_size]
+                nb = graph.neighbor_slots(nearest[rows], level)
+                # faiss 遇到第一个 -1 即停止遍历邻居
+                valid = np.cumprod(nb >= 0, axis=1).astype(bool)
+                safe_nb = np.where(valid, nb, 0)
+                diff = graph.vectors[safe_nb] - query_embs[rows][:, None, :]
+                dist = np.einsum("ijk,ijk->ij", diff, diff)
+                dist[~valid] = np.inf
+                np.add.at(visit_counts[level], nb[valid], 1)
+                # 顺序扫描、严格小于才更新，等价于取第一个最小值
+                best = np.argmin(dist, axis=1)
+                best_d = dist[np.arange(len(rows)), best]
+                improve = best_d < d_nearest[rows]
+                improved_rows = rows[improve]
+                nearest[improved_rows] = safe_nb[improve, best[improve]]
+                d_nearest[improved_rows] = best_d[improve]
+                hops[improved_rows, level] += 1
+                changed_list.append(improved_rows)
+            active = np.concatenate(changed_list) if changed_list else np.empty(0, dtype=np.int64)
+    return nearest, d_nearest, hops, visit_counts
+
+
+class _MinimaxHeap:
+    """faiss HNSW::MinimaxHeap 的等价实现：容量ef，弹出的元素保留距离直到被挤出"""
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.dis = []
+        self.ids = []
+        self.nvalid = 0
+
+    def push(self, node, d):
+        if len(self.dis) == self.capacity:
+            imax = max(range(len(self.dis)), key=self.dis.__getitem__)
+            if d >= self.dis[imax]:
+                return
+            if self.ids[imax] != -1:
+                self.nvalid -= 1
+            del self.dis[imax], self.ids[imax]
+        self.dis.append(d)
+        self.ids.append(node)
+        self.nvalid += 1
+
+    def pop_min(self):
+        imin, vmin = -1, np.inf
+        for i, (node, d) in enumerate(zip(self.ids, self.dis)):
+            if node != -1 and (imin == -1 or d < vmin):
+                imin, vmin = i, d
+        node = self.ids[imin]
+        self.ids[imin] = -1
+        self.nvalid -= 1
+        return node, vmin
+
+    def count_below(self, thresh):
+        return sum(1 for d in self.dis if d < thresh)
+
+
+def beam_search_level0(graph, query, entry, d_entry, ef):
+    """第0层束搜索（faiss search_from_candidates），返回 (访问节点数组, 对应距离数组, 扩展步数)"""
+    candidates = _MinimaxHeap(ef)
+    candidates.push(entry, d_entry)
+    visited = {entry}
+    visited_nodes = [np.array([entry])]
+    visited_dis = [np.array([d_entry], dtype=np.float32)]
+    nstep = 0
+    while candidates.nvalid > 0:
+        v0, d0 = candidates.pop_min()
+        if graph.check_relative_distance and candidates.count_below(d0) >= graph.ef_search:
+            break
+        nb = [v for v in graph.neighbors_of(v0, 0).tolist() if v not in visited]
+        if nb:
+            visited.update(nb)
+            nb = np.array(nb)
+            dist = l2_sqr(graph.vectors[nb], query)
+            visited_nodes.append(nb)
+            visited_dis.append(dist)
+            for v, d in zip(nb.tolist(), dist.tolist()):
+                candidates.push(v, d)
+        nstep += 1
+        if not graph.check_relative_distance and nstep > graph.ef_search:
+            break
+    return np.concatenate(visited_nodes), np.concatenate(visited_dis), nstep
+
+
+def traverse(graph, query_embs, topk, record_sequences=False, chunk_size=512):
+    """
+    重放整个查询集的检索过程，返回包含以下内容的字典:
+    indices/distances: 重放得到的top-k结果
+    visit_counts: {层级: 每个节点被访问(计算距离)次数}
+    hops: (nq, max_level+1) 每层跳数（第0层为束搜索扩展步数）
+    ndis_level0: 每个查询在第0层的距离计算次数
+    sequences: 每个查询按访问顺序的节点序列（record_sequences=True时）
+    """
+    query_embs = np.ascontiguousarray(query_embs, dtype=np.float32)
+    nq = query_embs.shape[0]
+    ef = max(graph.ef_search, topk)
+    entries, d_entries, hops, visit_counts = greedy_descent(graph, query_embs, chunk_size=chunk_size)
+
+    indices = np.full((nq, topk), -1, dtype=np.int64)
+    distances = np.full((nq, topk), np.inf, dtype=np.float32)
+    ndis_level0 = np.zeros(nq, dtype=np.int64)
+    level0_visits = []
+    sequences = [] if record_sequences else None
+    for i in range(nq):
+        nodes, dis, nstep = beam_search_level0(graph, query_embs[i], int(entries[i]), float(d_entries[i]), ef)
+        hops[i, 0] = nstep
+        ndis_level0[i] = len(nodes) - 1  # 入口节点的距离在上层已计算
+        order = np.argsort(dis, kind="stable")[:topk]
+        indices[i, :len(order)] = nodes[order]
+        distances[i, :len(order)] = dis[order]
+        level0_visits.append(nodes)
+        if record_sequences:
+            sequences.append(nodes)
+    if level0_visits:
+        visit_counts[0] += np.bincount(np.concatenate(level0_visits), minlength=graph.ntotal)
+    return {"indices": indices, "distances": distances, "visit_counts": visit_counts, "hops": hops,
+            "ndis_level0": ndis_level0, "sequences": sequences}
+
+
+def compare_with_faiss(index, query_embs, topk, result):
+    """与faiss检索结果核对: 完全一致的查询比例、top-k重合率、距离计算总次数"""
+    hnsw_stats = faiss.cvar.hnsw_stats
+    hnsw_stats.reset()
+    _, faiss_indices = index.search(np.ascontiguousarray(query_embs, dtype=np.float32), topk)
+    faiss_ndis = int(hnsw_stats.ndis)
+    replay = result["indices"]
+    exact = float(np.mean(np.all(replay == faiss_indices, axis=1)))
+    overlap = np.mean([len(np.intersect1d(a, b)) / topk for a, b in zip(replay, faiss_indices)])
+    # faiss的ndis不包含入口节点的首次距离计算
+    upper_visits = sum(int(result["visit_counts"][level].sum()) for level in result["visit_counts"] if level > 0)
+    replay_ndis = upper_visits - len(replay) + int(result["ndis_level0"].sum())
+    return {"exact_match_rate": exact, "topk_overlap": float(overlap),
+            "faiss_ndis": faiss_ndis, "replay_ndis": replay_ndis}
+
+
+def visit_concentration(counts, fractions=(0.01, 0.05, 0.1)):
+    """访问最多的前X%节点占总访问次数的比例"""
+    total = counts.sum()
+    ordered = np.sort(counts)[::-1]
+    return {f: (ordered[:max(1, int(f * len(counts)))].sum() / total if total else 0.0) for f in fractions}
+
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description="HNSW检索路径重放与节点访问热度统计")
+    parser.add_argument("--dataset", type=str, default="mmlu", choices=["mmlu", "nq", "hotpotqa", "triviaqa"],
+                        help="选择查询数据集: mmlu, nq, hotpotqa, triviaqa")
+    parser.add_argument("--topk", type=int, default=10, help="检索的top-k值 (默认: 10)")
+    parser.add_argument("--index", type=str, default="hnsw_index_100k.bin", help="faiss索引文件")
+    parser.add_argument("--sample", type=int, default=0, help="只重放前N个查询，0表示全部 (默认: 0)")
+    args = parser.parse_args()
+
+    dataset_name = args.dataset.lower()
+    topk = args.topk
+    print(f"加载索引 {args.index}...")
+    index = faiss.read_index(args.index)
+    graph = HNSWGraph(index)
+    query_embs = load_query_embeddings(dataset_name)
+    if args.sample > 0:
+        query_embs = query_embs[:args.sample]
+
+    print(f"重放 {len(query_embs)} 个查询的HNSW检索过程...")
+    result = traverse(graph, query_embs, topk)
+    check = compare_with_faiss(index, query_embs, topk, result)
+
+    stats_path = f"hnsw_visit_stats_{dataset_name}_top{topk}.txt"
+    lines = [f"HNSW检索路径重放 - {dataset_name.upper()} Top-{topk} "
+             f"(efSearch={graph.ef_search}, 查询数 {len(query_embs)})",
+             f"与faiss结果完全一致的查询比例: {check['exact_match_rate'] * 100:.2f}%",
+             f"与faiss的top-k重合率: {check['topk_overlap'] * 100:.2f}%",
+             f"距离计算总次数: 重放 {check['replay_ndis']}, faiss {check['faiss_ndis']}",
+             "\n每层平均跳数:"]
+    for level in range(graph.max_level, -1, -1):
+        lines.append(f"层级 {level}: {result['hops'][:, level].mean():.2f}")
+    lines.append(f"\n第0层平均距离计算次数: {result['ndis_level0'].mean():.2f}")
+    lines.append("\n每层被访问的节点数及访问集中度:")
+    for level in range(graph.max_level, -1, -1):
+        counts = result["visit_counts"][level]
+        conc = visit_concentration(counts)
+        lines.append(f"层级 {level}: 被访问节点 {int(np.count_nonzero(counts))}, 总访问 {int(counts.sum())}, "
+                     + ", ".join(f"Top {f * 100:g}% 节点占 {share * 100:.2f}%" for f, share in conc.items()))
+    with open(stats_path, "w", encoding="utf-8") as f:
+        f.write("\n".join(lines) + "\n")
+    for line in lines:
+        print(line)
+
+    heatmap_path = f"hnsw_visit_counts_{dataset_name}_top{topk}.npz"
+    np.savez_compressed(heatmap_path, hops=result["hops"], ndis_level0=result["ndis_level0"],
+                        **{f"level{level}": counts for level, counts in result["visit_counts"].items()})
+    print(f"节点访问统计保存到 {stats_path}，访问热度图保存到 {heatmap_path}")
+
+
+if __name__ == "__main__":
+    main()
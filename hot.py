@@ -3,10 +3,12 @@ import os
 import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
-from collections import Counter
 from datasets import load_dataset
 from sentence_transformers import SentenceTransformer
 import faiss
+from retrieval_engine import retrieve
+from retrieval_store import store_path, get_or_create_retrieval
+from hotness_stats import frequency_curve, top_percent_share
 # 配置matplotlib中文字体支持
 plt.rcParams['font.sans-serif'] = ['SimHei', 'Microsoft YaHei', 'DejaVu Sans']
 plt.rcParams['axes.unicode_minus'] = False  # 正确显示负号
@@ -20,6 +22,10 @@ parser.add_argument("--dataset", type=str, default="mmlu", choices=["mmlu", "nq"
                     help="选择查询数据集: mmlu, nq, hotpotqa, triviaqa")
 parser.add_argument("--topk", type=int, default=1,
                     help="检索的top-k值 (默认: 1)")
+parser.add_argument("--batch_size", type=int, default=256,
+                    help="查询编码批次大小 (默认: 256)")
+parser.add_argument("--threads", type=int, default=0,
+                    help="faiss检索线程数，0表示使用默认值 (默认: 0)")
 args = parser.parse_args()
 
 dataset_name = args.dataset.lower()
@@ -113,17 +119,17 @@ else:
 
 queries = [item[query_key] for item in query_dataset]  # 提取查询
 
-# 步骤5: 对于每个查询，进行检索并统计（top-k，但统计频率基于所有检索结果）
-retrieved_docs = []
-for query in queries:
-    query_emb = get_embedding([query])[0]  # 单查询嵌入
-    distances, indices = index.search(np.array([query_emb]), k=topk)  # 检索top-k
-    for idx in indices[0]:  # 对于top-k，每个检索到的文档都计入频率
-        retrieved_docs.append(idx)
+# 步骤5: 对所有查询批量检索并统计（top-k，但统计频率基于所有检索结果）
+# 每个(索引, 数据集)只在最大k下检索一次，之后各top-k直接读取保存的结果矩阵
+distances, indices = get_or_create_retrieval(
+    store_path(INDEX_PATH, dataset_name), topk,
+    lambda k: retrieve(model, index, queries, k,
+                       encode_batch_size=args.batch_size, num_threads=args.threads),  # 批量编码+批量检索
+    num_queries=len(queries), index_ntotal=index.ntotal, index_path=INDEX_PATH, queries=queries)
 
-# 步骤6: 统计频率分布
-doc_freq = Counter(retrieved_docs)
-freq_sorted = sorted(doc_freq.values(), reverse=True)  # 降序频率
+# 步骤6: 统计频率分布（对于top-k，每个检索到的文档都计入频率）
+freq_sorted = frequency_curve(indices)  # 降序频率
+total_retrievals = indices.size  # 注意：现在是top-k的总检索次数
 
 # 打印并保存top-10热门文档频率
 print("Top-10热门文档频率:")
@@ -134,9 +140,7 @@ with open(FREQ_STATS_PATH, "w") as f:
         f.write(stat + "\n")
 
 # 计算累积分布（验证热门现象）
-total_retrievals = len(retrieved_docs)  # 注意：现在是top-k的总检索次数
-cumulative = np.cumsum(freq_sorted) / total_retrievals
-top10_percent = cumulative[int(0.1 * len(freq_sorted)) - 1] * 100 if len(freq_sorted) > 0 else 0
+top10_percent = top_percent_share(freq_sorted, total_retrievals, 0.1)
 print(f"Top 10% 文档占总检索的 {top10_percent:.2f}%")
 with open(FREQ_STATS_PATH, "a") as f:
     f.write(f"Top 10% 文档占总检索的 {top10_percent:.2f}%\n")
@@ -3,10 +3,12 @@ import os
 import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
-from collections import Counter
 from datasets import load_dataset
 from sentence_transformers import SentenceTransformer
 import faiss
+from retrieval_engine import retrieve
+from retrieval_store import store_path, get_or_create_retrieval
+from ngram_stats import ngram_frequency_curve
 # 配置matplotlib中文字体支持
 plt.rcParams['font.sans-serif'] = ['SimHei', 'Microsoft YaHei', 'DejaVu Sans']
 plt.rcParams['axes.unicode_minus'] = False  # 正确显示负号
@@ -20,6 +22,10 @@ parser.add_argument("--dataset", type=str, default="mmlu", choices=["mmlu", "nq"
                     help="选择查询数据集: mmlu, nq, hotpotqa, triviaqa")
 parser.add_argument("--topk", type=int, default=10,
                     help="检索的top-k值 (默认: 10)")
+parser.add_argument("--batch_size", type=int, default=256,
+                    help="查询编码批次大小 (默认: 256)")
+parser.add_argument("--threads", type=int, default=0,
+                    help="faiss检索线程数，0表示使用默认值 (默认: 0)")
 args = parser.parse_args()
 
 dataset_name = args.dataset.lower()
@@ -113,40 +119,21 @@ else:
 
 queries = [item[query_key] for item in query_dataset]  # 提取查询
 
-# 步骤5: 对于每个查询，进行检索并统计（top-k，但统计频率基于所有检索结果）
-retrieved_docs = []
-retrieved_sequences = []  # 存储每个查询的top-10序列
-for query in queries:
-    query_emb = get_embedding([query])[0]  # 单查询嵌入
-    distances, indices = index.search(np.array([query_emb]), k=topk)  # 检索top-k
-    seq = list(indices[0])  # top-10序列
-    retrieved_sequences.append(seq)
-    for idx in seq:  # 对于top-k，每个检索到的文档都计入频率
-        retrieved_docs.append(idx)
+# 步骤5: 对所有查询批量检索并统计（top-k，但统计频率基于所有检索结果）
+# 每个(索引, 数据集)只在最大k下检索一次，之后各top-k直接读取保存的结果矩阵
+distances, indices = get_or_create_retrieval(
+    store_path(INDEX_PATH, dataset_name), topk,
+    lambda k: retrieve(model, index, queries, k,
+                       encode_batch_size=args.batch_size, num_threads=args.threads),  # 批量编码+批量检索
+    num_queries=len(queries), index_ntotal=index.ntotal, index_path=INDEX_PATH, queries=queries)
 
 # 步骤6: 统计频率分布
 
 
 # 新功能: 统计连续的2,3,4个文章对（n-gram）
-def extract_ngrams(sequences, n):
-    ngrams = []
-    for seq in sequences:
-        for i in range(len(seq) - n + 1):
-            ngram = tuple(seq[i:i+n])  # 有序tuple
-            ngrams.append(ngram)
-    return ngrams
-
+# 每个查询的top-k序列上取长度为n的有序滑动窗口，打包成整数键后按数组统计
 for n in [2, 3, 4]:
-    ngrams = extract_ngrams(retrieved_sequences, n)
-    ngram_freq = Counter(ngrams)
-# Create a new, empty Counter object. And if given, count elements from an input iterable. Or, initialize the count from another mapping of elements to their counts.
-
-# >>> c = Counter()                           # a new, empty counter
-# >>> c = Counter('gallahad')                 # a new counter from an iterable
-# >>> c = Counter({'a': 4, 'b': 2})           # a new counter from a mapping
-# >>> c = Counter(a=4, b=2)                   # a new counter from keyword args
-
-    ngram_freq_sorted = sorted(ngram_freq.values(), reverse=True)  # 降序频率
+    ngram_freq_sorted, total_ngrams = ngram_frequency_curve(indices, n, id_bound=index.ntotal)  # 降序频率, 总n-gram次数
     
     # 输出文件命名
     NGRAM_STATS_PATH = f"ngram_stats_n{n}_{dataset_name}_top{topk}.txt"
@@ -161,7 +148,6 @@ for n in [2, 3, 4]:
             f.write(stat + "\n")
     
     # 计算累积分布
-    total_ngrams = len(ngrams)  # 总n-gram次数
     ngram_cumulative = np.cumsum(ngram_freq_sorted) / total_ngrams
 
 # # 假设有以下数据：
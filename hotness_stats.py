@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+向量化文档频率统计
+用 np.bincount 直接在检索结果矩阵上统计每个文档的检索次数，
+用数组运算得到降序频率曲线、累积占比和 Top X% 占比，
+结果与原先 Counter(retrieved_docs) + sorted() 的文本输出完全一致
+（同频文档按首次出现顺序排列，与Counter插入顺序+稳定排序相同）
+"""
+
+import numpy as np
+
+HOT_PERCENT = 0.1
+
+
+def doc_frequency_table(indices):
+    """
+    统计检索结果矩阵中每个文档的出现次数
+    返回 (doc_ids, freqs, total)：doc_ids/freqs 按频率降序排列，同频按首次出现顺序；total 为总检索次数
+    """
+    flat = np.asarray(indices).ravel().astype(np.int64)
+    total = int(flat.size)
+    if total == 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), 0
+    # 整体偏移1，使 faiss 的 -1 填充位也能像原先的Counter一样被计数
+    bins = flat + 1
+    counts = np.bincount(bins)
+    # 首次出现位置: 逆序赋值时同一下标以最后一次写入（即最早的位置）为准
+    first_seen = np.empty(counts.size, dtype=np.int64)
+    first_seen[bins[::-1]] = np.arange(total - 1, -1, -1)
+    present = np.flatnonzero(counts)
+    order = np.lexsort((first_seen[present], -counts[present]))
+    doc_bins = present[order]
+    return doc_bins - 1, counts[doc_bins], total
+
+
+def frequency_curve(indices):
+    """只返回降序频率曲线（不需要文档ID和同频顺序时使用）"""
+    flat = np.asarray(indices).ravel().astype(np.int64)
+    counts = np.bincount(flat + 1)
+    return np.sort(counts[counts > 0])[::-1]
+
+
+def cumulative_share(freqs, total):
+    """累积占比曲线: 前i个对象占总次数的比例"""
+    return np.cumsum(freqs) / total
+
+
+def top_percent_share(freqs, total, percent=HOT_PERCENT):
+    """前 percent 的对象占总次数的百分比（与原脚本 cumulative[int(0.1 * len) - 1] * 100 的取法一致）"""
+    if len(freqs) == 0:
+        return 0
+    return cumulative_share(freqs, total)[int(percent * len(freqs)) - 1] * 100
+
+
+def hot_docs(doc_ids, percent=HOT_PERCENT):
+    """前 percent 的热门文档ID（至少1个）"""
+    return doc_ids[:max(1, int(percent * len(doc_ids)))]
+
+
+def hot_doc_mask(indices, ntotal, percent=HOT_PERCENT):
+    """热门文档的布尔掩码（长度 ntotal），先去掉 -1 填充位再取前 percent"""
+    doc_ids, _, _ = doc_frequency_table(indices)
+    hot = hot_docs(doc_ids[doc_ids >= 0], percent)
+    mask = np.zeros(ntotal, dtype=bool)
+    mask[hot] = True
+    return mask
@@ -3,10 +3,12 @@ import os
 import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
-from collections import Counter
 from datasets import load_dataset
 from sentence_transformers import SentenceTransformer
 import faiss
+from retrieval_engine import retrieve
+from retrieval_store import store_path, get_or_create_retrieval
+from combo_stats import combo_frequency_table, top_combos, write_top_combos
 # 配置matplotlib中文字体支持
 plt.rcParams['font.sans-serif'] = ['SimHei', 'Microsoft YaHei', 'DejaVu Sans']
 plt.rcParams['axes.unicode_minus'] = False  # 正确显示负号
@@ -20,6 +22,10 @@ parser.add_argument("--dataset", type=str, default="mmlu", choices=["mmlu", "nq"
                     help="选择查询数据集: mmlu, nq, hotpotqa, triviaqa")
 parser.add_argument("--topk", type=int, default=1,
                     help="检索的top-k值 (默认: 1)")
+parser.add_argument("--batch_size", type=int, default=256,
+                    help="查询编码批次大小 (默认: 256)")
+parser.add_argument("--threads", type=int, default=0,
+                    help="faiss检索线程数，0表示使用默认值 (默认: 0)")
 args = parser.parse_args()
 
 dataset_name = args.dataset.lower()
@@ -113,19 +119,13 @@ else:
 
 queries = [item[query_key] for item in query_dataset]  # 提取查询
 
-# 步骤5: 对于每个查询，进行检索并统计（top-k，但统计频率基于所有检索结果）
-retrieved_docs = []
-retrieved_ordered_combos = []
-retrieved_unordered_combos = []
-for query in queries:
-    query_emb = get_embedding([query])[0]  # 单查询嵌入
-    distances, indices = index.search(np.array([query_emb]), k=topk)  # 检索top-k
-    ordered_combo = tuple(indices[0])  # 有序组合：检索顺序
-    unordered_combo = frozenset(indices[0])  # 无序组合：忽略顺序
-    retrieved_ordered_combos.append(ordered_combo)
-    retrieved_unordered_combos.append(unordered_combo)
-    for idx in indices[0]:  # 对于top-k，每个检索到的文档都计入频率
-        retrieved_docs.append(idx)
+# 步骤5: 对所有查询批量检索并统计（top-k，但统计频率基于所有检索结果）
+# 每个(索引, 数据集)只在最大k下检索一次，之后各top-k直接读取保存的结果矩阵
+distances, indices = get_or_create_retrieval(
+    store_path(INDEX_PATH, dataset_name), topk,
+    lambda k: retrieve(model, index, queries, k,
+                       encode_batch_size=args.batch_size, num_threads=args.threads),  # 批量编码+批量检索
+    num_queries=len(queries), index_ntotal=index.ntotal, index_path=INDEX_PATH, queries=queries)
 
 # # 步骤6: 统计频率分布
 # doc_freq = Counter(retrieved_docs)
@@ -163,19 +163,19 @@ for query in queries:
 
 #==========================================================================
 # 新功能: 统计有序和无序文章组合
-# 有序组合频率
-ordered_combo_freq = Counter(retrieved_ordered_combos)
-ordered_freq_sorted = sorted(ordered_combo_freq.values(), reverse=True)
+# 有序组合频率（有序组合：检索顺序）
+ordered_combo_keys, ordered_freq_sorted, _ = combo_frequency_table(indices, ordered=True)
 
-# 无序组合频率
-unordered_combo_freq = Counter(retrieved_unordered_combos)
-unordered_freq_sorted = sorted(unordered_combo_freq.values(), reverse=True)
+# 无序组合频率（无序组合：忽略顺序）
+unordered_combo_keys, unordered_freq_sorted, _ = combo_frequency_table(indices, ordered=False)
 
 # 输出文件命名
 ORDERED_STATS_PATH = f"ordered_combo_stats_{dataset_name}_top{topk}.txt"
 UNORDERED_STATS_PATH = f"unordered_combo_stats_{dataset_name}_top{topk}.txt"
 ORDERED_PLOT_PATH = f"ordered_combo_distribution_{dataset_name}_top{topk}.png"
 UNORDERED_PLOT_PATH = f"unordered_combo_distribution_{dataset_name}_top{topk}.png"
+ORDERED_TOP_PATH = f"ordered_combo_top_{dataset_name}_top{topk}.txt"
+UNORDERED_TOP_PATH = f"unordered_combo_top_{dataset_name}_top{topk}.txt"
 
 # 总查询次数（每个查询一个组合）
 total_queries = len(queries)
@@ -208,6 +208,13 @@ with open(UNORDERED_STATS_PATH, "a") as f:
     f.write(f"Top 10% 无序组合占总访问的 {unordered_top10_percent:.2f}%\n")
 print(f"无序组合统计保存到 {UNORDERED_STATS_PATH}")
 
+# 保存热门组合对应的文档ID
+write_top_combos(ORDERED_TOP_PATH, top_combos(ordered_combo_keys, ordered_freq_sorted, topk, ordered=True),
+                 f"有序文章组合 Top-10 (检索顺序) - {dataset_name.upper()} Top-{topk}")
+write_top_combos(UNORDERED_TOP_PATH, top_combos(unordered_combo_keys, unordered_freq_sorted, topk, ordered=False),
+                 f"无序文章组合 Top-10 (文档ID升序) - {dataset_name.upper()} Top-{topk}")
+print(f"热门组合文档ID保存到 {ORDERED_TOP_PATH} 和 {UNORDERED_TOP_PATH}")
+
 # 绘制有序组合分布图
 plt.figure(figsize=(10, 6))
 plt.plot(range(1, len(ordered_freq_sorted) + 1), ordered_freq_sorted, marker='o')
@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+嵌入空间枢纽性 (hubness) 与检索热度的关联分析
+高维嵌入空间中少数"枢纽"文档会出现在大量其他文档的近邻列表中，它们被检索到可能只是几何原因而非内容本身热门。本脚本:
+1. 统计每个文档的 k-occurrence N_k（出现在多少个其他文档的 k 近邻中），近邻来源可选:
+   exact - 对 doc_embeddings_100k.npy 分批精确 kNN（与索引同一度量）
+   hnsw  - 用HNSW索引近似检索每个文档的 kNN
+   graph - 直接取HNSW第0层邻居表的入度（hnsw_graph_stats.py），无需检索但近邻经过剪枝
+   N_k 缓存为 k_occurrence_{method}_k{k}.npy
+2. 枢纽性统计: N_k 的偏度 S_Nk、最大值、前1%文档占全部出现次数的比例、枢纽数（N_k > hub_factor × 平均值）、
+   反枢纽数（N_k = 0）
+3. 对每个数据集计算 N_k 与文档检索频率的 Spearman / Pearson(log1p) 相关、枢纽文档吸收的检索流量及其相对语料占比的倍数、
+   Top 10% 热门文档中枢纽的比例
+4. 在至少 --pin_min_datasets 个数据集中都属于 Top 10% 热门的枢纽文档，与查询集无关地吸收流量，列为缓存常驻候选
+
+用法:
+    python hubness.py --datasets mmlu nq hotpotqa triviaqa --topk 10 --knn 10 --method exact
+"""
+
+import os
+import json
+import argparse
+import numpy as np
+import faiss
+import matplotlib.pyplot as plt
+
+from retrieval_store import add_retrieval_args, load_or_search
+from hotness_stats import hot_doc_mask
+from hnsw_graph_stats import hnsw_degrees
+from page_io_sim import EMBEDDINGS_PATH
+
+# 配置matplotlib中文字体支持
+plt.rcParams['font.sans-serif'] = ['SimHei', 'Microsoft YaHei', 'DejaVu Sans']
+plt.rcParams['axes.unicode_minus'] = False  # 正确显示负号
+
+METHODS = ["exact", "hnsw", "graph"]
+TOP_SHARE_PERCENT = 0.01
+
+
+def k_occurrence_cache_path(method, k, index_path, embeddings_path=None):
+    """
+    N_k 缓存文件名，包含索引文件名和（exact/hnsw 方法）嵌入文件名，换用其他索引或嵌入时不会误用旧缓存；
+    graph 方法与 k 和嵌入无关；embeddings_path 为 None 表示向量由索引重建
+    """
+    index_name = os.path.splitext(os.path.basename(index_path))[0]
+    if method == "graph":
+        return f"k_occurrence_graph_{index_name}.npy"
+    source = index_name
+    if embeddings_path is not None:
+        source += "_" + os.path.splitext(os.path.basename(embeddings_path))[0]
+    return f"k_occurrence_{method}_k{k}_{source}.npy"
+
+
+def drop_self(ids, first_id):
+    """去掉每行中的查询文档自身；自身不在结果中（存在重复向量）时去掉最后一列"""
+    n, width = ids.shape
+    is_self = ids == np.arange(first_id, first_id + n)[:, None]
+    is_self[~is_self.any(axis=1), -1] = True
+    return ids[~is_self].reshape(n, width - 1)
+
+
+def knn_neighbors(vectors, k, searcher, batch_size=4096, log=print):
+    """以每个文档向量为查询分批检索 k+1 个近邻并去掉自身，返回 (ntotal, k) 的近邻ID矩阵"""
+    ntotal = len(vectors)
+    neighbors = np.empty((ntotal, k), dtype=np.int64)
+    for start in range(0, ntotal, batch_size):
+        batch = np.ascontiguousarray(vectors[start:start + batch_size], dtype=np.float32)
+        _, ids = searcher.search(batch, k + 1)
+        neighbors[start:start + len(batch)] = drop_self(ids, start)
+        if (start // batch_size) % 10 == 0:
+            log(f"kNN: {start + len(batch)}/{ntotal}")
+    return neighbors
+
+
+def k_occurrence(neighbors, ntotal):
+    """N_k: 每个文档出现在多少个其他文档的近邻列表中（-1填充位不计）"""
+    flat = np.asarray(neighbors).ravel()
+    return np.bincount(flat[flat >= 0], minlength=ntotal)
+
+
+def compute_k_occurrence(method, index, vectors, k, batch_size=4096, log=print):
+    """按 method 计算 N_k"""
+    if method == "graph":
+        _, _, in_degree = hnsw_degrees(index)[0]
+        return in_degree.astype(np.int64)
+    if method == "hnsw":
+        searcher = index
+    else:
+        searcher = faiss.IndexFlat(vectors.shape[1], index.metric_type)
+        for start in range(0, len(vectors), batch_size * 16):
+            searcher.add(np.ascontiguousarray(vectors[start:start + batch_size * 16], dtype=np.float32))
+    return k_occurrence(knn_neighbors(vectors, k, searcher, batch_size, log), len(vectors))
+
+
+def load_k_occurrence(method, index, vectors, k, index_path, embeddings_path=None, batch_size=4096, log=print):
+    """加载或计算 N_k（缓存到当前目录，文件名见 k_occurrence_cache_path）"""
+    cache_path = k_occurrence_cache_path(method, k, index_path, embeddings_path)
+    if os.path.exists(cache_path):
+        counts = np.load(cache_path)
+        if len(counts) == index.ntotal:
+            log(f"加载 k-occurrence 缓存 {cache_path}")
+            return counts
+    log(f"计算 k-occurrence ({method}, k={k})...")
+    counts = compute_k_occurrence(method, index, vectors, k, batch_size, log)
+    np.save(cache_path, counts)
+    return counts
+
+
+def skewness(values):
+    """偏度（三阶标准矩），方差为0时返回0"""
+    x = np.asarray(values, dtype=np.float64)
+    std = x.std()
+    if std == 0:
+        return 0.0
+    return float(np.mean((x - x.mean()) ** 3) / std ** 3)
+
+
+def hubness_stats(nk, hub_factor=2.0):
+    """N_k 分布的枢纽性统计，返回 (统计字典, 枢纽文档掩码)"""
+    nk = np.asarray(nk)
+    mean = float(nk.mean())
+    hubs = nk > hub_factor * mean
+    num_top = max(1, int(TOP_SHARE_PERCENT * len(nk)))
+    top_share = np.sort(nk)[::-1][:num_top].sum() / max(int(nk.sum()), 1)
+    stats = {
+        "mean": mean,
+        "std": float(nk.std()),
+        "max": int(nk.max()),
+        "skewness": skewness(nk),
+        "top1_percent_share": float(top_share),
+        "hub_threshold": hub_factor * mean,
+        "num_hubs": int(np.count_nonzero(hubs)),
+        "num_antihubs": int(np.count_nonzero(nk == 0)),
+    }
+    return stats, hubs
+
+
+def average_ranks(values):
+    """秩（从1开始，并列取平均秩）"""
+    _, inverse, counts = np.unique(values, return_inverse=True, return_counts=True)
+    ends = np.cumsum(counts)
+    return (ends - (counts - 1) / 2.0)[inverse]
+
+
+def pearson(x, y):
+    """Pearson相关系数，任一变量为常数时返回0"""
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    if x.std() == 0 or y.std() == 0:
+        return 0.0
+    return float(np.corrcoef(x, y)[0, 1])
+
+
+def spearman(x, y):
+    """Spearman秩相关系数"""
+    return pearson(average_ranks(x), average_ranks(y))
+
+
+def retrieval_correlation(nk, doc_freq, hubs, hot_mask):
+    """N_k 与一个数据集检索频率的关联"""
+    retrieved = doc_freq > 0
+    total = max(int(doc_freq.sum()), 1)
+    hub_traffic = doc_freq[hubs].sum() / total
+    hub_corpus = np.count_nonzero(hubs) / len(nk)
+    num_hot = np.count_nonzero(hot_mask)
+    return {
+        "spearman": spearman(nk, doc_freq),
+        "spearman_retrieved": spearman(nk[retrieved], doc_freq[retrieved]) if retrieved.any() else 0.0,
+        "pearson_log1p": pearson(np.log1p(nk), np.log1p(doc_freq)),
+        "hub_traffic_share": float(hub_traffic),
+        "hub_traffic_lift": float(hub_traffic / hub_corpus) if hub_corpus > 0 else 0.0,
+        "hot_hub_fraction": float(np.count_nonzero(hubs & hot_mask) / num_hot) if num_hot else 0.0,
+        "mean_nk_hot": float(nk[hot_mask].mean()) if num_hot else 0.0,
+        "mean_nk_all": float(nk.mean()),
+    }
+
+
+def pin_candidates(nk, hubs, hot_masks, min_datasets):
+    """在至少 min_datasets 个数据集中都属于热门的枢纽文档，按 N_k 降序返回 (doc_ids, 热门数据集数)"""
+    hot_count = np.sum(hot_masks, axis=0)
+    ids = np.flatnonzero(hubs & (hot_count >= min_datasets))
+    ids = ids[np.argsort(-nk[ids], kind="stable")]
+    return ids, hot_count[ids]
+
+
+def write_hubness_report(path, method, k, topk, stats, correlations, pins, pin_counts, nk, min_datasets):
+    """保存枢纽性统计、各数据集相关性和常驻候选"""
+    source = "HNSW第0层入度" if method == "graph" else f"{method}, k={k}"
+    lines = [f"嵌入空间枢纽性分析 - k-occurrence ({source}), 检索 Top-{topk}",
+             f"N_k 平均 {stats['mean']:.2f}, 标准差 {stats['std']:.2f}, 最大 {stats['max']}, 偏度 S_Nk {stats['skewness']:.3f}",
+             f"前{TOP_SHARE_PERCENT * 100:g}%文档占全部出现次数: {stats['top1_percent_share'] * 100:.2f}%",
+             f"枢纽 (N_k > {stats['hub_threshold']:.1f}): {stats['num_hubs']} 个, 反枢纽 (N_k = 0): {stats['num_antihubs']} 个",
+             f"\n{'数据集':>10}{'Spearman':>10}{'Spearman(被检索)':>18}{'Pearson(log1p)':>16}"
+             f"{'枢纽流量%':>10}{'流量倍数':>10}{'热门中枢纽%':>12}{'热门N_k':>10}"]
+    for name, c in correlations.items():
+        lines.append(f"{name:>10}{c['spearman']:>10.3f}{c['spearman_retrieved']:>18.3f}{c['pearson_log1p']:>16.3f}"
+                     f"{c['hub_traffic_share'] * 100:>10.2f}{c['hub_traffic_lift']:>10.2f}"
+                     f"{c['hot_hub_fraction'] * 100:>12.2f}{c['mean_nk_hot']:>10.2f}")
+    lines.append(f"\n常驻缓存候选（至少 {min_datasets} 个数据集中属于Top 10%热门的枢纽）: {len(pins)} 个")
+    for doc_id, count in zip(pins[:20], pin_counts[:20]):
+        lines.append(f"Doc {doc_id}: N_k {nk[doc_id]}, 热门数据集数 {count}")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("\n".join(lines) + "\n")
+    for line in lines:
+        print(line)
+
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description="嵌入空间枢纽性与检索热度的关联分析")
+    add_retrieval_args(parser, multi_dataset=True)
+    parser.add_argument("--embeddings", type=str, default=EMBEDDINGS_PATH, help="文档嵌入 .npy 文件")
+    parser.add_argument("--knn", type=int, default=10, help="k-occurrence 的近邻数k (默认: 10)")
+    parser.add_argument("--method", type=str, default="exact", choices=METHODS,
+                        help="近邻来源: exact 精确kNN, hnsw 索引近似kNN, graph HNSW第0层入度")
+    parser.add_argument("--batch_size", type=int, default=4096, help="kNN分批大小 (默认: 4096)")
+    parser.add_argument("--hub_factor", type=float, default=2.0, help="N_k 超过平均值多少倍算枢纽 (默认: 2)")
+    parser.add_argument("--pin_min_datasets", type=int, default=None,
+                        help="常驻候选至少在多少个数据集中属于热门 (默认: 全部数据集)")
+    args = parser.parse_args()
+
+    topk = args.topk
+    print(f"加载索引 {args.index}...")
+    index = faiss.read_index(args.index)
+    embeddings_path = args.embeddings
+    if os.path.exists(embeddings_path):
+        vectors = np.load(embeddings_path, mmap_mode="r")
+    else:
+        print(f"未找到嵌入文件 {embeddings_path}，从索引重建向量")
+        vectors = index.reconstruct_n(0, index.ntotal)
+        embeddings_path = None
+    nk = load_k_occurrence(args.method, index, vectors, args.knn, args.index, embeddings_path, args.batch_size)
+    stats, hubs = hubness_stats(nk, args.hub_factor)
+
+    correlations = {}
+    doc_freqs = {}
+    hot_masks = []
+    for dataset_name in args.datasets:
+        _, _, indices = load_or_search(args.index, dataset_name, topk, index)
+        flat = np.asarray(indices).ravel()
+        doc_freq = np.bincount(flat[flat >= 0], minlength=index.ntotal)
+        hot_mask = hot_doc_mask(indices, index.ntotal)
+        correlations[dataset_name] = retrieval_correlation(nk, doc_freq, hubs, hot_mask)
+        doc_freqs[dataset_name] = doc_freq
+        hot_masks.append(hot_mask)
+
+    min_datasets = args.pin_min_datasets or len(args.datasets)
+    pins, pin_counts = pin_candidates(nk, hubs, hot_masks, min_datasets)
+
+    name = f"hubness_graph_top{topk}" if args.method == "graph" else f"hubness_{args.method}_k{args.knn}_top{topk}"
+    write_hubness_report(f"{name}.txt", args.method, args.knn, topk, stats, correlations, pins, pin_counts, nk,
+                         min_datasets)
+    with open(f"{name}.json", "w", encoding="utf-8") as f:
+        json.dump({"args": vars(args), "stats": stats, "correlations": correlations,
+                   "pin_candidates": [{"doc_id": int(d), "k_occurrence": int(nk[d]), "hot_datasets": int(c)}
+                                      for d, c in zip(pins, pin_counts)]},
+                  f, ensure_ascii=False, indent=2)
+
+    fig, axes = plt.subplots(1, 2, figsize=(14, 6))
+    values, counts = np.unique(nk[nk > 0], return_counts=True)
+    axes[0].loglog(values, counts, marker='.', linestyle='none')
+    axes[0].set_title(f"k-occurrence 分布 ({args.method}, k={args.knn}, 偏度 {stats['skewness']:.2f})")
+    axes[0].set_xlabel("N_k")
+    axes[0].set_ylabel("文档数")
+    axes[0].grid(True)
+    for dataset_name, doc_freq in doc_freqs.items():
+        retrieved = doc_freq > 0
+        axes[1].scatter(nk[retrieved], doc_freq[retrieved], s=4, alpha=0.4, label=dataset_name.upper())
+    axes[1].axvline(stats["hub_threshold"], color='black', linestyle='--', linewidth=1)
+    axes[1].set_xscale("symlog")
+    axes[1].set_yscale("log")
+    axes[1].set_title(f"N_k vs 检索频率 (Top-{topk})")
+    axes[1].set_xlabel("N_k")
+    axes[1].set_ylabel("检索频率")
+    axes[1].legend()
+    axes[1].grid(True)
+    plt.tight_layout()
+    plt.savefig(f"{name}.png")
+    print(f"枢纽性分析保存到 {name}.txt，分布图保存为 {name}.png")
+
+
+if __name__ == "__main__":
+    main()
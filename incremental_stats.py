@@ -0,0 +1,291 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+增量热度统计
+把文档频率、2/3/4-gram 计数、有序/无序组合计数保存为可合并的统计状态（.npz，与统计输出放在一起），
+新增一批查询时只处理新的检索结果并合并进已有状态，无需重算历史:
+- update(indices): 按行块加入新的检索结果
+- merge(other): 合并另一份状态（other 视为发生在本状态之后）
+- save(path) / load(path): 序列化
+
+计数表的键保持有序，合并时用 searchsorted 定位已有键、原地累加计数、一次性插入新键，
+耗时与新数据量成正比（外加一次线性的数组拷贝）；同频对象保留全局首次出现位置，
+因此汇总结果与对全部历史一次性统计的结果完全一致
+
+用法:
+    python incremental_stats.py --dataset nq --topk 10                          # 从保存的检索结果建立状态
+    python incremental_stats.py --dataset nq --topk 10 --append new_queries.json  # 追加新查询
+    python incremental_stats.py --dataset nq --topk 10 --append new_indices.npy   # 追加已有的检索结果矩阵
+    python incremental_stats.py --dataset nq --topk 10 --merge other_state.npz    # 合并其他状态
+"""
+
+import os
+import json
+import argparse
+import numpy as np
+import faiss
+
+from retrieval_engine import load_embedding_model, retrieve
+from retrieval_store import (add_retrieval_args, prepare_retrieval, iter_retrieval_chunks, load_meta, store_path,
+                             DEFAULT_MAX_K)
+from hotness_stats import top_percent_share, HOT_PERCENT
+from ngram_stats import count_ngrams_chunks, DEFAULT_CHUNK_ROWS
+from combo_stats import count_combos_chunks
+
+NGRAM_SIZES = [2, 3, 4]
+COMBO_KINDS = ["ordered", "unordered"]
+STATE_VERSION = 1
+
+
+def state_path(dataset_name, topk):
+    """统计状态文件路径（与统计输出放在同一目录）"""
+    return f"hotness_state_{dataset_name}_top{topk}.npz"
+
+
+class CountTable:
+    """键有序的计数表，可选记录每个键的首次出现位置（用于复现同频的插入顺序）"""
+
+    def __init__(self, keys=None, counts=None, first_seen=None):
+        self.keys = keys
+        self.counts = np.empty(0, dtype=np.int64) if counts is None else counts
+        self.first_seen = first_seen
+
+    def __len__(self):
+        return len(self.counts)
+
+    def add(self, keys, counts, first_seen=None):
+        """合并一批（已排序去重的）键"""
+        if len(keys) == 0:
+            return
+        counts = counts.astype(np.int64)
+        if self.keys is None or len(self.keys) == 0:
+            self.keys, self.counts = keys, counts
+            self.first_seen = None if first_seen is None else first_seen.astype(np.int64)
+            return
+        pos = np.searchsorted(self.keys, keys)
+        found = pos < len(self.keys)
+        found[found] = self.keys[pos[found]] == keys[found]
+        self.counts[pos[found]] += counts[found]
+        if self.first_seen is not None:
+            self.first_seen[pos[found]] = np.minimum(self.first_seen[pos[found]], first_seen[found])
+        new = ~found
+        if new.any():
+            self.keys = np.insert(self.keys, pos[new], keys[new])
+            self.counts = np.insert(self.counts, pos[new], counts[new])
+            if self.first_seen is not None:
+                self.first_seen = np.insert(self.first_seen, pos[new], first_seen[new])
+
+    def sorted_by_frequency(self):
+        """按频率降序（同频按首次出现）返回 (keys, counts)"""
+        if self.keys is None:
+            return None, self.counts
+        if self.first_seen is None:
+            order = np.argsort(-self.counts, kind="stable")
+        else:
+            order = np.lexsort((self.first_seen, -self.counts))
+        return self.keys[order], self.counts[order]
+
+
+class HotnessState:
+    """可合并的热度统计状态（固定 top-k 和文档ID上界）"""
+
+    def __init__(self, topk, id_bound, ngram_sizes=NGRAM_SIZES):
+        self.topk = topk
+        self.id_bound = id_bound
+        self.ngram_sizes = list(ngram_sizes)
+        self.num_queries = 0
+        self.total_retrievals = 0
+        # 文档ID整体偏移1，使faiss的-1填充位也被计数（与 hotness_stats 一致）
+        self.doc_counts = np.zeros(id_bound + 1, dtype=np.int64)
+        self.doc_first_seen = np.full(id_bound + 1, np.iinfo(np.int64).max, dtype=np.int64)
+        self.ngrams = {n: CountTable() for n in self.ngram_sizes}
+        self.combos = {kind: CountTable() for kind in COMBO_KINDS}
+
+    def update(self, indices, chunk_rows=DEFAULT_CHUNK_ROWS):
+        """加入新的检索结果矩阵 (num_queries, topk)，耗时与新数据量成正比"""
+        indices = np.asarray(indices)
+        if indices.ndim != 2 or indices.shape[1] < self.topk:
+            raise ValueError(f"检索结果形状 {indices.shape} 与状态的 top-k={self.topk} 不一致")
+        indices = indices[:, :self.topk]
+        for start in range(0, len(indices), chunk_rows):
+            self._update_chunk(indices[start:start + chunk_rows])
+
+    def _update_chunk(self, chunk):
+        bins = chunk.ravel().astype(np.int64) + 1
+        if bins.size:
+            self.doc_counts += np.bincount(bins, minlength=self.id_bound + 1)
+            positions = np.arange(self.total_retrievals, self.total_retrievals + bins.size)
+            np.minimum.at(self.doc_first_seen, bins, positions)
+        for n in self.ngram_sizes:
+            keys, counts, _ = count_ngrams_chunks([chunk], n, self.id_bound)
+            self.ngrams[n].add(keys, counts)
+        for kind in COMBO_KINDS:
+            keys, counts, first_seen, _ = count_combos_chunks([chunk], ordered=kind == "ordered")
+            if keys is not None:
+                self.combos[kind].add(keys, counts, first_seen + self.num_queries)
+        self.num_queries += len(chunk)
+        self.total_retrievals += int(bins.size)
+
+    def merge(self, other):
+        """合并另一份状态（other 中的查询视为排在本状态之后）"""
+        if other.topk != self.topk or other.id_bound != self.id_bound or other.ngram_sizes != self.ngram_sizes:
+            raise ValueError("只能合并 top-k、文档ID上界和 n-gram 设置相同的状态")
+        self.doc_counts += other.doc_counts
+        seen = other.doc_counts > 0
+        self.doc_first_seen[seen] = np.minimum(self.doc_first_seen[seen],
+                                               other.doc_first_seen[seen] + self.total_retrievals)
+        for n in self.ngram_sizes:
+            table = other.ngrams[n]
+            if table.keys is not None:
+                self.ngrams[n].add(table.keys, table.counts)
+        for kind in COMBO_KINDS:
+            table = other.combos[kind]
+            if table.keys is not None:
+                self.combos[kind].add(table.keys, table.counts, table.first_seen + self.num_queries)
+        self.num_queries += other.num_queries
+        self.total_retrievals += other.total_retrievals
+
+    def doc_table(self):
+        """与 hotness_stats.doc_frequency_table 相同的 (doc_ids, freqs, total)"""
+        present = np.flatnonzero(self.doc_counts)
+        order = np.lexsort((self.doc_first_seen[present], -self.doc_counts[present]))
+        doc_bins = present[order]
+        return doc_bins - 1, self.doc_counts[doc_bins], self.total_retrievals
+
+    def ngram_curve(self, n):
+        """n-gram 降序频率和总次数"""
+        counts = self.ngrams[n].counts
+        return np.sort(counts)[::-1], int(counts.sum())
+
+    def combo_table(self, kind):
+        """组合按频率降序（同频按首次出现）的 (keys, freqs)"""
+        return self.combos[kind].sorted_by_frequency()
+
+    def save(self, path):
+        """保存为 .npz"""
+        meta = {"version": STATE_VERSION, "topk": self.topk, "id_bound": self.id_bound,
+                "ngram_sizes": self.ngram_sizes, "num_queries": self.num_queries,
+                "total_retrievals": self.total_retrievals}
+        arrays = {"meta": np.array(json.dumps(meta)), "doc_counts": self.doc_counts,
+                  "doc_first_seen": self.doc_first_seen}
+        for n, table in self.ngrams.items():
+            if table.keys is not None:
+                arrays[f"ngram{n}_keys"] = table.keys
+                arrays[f"ngram{n}_counts"] = table.counts
+        for kind, table in self.combos.items():
+            if table.keys is not None:
+                arrays[f"{kind}_keys"] = table.keys
+                arrays[f"{kind}_counts"] = table.counts
+                arrays[f"{kind}_first_seen"] = table.first_seen
+        tmp_path = path + ".tmp.npz"
+        np.savez(tmp_path, **arrays)
+        os.replace(tmp_path, path)  # 先写临时文件再替换，避免中断时损坏已有状态
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            meta = json.loads(str(data["meta"]))
+            if meta["version"] != STATE_VERSION:
+                raise ValueError(f"不支持的状态版本: {meta['version']}")
+            state = cls(meta["topk"], meta["id_bound"], meta["ngram_sizes"])
+            state.num_queries = meta["num_queries"]
+            state.total_retrievals = meta["total_retrievals"]
+            state.doc_counts = data["doc_counts"]
+            state.doc_first_seen = data["doc_first_seen"]
+            for n in state.ngram_sizes:
+                if f"ngram{n}_keys" in data:
+                    state.ngrams[n] = CountTable(data[f"ngram{n}_keys"], data[f"ngram{n}_counts"])
+            for kind in COMBO_KINDS:
+                if f"{kind}_keys" in data:
+                    state.combos[kind] = CountTable(data[f"{kind}_keys"], data[f"{kind}_counts"],
+                                                    data[f"{kind}_first_seen"])
+        return state
+
+
+def write_summary(path, dataset_name, state):
+    """保存汇总: 文档Top-10、Top 10%占比，各n-gram和组合的Top 10%占比"""
+    doc_ids, freqs, total = state.doc_table()
+    lines = [f"增量热度统计 - {dataset_name.upper()} Top-{state.topk}",
+             f"累计查询数: {state.num_queries}, 总检索次数: {total}, 不同文档数: {len(doc_ids)}",
+             "\nTop-10热门文档频率:"]
+    for rank, (doc_id, freq) in enumerate(zip(doc_ids[:10], freqs[:10]), 1):
+        lines.append(f"Rank {rank}: Doc {doc_id} - {freq} 次")
+    lines.append(f"Top 10% 文档占总检索的 {top_percent_share(freqs, total, HOT_PERCENT):.2f}%")
+    for n in state.ngram_sizes:
+        ngram_freqs, ngram_total = state.ngram_curve(n)
+        lines.append(f"Top 10% {n}-gram 占总访问的 {top_percent_share(ngram_freqs, ngram_total, HOT_PERCENT):.2f}% "
+                     f"(不同 {n}-gram {len(ngram_freqs)} 个)")
+    for kind, label in (("ordered", "有序组合"), ("unordered", "无序组合")):
+        _, combo_freqs = state.combo_table(kind)
+        lines.append(f"Top 10% {label}占总访问的 {top_percent_share(combo_freqs, state.num_queries, HOT_PERCENT):.2f}% "
+                     f"(不同组合 {len(combo_freqs)} 个)")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("\n".join(lines) + "\n")
+    for line in lines:
+        print(line)
+
+
+def load_append_indices(path, index, topk, batch_size, search_k=DEFAULT_MAX_K):
+    """
+    读取要追加的检索结果: .npy 为检索结果矩阵，.json 为查询列表（字符串或含 question 字段的对象）
+    新查询与历史检索结果一样在 search_k（检索结果存储的 max_k）下检索后取前 topk 列，
+    追加部分与历史部分按同一方式得到（efSearch 固定时HNSW结果与 k 无关，前缀即小k的检索结果）
+    """
+    if path.endswith(".npy"):
+        return np.load(path)[:, :topk]
+    with open(path, "r", encoding="utf-8") as f:
+        items = json.load(f)
+    queries = [item if isinstance(item, str) else item["question"] for item in items]
+    print(f"编码并检索 {len(queries)} 个新查询 (k={max(topk, search_k)})...")
+    model = load_embedding_model()
+    _, indices = retrieve(model, index, queries, max(topk, search_k), encode_batch_size=batch_size)
+    return indices[:, :topk]
+
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description="增量热度统计")
+    add_retrieval_args(parser)
+    parser.add_argument("--state", type=str, default=None, help="统计状态文件 (默认: hotness_state_{dataset}_top{k}.npz)")
+    parser.add_argument("--append", type=str, nargs="+", default=None,
+                        help="追加新的查询 (.json) 或检索结果矩阵 (.npy)，只处理新数据")
+    parser.add_argument("--merge", type=str, nargs="+", default=None, help="合并其他统计状态文件 (.npz)")
+    parser.add_argument("--batch_size", type=int, default=256, help="查询编码的批次大小 (默认: 256)")
+    args = parser.parse_args()
+
+    dataset_name = args.dataset.lower()
+    topk = args.topk
+    path = args.state or state_path(dataset_name, topk)
+    print(f"加载索引 {args.index}...")
+    index = faiss.read_index(args.index)
+
+    if args.append or args.merge:
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"未找到统计状态 {path}，请先不带 --append/--merge 运行一次建立状态")
+        state = HotnessState.load(path)
+        print(f"加载统计状态 {path} (累计 {state.num_queries} 个查询)")
+        meta = load_meta(store_path(args.index, dataset_name))
+        search_k = meta["max_k"] if meta is not None else DEFAULT_MAX_K
+        for append_path in args.append or []:
+            new_indices = load_append_indices(append_path, index, topk, args.batch_size, search_k)
+            print(f"追加 {append_path}: {len(new_indices)} 个查询")
+            state.update(new_indices)
+        for merge_path in args.merge or []:
+            print(f"合并统计状态 {merge_path}")
+            state.merge(HotnessState.load(merge_path))
+    else:
+        store_dir, _ = prepare_retrieval(args.index, dataset_name, topk, index)
+        print("从保存的检索结果建立统计状态...")
+        state = HotnessState(topk, index.ntotal)
+        for chunk in iter_retrieval_chunks(store_dir, topk):
+            state.update(np.asarray(chunk))
+
+    state.save(path)
+    print(f"统计状态保存到 {path}")
+    summary_path = f"hotness_summary_{dataset_name}_top{topk}.txt"
+    write_summary(summary_path, dataset_name, state)
+    print(f"增量统计汇总保存到 {summary_path}")
+
+
+if __name__ == "__main__":
+    main()
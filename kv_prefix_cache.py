@@ -0,0 +1,288 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+LLM 前缀（KV-cache）复用模拟
+RAG 把每个查询检索到的 top-k 文档按顺序拼接进提示词: [系统提示] + 文档1 + 文档2 + ... + 文档k + 查询，
+推理服务端只有相同的前缀才能复用已计算的KV-cache，因此决定复用量的是有序组合而不是无序组合（参见 hotpair.py）
+
+本脚本只统计每个文档的token数（不保留token本身），把提示词按文档拆成前缀树（radix tree）节点，
+按查询顺序在以token计容量的前缀树KV-cache中重放（满时按LRU淘汰叶子节点，类似SGLang RadixAttention），
+统计可省去的prefill token数。查询文本每次都不同，不计入可复用部分
+
+文档排列顺序:
+- retrieval: 按检索排名（默认的真实顺序）
+- id: 按文档ID排序的规范顺序
+- popularity: 按全局检索频率降序（同频按ID）的规范顺序，热门文档排在前面以共享更长的前缀
+
+用法:
+    python kv_prefix_cache.py --dataset nq --topk 5 --capacities 100000 1000000 --orders retrieval popularity
+"""
+
+import os
+import re
+import json
+import heapq
+import argparse
+import numpy as np
+import matplotlib.pyplot as plt
+import faiss
+
+from retrieval_store import add_retrieval_args, load_or_search
+from hotness_stats import doc_frequency_table
+
+# 配置matplotlib中文字体支持
+plt.rcParams['font.sans-serif'] = ['SimHei', 'Microsoft YaHei', 'DejaVu Sans']
+plt.rcParams['axes.unicode_minus'] = False  # 正确显示负号
+
+WIKI_DATA_PATH = os.path.join("wikipedia_data", "wikipedia_100k.json")
+DEFAULT_TOKENIZER = "Qwen/Qwen2.5-7B-Instruct"
+DEFAULT_CAPACITIES = [50000, 100000, 200000, 500000, 1000000, 2000000]  # 以token计
+ORDERS = ["retrieval", "id", "popularity"]
+SYSTEM_PROMPT_DOC = -2  # 系统提示在前缀树中的节点标记
+FALLBACK_TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+
+
+def tokenizer_cache_path(tokenizer_name):
+    """文档token数缓存文件路径"""
+    return f"doc_token_counts_{re.sub(r'[^0-9A-Za-z]+', '_', tokenizer_name)}.npy"
+
+
+def count_tokens(texts, tokenizer_name=DEFAULT_TOKENIZER, batch_size=1000, log=print):
+    """
+    每段文本的token数（不加特殊token）
+    无法加载tokenizer时退化为按单词/标点的近似计数
+    """
+    try:
+        from transformers import AutoTokenizer
+        tokenizer = AutoTokenizer.from_pretrained(tokenizer_name)
+    except Exception as e:
+        log(f"加载tokenizer {tokenizer_name} 失败 ({e})，按单词/标点近似计数")
+        return np.array([len(FALLBACK_TOKEN_PATTERN.findall(text)) for text in texts], dtype=np.int64)
+
+    counts = np.zeros(len(texts), dtype=np.int64)
+    for start in range(0, len(texts), batch_size):
+        batch = texts[start:start + batch_size]
+        encoded = tokenizer(batch, add_special_tokens=False)["input_ids"]
+        counts[start:start + len(batch)] = [len(ids) for ids in encoded]
+    return counts
+
+
+def load_doc_token_counts(ntotal, corpus_path=WIKI_DATA_PATH, tokenizer_name=DEFAULT_TOKENIZER,
+                          default_tokens=128, log=print):
+    """文档token数（缓存到当前目录）；找不到语料库时所有文档按 default_tokens 计"""
+    cache_path = tokenizer_cache_path(tokenizer_name)
+    if os.path.exists(cache_path):
+        counts = np.load(cache_path)
+        if len(counts) == ntotal:
+            log(f"加载文档token数缓存 {cache_path}")
+            return counts
+    if not os.path.exists(corpus_path):
+        log(f"未找到语料库 {corpus_path}，所有文档按 {default_tokens} 个token计算")
+        return np.full(ntotal, default_tokens, dtype=np.int64)
+    with open(corpus_path, "r", encoding="utf-8") as f:
+        texts = json.load(f)["text"]
+    log(f"统计 {min(ntotal, len(texts))} 个文档的token数 ({tokenizer_name})...")
+    counts = np.full(ntotal, default_tokens, dtype=np.int64)
+    n = min(ntotal, len(texts))
+    counts[:n] = count_tokens(texts[:n], tokenizer_name, log=log)
+    np.save(cache_path, counts)
+    return counts
+
+
+def order_rows(indices, order, doc_rank=None):
+    """
+    按指定顺序重排每行检索结果（-1填充位保持在行尾）
+    doc_rank: popularity 顺序下每个文档的全局名次（越热门越小）
+    """
+    indices = np.asarray(indices)
+    if order == "retrieval":
+        return indices
+    padded = indices < 0
+    if order == "id":
+        keys = np.where(padded, np.iinfo(np.int64).max, indices.astype(np.int64))
+    elif order == "popularity":
+        keys = np.where(padded, np.iinfo(np.int64).max, doc_rank[np.where(padded, 0, indices)])
+    else:
+        raise ValueError(f"未知排列顺序: {order}")
+    return np.take_along_axis(indices, np.argsort(keys, axis=1, kind="stable"), axis=1)
+
+
+def popularity_rank(indices, ntotal):
+    """每个文档的全局检索频率名次（频率降序、同频按ID，未被检索到的排在最后）"""
+    doc_ids, freqs, _ = doc_frequency_table(indices)
+    keep = doc_ids >= 0
+    doc_ids, freqs = doc_ids[keep], freqs[keep]
+    ranked = doc_ids[np.lexsort((doc_ids, -freqs))]
+    rank = np.full(ntotal, len(ranked), dtype=np.int64)
+    rank[ranked] = np.arange(len(ranked))
+    return rank
+
+
+class PrefixCache:
+    """
+    以文档为边的前缀树KV-cache，容量以token计
+    每个节点对应"父节点前缀 + 一个文档"的KV，超出容量时按最近访问时间淘汰叶子节点（惰性删除堆）
+    """
+
+    def __init__(self, capacity=None):
+        self.capacity = capacity  # None 表示不限容量
+        self.children = [{}]      # 节点 -> {文档: 子节点}，0为根节点（空前缀）
+        self.parent = [-1]
+        self.doc = [-1]
+        self.tokens = [0]
+        self.last_access = [0]
+        self.alive = [True]
+        self.free = []
+        self.heap = []            # (最近访问时间, 节点) 叶子候选
+        self.used_tokens = 0
+        self.clock = 0
+
+    def _new_node(self, parent, doc, tokens):
+        if self.free:
+            node = self.free.pop()
+            self.children[node], self.parent[node], self.doc[node] = {}, parent, doc
+            self.tokens[node], self.alive[node] = tokens, True
+        else:
+            node = len(self.parent)
+            self.children.append({})
+            self.parent.append(parent)
+            self.doc.append(doc)
+            self.tokens.append(tokens)
+            self.last_access.append(0)
+            self.alive.append(True)
+        self.children[parent][doc] = node
+        self.used_tokens += tokens
+        return node
+
+    def _evict(self):
+        """淘汰叶子节点直到不超过容量（当前请求路径最后访问，最后才会被淘汰）"""
+        while self.used_tokens > self.capacity and self.heap:
+            access, node = heapq.heappop(self.heap)
+            if not self.alive[node] or self.children[node] or self.last_access[node] != access:
+                continue
+            parent = self.parent[node]
+            del self.children[parent][self.doc[node]]
+            self.alive[node] = False
+            self.used_tokens -= self.tokens[node]
+            self.free.append(node)
+            if parent != 0 and not self.children[parent]:
+                heapq.heappush(self.heap, (self.last_access[parent], parent))
+
+    def request(self, docs, doc_tokens):
+        """处理一个提示词（文档序列），返回 (命中前缀的token数, 命中前缀的文档数)"""
+        self.clock += 1
+        node, matched_tokens, matched_docs = 0, 0, 0
+        for doc in docs:
+            child = self.children[node].get(doc)
+            if child is None:
+                break
+            node = child
+            matched_tokens += self.tokens[node]
+            matched_docs += 1
+            self.last_access[node] = self.clock
+        for doc in docs[matched_docs:]:
+            node = self._new_node(node, doc, doc_tokens(doc))
+            self.last_access[node] = self.clock
+        if node != 0 and not self.children[node]:
+            heapq.heappush(self.heap, (self.clock, node))
+        if self.capacity is not None:
+            self._evict()
+        return matched_tokens, matched_docs
+
+
+def simulate_prefix_reuse(rows, doc_tokens, capacity=None, system_tokens=0):
+    """
+    按查询顺序重放提示词，返回统计字典
+    rows: 每个查询的有序文档ID（-1填充位跳过）；doc_tokens: 每个文档的token数数组
+    """
+    cache = PrefixCache(capacity)
+    token_of = lambda doc: system_tokens if doc == SYSTEM_PROMPT_DOC else int(doc_tokens[doc])
+    prefix = [SYSTEM_PROMPT_DOC] if system_tokens > 0 else []
+    total_tokens = saved_tokens = matched_docs_sum = hit_requests = 0
+    for row in np.asarray(rows).tolist():
+        docs = prefix + [doc for doc in row if doc >= 0]
+        matched_tokens, matched_docs = cache.request(docs, token_of)
+        total_tokens += sum(token_of(doc) for doc in docs)
+        saved_tokens += matched_tokens
+        matched_docs_sum += matched_docs - (1 if prefix and matched_docs else 0)
+        hit_requests += 1 if matched_docs > len(prefix) else 0
+    num_requests = len(rows)
+    return {"capacity": capacity, "num_requests": num_requests, "prefill_tokens": total_tokens,
+            "saved_tokens": saved_tokens, "saved_ratio": saved_tokens / total_tokens if total_tokens else 0.0,
+            "doc_prefix_hit_rate": hit_requests / num_requests if num_requests else 0.0,
+            "mean_matched_docs": matched_docs_sum / num_requests if num_requests else 0.0}
+
+
+def write_prefix_report(path, dataset_name, topk, results, orders, capacities):
+    """保存各排列顺序、各容量下省去的prefill token比例"""
+    table = {(r["order"], r["capacity"]): r for r in results}
+    lines = [f"LLM前缀KV-cache复用模拟 - {dataset_name.upper()} Top-{topk}",
+             f"查询数: {results[0]['num_requests']}, 总prefill token数(文档+系统提示): {results[0]['prefill_tokens']}"]
+    for metric, label, scale in (("saved_ratio", "省去的prefill token比例(%)", 100),
+                                 ("doc_prefix_hit_rate", "至少命中一个文档前缀的请求比例(%)", 100),
+                                 ("mean_matched_docs", "平均命中前缀文档数", 1)):
+        lines.append(f"\n{label}")
+        lines.append(f"{'容量(token)':<14}" + "".join(f"{o:>12}" for o in orders))
+        for capacity in capacities:
+            name = "不限" if capacity is None else str(capacity)
+            lines.append(f"{name:<14}" + "".join(f"{table[(o, capacity)][metric] * scale:>12.2f}" for o in orders))
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("\n".join(lines) + "\n")
+    for line in lines:
+        print(line)
+
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description="LLM前缀KV-cache复用模拟")
+    add_retrieval_args(parser, default_topk=5)
+    parser.add_argument("--capacities", type=int, nargs="+", default=DEFAULT_CAPACITIES,
+                        help="KV-cache容量（token数），另外总会模拟不限容量的情况")
+    parser.add_argument("--orders", type=str, nargs="+", default=ORDERS, choices=ORDERS,
+                        help="提示词中文档的排列顺序")
+    parser.add_argument("--tokenizer", type=str, default=DEFAULT_TOKENIZER, help="用于统计token数的LLM tokenizer")
+    parser.add_argument("--corpus", type=str, default=WIKI_DATA_PATH, help="语料库JSON")
+    parser.add_argument("--system_tokens", type=int, default=0, help="所有提示词共享的系统提示token数 (默认: 0)")
+    args = parser.parse_args()
+
+    dataset_name = args.dataset.lower()
+    topk = args.topk
+    print(f"加载索引 {args.index}...")
+    index = faiss.read_index(args.index)
+    _, _, indices = load_or_search(args.index, dataset_name, topk, index)
+
+    doc_tokens = load_doc_token_counts(index.ntotal, args.corpus, args.tokenizer)
+    doc_rank = popularity_rank(indices, index.ntotal) if "popularity" in args.orders else None
+    capacities = sorted(set(args.capacities)) + [None]
+    results = []
+    for order in args.orders:
+        rows = order_rows(indices, order, doc_rank)
+        for capacity in capacities:
+            result = simulate_prefix_reuse(rows, doc_tokens, capacity, args.system_tokens)
+            result["order"] = order
+            results.append(result)
+
+    report_path = f"kv_prefix_cache_{dataset_name}_top{topk}.txt"
+    write_prefix_report(report_path, dataset_name, topk, results, args.orders, capacities)
+    with open(f"kv_prefix_cache_{dataset_name}_top{topk}.json", "w", encoding="utf-8") as f:
+        json.dump({"tokenizer": args.tokenizer, "system_tokens": args.system_tokens, "results": results},
+                  f, ensure_ascii=False, indent=2)
+
+    plot_path = f"kv_prefix_cache_{dataset_name}_top{topk}.png"
+    plt.figure(figsize=(10, 6))
+    for order in args.orders:
+        ratios = [r["saved_ratio"] * 100 for c in capacities[:-1] for r in results
+                  if r["order"] == order and r["capacity"] == c]
+        plt.plot(capacities[:-1], ratios, marker='o', label=order)
+    plt.xscale('log')
+    plt.title(f"前缀KV-cache省去的prefill token比例 - {dataset_name.upper()} Top-{topk}")
+    plt.xlabel("KV-cache容量 (token)")
+    plt.ylabel("省去的prefill token (%)")
+    plt.legend()
+    plt.grid(True)
+    plt.savefig(plot_path)
+    print(f"前缀复用模拟结果保存到 {report_path}，曲线保存为 {plot_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+逐查询延迟分位数基准测试
+对每个缓存的查询集 (mmlu, nq, hotpotqa, triviaqa) 在 top-k 1/5/10/16/32 下，
+分别以单查询模式和批量模式重放，独立测量嵌入和检索的 p50/p95/p99/max 延迟，
+输出机器可读的JSON结果和汇总表
+
+用法:
+    python latency_benchmark.py --sample 2000 --batch_size 64
+"""
+
+import json
+import time
+import argparse
+import numpy as np
+import faiss
+
+from retrieval_engine import load_embedding_model, load_queries, set_search_threads
+
+DEFAULT_TOPKS = [1, 5, 10, 16, 32]
+DATASETS = ["mmlu", "nq", "hotpotqa", "triviaqa"]
+
+
+def latency_summary(latencies_ms):
+    """计算延迟分位数（毫秒）"""
+    arr = np.asarray(latencies_ms, dtype=np.float64)
+    p50, p95, p99 = np.percentile(arr, [50, 95, 99])
+    return {"count": int(arr.size), "mean": float(arr.mean()), "p50": float(p50), "p95": float(p95),
+            "p99": float(p99), "max": float(arr.max())}
+
+
+def time_calls(fn, items, warmup=5):
+    """依次对每个输入调用 fn 并记录耗时（毫秒），前 warmup 次调用不计入"""
+    for item in items[:warmup]:
+        fn(item)
+    latencies = np.empty(len(items), dtype=np.float64)
+    for i, item in enumerate(items):
+        start = time.perf_counter()
+        fn(item)
+        latencies[i] = (time.perf_counter() - start) * 1000
+    return latencies
+
+
+def benchmark_dataset(model, index, queries, topks, batch_size, log=print):
+    """对单个数据集测量单查询和批量两种模式下的嵌入/检索延迟"""
+    results = {}
+    single_items = [[q] for q in queries]
+    batch_items = [queries[i:i + batch_size] for i in range(0, len(queries), batch_size)]
+
+    def encode(batch):
+        return model.encode(batch, batch_size=len(batch), normalize_embeddings=True,
+                            show_progress_bar=False).astype(np.float32)
+
+    for mode, items in (("single", single_items), ("batched", batch_items)):
+        log(f"  [{mode}] 测量嵌入延迟 ({len(items)} 次调用)...")
+        embed_latencies = time_calls(encode, items)
+        results[mode] = {"embedding": latency_summary(embed_latencies), "search": {}}
+        if mode == "batched":
+            # 批内每个查询都要等待整个批次完成，同时给出均摊到每个查询的延迟
+            sizes = np.array([len(b) for b in items])
+            results[mode]["embedding_per_query_amortized"] = latency_summary(embed_latencies / sizes)
+        embs = [encode(batch) for batch in items]
+        for topk in topks:
+            search_latencies = time_calls(lambda x: index.search(x, topk), embs)
+            results[mode]["search"][str(topk)] = latency_summary(search_latencies)
+            log(f"  [{mode}] top-{topk} 检索 p50 {results[mode]['search'][str(topk)]['p50']:.3f} ms, "
+                f"p99 {results[mode]['search'][str(topk)]['p99']:.3f} ms")
+    return results
+
+
+def format_summary(all_results, batch_size):
+    """生成汇总表（每行: 数据集, 模式, 阶段, top-k, 分位数）"""
+    header = f"{'数据集':<10}{'模式':<10}{'阶段':<12}{'top-k':>6}{'p50(ms)':>10}{'p95(ms)':>10}{'p99(ms)':>10}{'max(ms)':>10}"
+    lines = [f"延迟基准测试汇总 (批量模式批次大小 {batch_size}，批量模式延迟为整批耗时)", header, "-" * len(header)]
+    for dataset_name, dataset_results in all_results.items():
+        for mode, mode_results in dataset_results.items():
+            rows = [("embedding", "-", mode_results["embedding"])]
+            rows += [("search", topk, s) for topk, s in mode_results["search"].items()]
+            for stage, topk, s in rows:
+                lines.append(f"{dataset_name:<10}{mode:<10}{stage:<12}{topk:>6}{s['p50']:>10.3f}"
+                             f"{s['p95']:>10.3f}{s['p99']:>10.3f}{s['max']:>10.3f}")
+    return "\n".join(lines)
+
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description="逐查询延迟分位数基准测试")
+    parser.add_argument("--datasets", type=str, nargs="+", default=DATASETS, choices=DATASETS,
+                        help="要测试的查询数据集 (默认: 全部)")
+    parser.add_argument("--topks", type=int, nargs="+", default=DEFAULT_TOPKS,
+                        help="要测试的top-k值 (默认: 1 5 10 16 32)")
+    parser.add_argument("--index", type=str, default="hnsw_index_100k.bin", help="faiss索引文件")
+    parser.add_argument("--sample", type=int, default=1000, help="每个数据集测试的查询数，0表示全部 (默认: 1000)")
+    parser.add_argument("--batch_size", type=int, default=64, help="批量模式的批次大小 (默认: 64)")
+    parser.add_argument("--threads", type=int, default=0, help="faiss检索线程数，0表示默认值 (默认: 0)")
+    parser.add_argument("--output", type=str, default="latency_benchmark", help="输出文件前缀")
+    args = parser.parse_args()
+
+    print("加载本地嵌入模型...")
+    model = load_embedding_model()
+    print(f"加载索引 {args.index}...")
+    index = faiss.read_index(args.index)
+    set_search_threads(args.threads)
+
+    all_results = {}
+    for dataset_name in args.datasets:
+        queries = load_queries(dataset_name)
+        if args.sample > 0:
+            queries = queries[:args.sample]
+        print(f"测试 {dataset_name.upper()} ({len(queries)} 个查询)...")
+        all_results[dataset_name] = benchmark_dataset(model, index, queries, args.topks, args.batch_size)
+
+    report = {
+        "index": args.index,
+        "efSearch": int(index.hnsw.efSearch) if hasattr(index, "hnsw") else None,
+        "faiss_threads": faiss.omp_get_max_threads(),
+        "batch_size": args.batch_size,
+        "sample": args.sample,
+        "results": all_results
+    }
+    json_path = f"{args.output}.json"
+    with open(json_path, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    summary = format_summary(all_results, args.batch_size)
+    summary_path = f"{args.output}_summary.txt"
+    with open(summary_path, "w", encoding="utf-8") as f:
+        f.write(summary + "\n")
+    print(summary)
+    print(f"基准测试结果保存到 {json_path} 和 {summary_path}")
+
+
+if __name__ == "__main__":
+    main()
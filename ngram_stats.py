@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+向量化 n-gram 统计
+在检索结果矩阵上用滑动窗口视图取出每个查询 top-k 序列中连续的 n 个文档，
+将每个窗口打包成定宽整数键（放不下时用定长字节键），再用排序+游程计数统计频率，
+避免为每个窗口分配Python tuple；支持按行分块流式统计，结果与 Counter(extract_ngrams(...)) 完全一致
+
+用法:
+    from ngram_stats import ngram_frequency_curve
+    freqs, total = ngram_frequency_curve(indices, n=2, id_bound=index.ntotal)
+"""
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+DEFAULT_CHUNK_ROWS = 65536
+
+
+def key_width(id_bound):
+    """每个文档ID占用的位数（ID整体偏移1，使faiss的-1填充位也能被计数）"""
+    return max(1, int(id_bound).bit_length())
+
+
+def sliding_windows(indices, n):
+    """每行长度为 n 的滑动窗口（不复制数据），返回形状 (行数 * (k-n+1), n)"""
+    indices = np.asarray(indices)
+    if indices.shape[1] < n:
+        return np.empty((0, n), dtype=indices.dtype)
+    return sliding_window_view(indices, n, axis=1).reshape(-1, n)
+
+
+def pack_ngrams(windows, width):
+    """
+    将 n-gram 窗口打包成一维键
+    n * width <= 64 时打包进 uint64，否则把每行视为定长字节串 (np.void)
+    """
+    n = windows.shape[1]
+    shifted = windows.astype(np.int64) + 1
+    if n * width <= 64:
+        keys = np.zeros(len(windows), dtype=np.uint64)
+        for j in range(n):
+            keys = (keys << np.uint64(width)) | shifted[:, j].astype(np.uint64)
+        return keys
+    rows = np.ascontiguousarray(shifted, dtype=np.uint32 if width <= 32 else np.uint64)
+    return rows.view(np.dtype((np.void, rows.dtype.itemsize * n))).ravel()
+
+
+def unpack_ngrams(keys, n, width):
+    """把 pack_ngrams 得到的键还原为 (m, n) 的文档ID矩阵"""
+    if keys.dtype == np.uint64:
+        mask = np.uint64((1 << width) - 1)
+        windows = np.empty((len(keys), n), dtype=np.int64)
+        for j in range(n - 1, -1, -1):
+            windows[:, j] = (keys & mask).astype(np.int64)
+            keys = keys >> np.uint64(width)
+    else:
+        item_dtype = np.uint32 if width <= 32 else np.uint64
+        windows = np.frombuffer(np.ascontiguousarray(keys).tobytes(), dtype=item_dtype).reshape(-1, n).astype(np.int64)
+    return windows - 1
+
+
+def reduce_counts(keys, counts):
+    """对 (键, 计数) 做排序+游程合并，返回去重后的键和累加计数"""
+    if len(keys) == 0:
+        return keys, counts
+    order = np.argsort(keys, kind="stable")
+    sorted_keys = keys[order]
+    starts = np.concatenate(([0], np.flatnonzero(sorted_keys[1:] != sorted_keys[:-1]) + 1))
+    return sorted_keys[starts], np.add.reduceat(counts[order], starts)
+
+
+def count_ngrams_chunks(chunks, n, id_bound):
+    """
+    流式统计: chunks 为检索结果矩阵的行块（如 retrieval_store.iter_retrieval_chunks 的输出），
+    n-gram 不跨行，因此按行分块统计再合并是精确的。返回 (keys, counts, total)
+    """
+    width = key_width(id_bound)
+    keys = counts = None
+    total = 0
+    for chunk in chunks:
+        windows = sliding_windows(chunk, n)
+        if len(windows) == 0:
+            continue
+        chunk_keys, chunk_counts = np.unique(pack_ngrams(windows, width), return_counts=True)
+        total += len(windows)
+        if keys is None:
+            keys, counts = chunk_keys, chunk_counts.astype(np.int64)
+        else:
+            keys, counts = reduce_counts(np.concatenate((keys, chunk_keys)),
+                                         np.concatenate((counts, chunk_counts)))
+    if keys is None:
+        return np.empty(0, dtype=np.uint64), np.empty(0, dtype=np.int64), 0
+    return keys, counts, total
+
+
+def count_ngrams(indices, n, id_bound=None, chunk_rows=DEFAULT_CHUNK_ROWS):
+    """对完整的检索结果矩阵按 chunk_rows 行分块统计 n-gram，返回 (keys, counts, total)"""
+    indices = np.asarray(indices)
+    if id_bound is None:
+        id_bound = int(indices.max()) + 1 if indices.size else 1
+    chunks = (indices[start:start + chunk_rows] for start in range(0, len(indices), chunk_rows))
+    return count_ngrams_chunks(chunks, n, id_bound)
+
+
+def ngram_frequency_curve(indices, n, id_bound=None, chunk_rows=DEFAULT_CHUNK_ROWS):
+    """返回 (降序频率数组, n-gram总次数)，对应原脚本的 ngram_freq_sorted 和 len(ngrams)"""
+    _, counts, total = count_ngrams(indices, n, id_bound, chunk_rows)
+    return np.sort(counts)[::-1], total
+
+
+def top_ngrams(indices, n, num=10, id_bound=None, chunk_rows=DEFAULT_CHUNK_ROWS):
+    """频率最高的 num 个 n-gram，返回 [(文档ID元组, 次数), ...]（同频按键排序）"""
+    indices = np.asarray(indices)
+    if id_bound is None:
+        id_bound = int(indices.max()) + 1 if indices.size else 1
+    keys, counts, _ = count_ngrams(indices, n, id_bound, chunk_rows)
+    order = np.argsort(-counts, kind="stable")[:num]
+    windows = unpack_ngrams(keys[order], n, key_width(id_bound))
+    return [(tuple(int(d) for d in row), int(c)) for row, c in zip(windows, counts[order])]
@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+mmap 页级 I/O 模拟
+向量和正文通过 mmap 读取时，性能取决于缺页次数而不是文档级命中。本脚本把每个查询访问的文档
+（以及可选的HNSW第0层检索过程中访问的节点）映射到两个文件中的字节区间:
+- 嵌入文件 doc_embeddings_100k.npy: .npy头之后按存储位置排列的 float32 向量
+- 语料文件: 文档正文（UTF-8）按存储位置首尾相接存放，每篇的偏移为之前各篇长度之和
+再按页大小展开为页访问序列，用LRU页缓存（两个文件共享）重放，统计缺页次数和读取字节数
+
+LRU是栈算法，页访问序列的栈距离（reuse_distance.py 的树状数组实现）一次给出所有页缓存大小下的缺页数
+
+对比的存储布局（文档 -> 存储位置）:
+- id: 原始文档ID顺序
+- hotness: 按检索频率降序（热门文档集中在文件开头）
+- cluster: 按嵌入 k-means 聚类的簇排序（簇内按ID）
+- co_retrieval: 从最热门文档出发，贪心地把共同检索次数最多的未放置邻居排在后面
+
+用法:
+    python page_io_sim.py --dataset nq --topk 10 --page_sizes 4096 65536 --cache_mb 16 64 256
+    python page_io_sim.py --dataset nq --topk 10 --hnsw_queries 1000   # 计入HNSW检索访问的节点向量
+"""
+
+import os
+import json
+import argparse
+import numpy as np
+import matplotlib.pyplot as plt
+import faiss
+
+from retrieval_store import add_retrieval_args, load_or_search
+from co_retrieval import build_co_retrieval
+from cache_sim import load_doc_sizes, WIKI_DATA_PATH
+from reuse_distance import stack_distances, lru_hit_curve
+
+# 配置matplotlib中文字体支持
+plt.rcParams['font.sans-serif'] = ['SimHei', 'Microsoft YaHei', 'DejaVu Sans']
+plt.rcParams['axes.unicode_minus'] = False  # 正确显示负号
+
+EMBEDDINGS_PATH = "doc_embeddings_100k.npy"
+LAYOUTS = ["id", "hotness", "cluster", "co_retrieval"]
+DEFAULT_PAGE_SIZES = [4096, 16384, 65536]
+DEFAULT_CACHE_MB = [4, 16, 64, 256]
+NPY_HEADER_BYTES = 128  # 找不到嵌入文件时假定的 .npy 头长度
+EMBEDDING_FILE, CORPUS_FILE = 0, 1
+
+
+def id_layout(ntotal):
+    """原始ID顺序: 存储位置即文档ID"""
+    return np.arange(ntotal, dtype=np.int64)
+
+
+def hotness_layout(doc_freq):
+    """按检索频率降序（同频按ID）排列"""
+    docs = np.arange(len(doc_freq), dtype=np.int64)
+    return docs[np.lexsort((docs, -doc_freq))]
+
+
+def kmeans_assign(vectors, nlist=256, niter=20, seed=1234):
+    """faiss k-means 聚类，返回每个文档的簇号"""
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    kmeans = faiss.Kmeans(vectors.shape[1], nlist, niter=niter, seed=seed)
+    kmeans.train(vectors)
+    _, assign = kmeans.index.search(vectors, 1)
+    return assign.ravel().astype(np.int64)
+
+
+def cluster_layout(vectors, nlist=256, niter=20, seed=1234):
+    """按 k-means 簇号排序（簇内按ID），返回 (存储顺序, 每个文档的簇号)"""
+    assign = kmeans_assign(vectors, nlist, niter, seed)
+    return np.argsort(assign, kind="stable"), assign
+
+
+def co_retrieval_layout(matrix, doc_freq):
+    """
+    贪心链式排列: 按频率从高到低选未放置的文档作为链首，之后不断接上当前文档共同检索次数最多的未放置邻居，
+    没有可接的邻居时开始新链；从未被检索到的文档按ID排在最后
+    """
+    ntotal = len(doc_freq)
+    placed = np.zeros(ntotal, dtype=bool)
+    order = []
+    for seed in hotness_layout(doc_freq):
+        if doc_freq[seed] == 0:
+            break
+        current = int(seed)
+        while current >= 0 and not placed[current]:
+            placed[current] = True
+            order.append(current)
+            neighbors, _ = matrix.neighbors(current, num=matrix.num_docs)
+            free = neighbors[~placed[neighbors]]
+            current = int(free[0]) if len(free) else -1
+    order = np.asarray(order, dtype=np.int64)
+    return np.concatenate((order, np.flatnonzero(~placed)))
+
+
+def positions_from_order(order):
+    """存储顺序（位置 -> 文档）转为文档 -> 存储位置"""
+    positions = np.empty(len(order), dtype=np.int64)
+    positions[order] = np.arange(len(order))
+    return positions
+
+
+def build_accesses(indices, hnsw_sequences=None):
+    """
+    按查询顺序生成文档访问序列，返回 (文件编号, 文档ID) 两个数组:
+    每个查询先访问HNSW第0层访问过的节点向量（若提供），再读取 top-k 文档的向量和正文
+    """
+    files, docs = [], []
+    for i, row in enumerate(np.asarray(indices)):
+        row = row[row >= 0]
+        if hnsw_sequences is not None and i < len(hnsw_sequences):
+            files.append(np.full(len(hnsw_sequences[i]), EMBEDDING_FILE, dtype=np.int8))
+            docs.append(np.asarray(hnsw_sequences[i], dtype=np.int64))
+        files.append(np.full(len(row), EMBEDDING_FILE, dtype=np.int8))
+        docs.append(row.astype(np.int64))
+        files.append(np.full(len(row), CORPUS_FILE, dtype=np.int8))
+        docs.append(row.astype(np.int64))
+    if not docs:
+        return np.empty(0, dtype=np.int8), np.empty(0, dtype=np.int64)
+    return np.concatenate(files), np.concatenate(docs)
+
+
+def range_pages(start, length, page_size):
+    """把一组字节区间 [start, start+length) 按顺序展开为覆盖的页号序列"""
+    first = start // page_size
+    last = (start + np.maximum(length, 1) - 1) // page_size
+    spans = last - first + 1
+    return np.repeat(first, spans) + (np.arange(spans.sum()) - np.repeat(np.cumsum(spans) - spans, spans))
+
+
+def page_trace(files, docs, positions, vector_bytes, header_bytes, doc_sizes, page_size):
+    """
+    把文档访问展开为页访问序列（语料文件的页号排在嵌入文件的页之后），
+    返回 (页号序列, 请求的字节数)
+    """
+    pos = positions[docs]
+    corpus_offsets = np.zeros(len(positions) + 1, dtype=np.int64)
+    np.cumsum(doc_sizes[np.argsort(positions)], out=corpus_offsets[1:])
+    is_emb = files == EMBEDDING_FILE
+    start = np.where(is_emb, header_bytes + pos * vector_bytes, corpus_offsets[pos])
+    length = np.where(is_emb, vector_bytes, doc_sizes[docs])
+    emb_pages = (header_bytes + len(positions) * vector_bytes) // page_size + 1
+    start = np.where(is_emb, start, start + emb_pages * page_size)
+    return range_pages(start, length, page_size), int(length.sum())
+
+
+def fault_curve(pages):
+    """
+    所有页缓存大小下的缺页数: 返回数组第 C 项为缓存 C 页时的缺页次数
+    连续重复访问同一页在任何缓存大小下都命中，先去掉再求栈距离
+    """
+    if len(pages) == 0:
+        return np.zeros(1, dtype=np.int64)
+    keep = np.concatenate(([True], pages[1:] != pages[:-1]))
+    compact = pages[keep]
+    distances = stack_distances(compact)
+    hits = np.round(lru_hit_curve(distances) * len(compact)).astype(np.int64)
+    return len(compact) - hits
+
+
+def simulate_layouts(files, docs, layouts, vector_bytes, header_bytes, doc_sizes, page_sizes, cache_mb, log=print):
+    """对每种布局、每个页大小求缺页曲线，并取出各页缓存大小下的结果"""
+    results = []
+    for name, positions in layouts.items():
+        for page_size in page_sizes:
+            pages, requested = page_trace(files, docs, positions, vector_bytes, header_bytes, doc_sizes, page_size)
+            faults = fault_curve(pages)
+            log(f"布局 {name}, 页大小 {page_size}: 页访问 {len(pages)} 次, 不同页 {len(np.unique(pages))}")
+            for mb in cache_mb:
+                capacity = int(mb * 1024 * 1024 // page_size)
+                num_faults = int(faults[min(capacity, len(faults) - 1)])
+                results.append({"layout": name, "page_size": page_size, "cache_mb": mb,
+                                "page_accesses": int(len(pages)), "faults": num_faults,
+                                "fault_rate": num_faults / len(pages) if len(pages) else 0.0,
+                                "bytes_read": num_faults * page_size,
+                                "read_amplification": num_faults * page_size / requested if requested else 0.0,
+                                "distinct_pages": int(len(np.unique(pages)))})
+    return results
+
+
+def write_page_io_report(path, dataset_name, topk, num_queries, hnsw_queries, results):
+    """保存各布局、页大小、页缓存大小下的缺页数和读取量"""
+    lines = [f"mmap页级I/O模拟 - {dataset_name.upper()} Top-{topk}",
+             f"查询数: {num_queries}" + (f", 其中前 {hnsw_queries} 个计入HNSW第0层访问的节点向量" if hnsw_queries else ""),
+             f"\n{'布局':<14}{'页大小':>8}{'缓存MB':>8}{'页访问':>12}{'缺页':>12}{'缺页率%':>9}{'读取MB':>10}{'读放大':>8}"]
+    for r in results:
+        lines.append(f"{r['layout']:<14}{r['page_size']:>8}{r['cache_mb']:>8g}{r['page_accesses']:>12}{r['faults']:>12}"
+                     f"{r['fault_rate'] * 100:>9.2f}{r['bytes_read'] / 1e6:>10.2f}{r['read_amplification']:>8.2f}")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("\n".join(lines) + "\n")
+    for line in lines:
+        print(line)
+
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description="mmap页级I/O模拟")
+    add_retrieval_args(parser)
+    parser.add_argument("--embeddings", type=str, default=EMBEDDINGS_PATH, help="文档嵌入 .npy 文件")
+    parser.add_argument("--corpus", type=str, default=WIKI_DATA_PATH, help="语料库JSON（用于文档正文长度）")
+    parser.add_argument("--layouts", type=str, nargs="+", default=LAYOUTS, choices=LAYOUTS, help="要对比的存储布局")
+    parser.add_argument("--page_sizes", type=int, nargs="+", default=DEFAULT_PAGE_SIZES, help="页大小（字节）")
+    parser.add_argument("--cache_mb", type=float, nargs="+", default=DEFAULT_CACHE_MB, help="页缓存大小（MB）")
+    parser.add_argument("--nlist", type=int, default=256, help="cluster布局的聚类数 (默认: 256)")
+    parser.add_argument("--hnsw_queries", type=int, default=0,
+                        help="重放前N个查询的HNSW检索过程并计入访问的节点向量，0表示不计入 (默认: 0)")
+    args = parser.parse_args()
+
+    dataset_name = args.dataset.lower()
+    topk = args.topk
+    print(f"加载索引 {args.index}...")
+    index = faiss.read_index(args.index)
+    query_embs, _, indices = load_or_search(args.index, dataset_name, topk, index)
+
+    ntotal = index.ntotal
+    if os.path.exists(args.embeddings):
+        vectors = np.load(args.embeddings, mmap_mode="r")
+        header_bytes = int(vectors.offset)
+    else:
+        print(f"未找到嵌入文件 {args.embeddings}，从索引重建向量并假定 .npy 头为 {NPY_HEADER_BYTES} 字节")
+        vectors = index.reconstruct_n(0, ntotal)
+        header_bytes = NPY_HEADER_BYTES
+    vector_bytes = index.d * 4
+    doc_sizes = load_doc_sizes(ntotal, args.corpus)
+    flat = np.asarray(indices).ravel()
+    doc_freq = np.bincount(flat[flat >= 0], minlength=ntotal).astype(np.int64)
+
+    layouts = {}
+    for name in args.layouts:
+        print(f"生成 {name} 布局...")
+        if name == "id":
+            order = id_layout(ntotal)
+        elif name == "hotness":
+            order = hotness_layout(doc_freq)
+        elif name == "cluster":
+            order, _ = cluster_layout(vectors, args.nlist)
+        else:
+            order = co_retrieval_layout(build_co_retrieval([indices], ntotal), doc_freq)
+        layouts[name] = positions_from_order(order)
+
+    hnsw_sequences = None
+    if args.hnsw_queries > 0:
+        from hnsw_traversal import HNSWGraph, traverse
+        print(f"重放前 {args.hnsw_queries} 个查询的HNSW检索过程...")
+        graph = HNSWGraph(index, vectors=np.asarray(vectors))
+        hnsw_sequences = traverse(graph, query_embs[:args.hnsw_queries], topk, record_sequences=True)["sequences"]
+
+    files, docs = build_accesses(indices, hnsw_sequences)
+    results = simulate_layouts(files, docs, layouts, vector_bytes, header_bytes, doc_sizes,
+                               sorted(args.page_sizes), sorted(args.cache_mb))
+
+    report_path = f"page_io_sim_{dataset_name}_top{topk}.txt"
+    write_page_io_report(report_path, dataset_name, topk, len(indices), args.hnsw_queries, results)
+    with open(f"page_io_sim_{dataset_name}_top{topk}.json", "w", encoding="utf-8") as f:
+        json.dump({"args": vars(args), "results": results}, f, ensure_ascii=False, indent=2)
+
+    plot_path = f"page_io_sim_{dataset_name}_top{topk}.png"
+    page_size = min(args.page_sizes)
+    plt.figure(figsize=(10, 6))
+    for name in layouts:
+        rows = [r for r in results if r["layout"] == name and r["page_size"] == page_size]
+        plt.plot([r["cache_mb"] for r in rows], [r["bytes_read"] / 1e6 for r in rows], marker='o', label=name)
+    plt.xscale('log')
+    plt.title(f"各存储布局的mmap读取量 - {dataset_name.upper()} Top-{topk} (页大小 {page_size} 字节)")
+    plt.xlabel("页缓存大小 (MB)")
+    plt.ylabel("读取量 (MB)")
+    plt.legend()
+    plt.grid(True)
+    plt.savefig(plot_path)
+    print(f"页级I/O模拟结果保存到 {report_path}，读取量曲线保存为 {plot_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+线程池并行检索
+将查询集切分为批次，由线程池并发调用 index.search（faiss在检索时释放GIL），
+每个工作线程单独设置OpenMP线程数；并提供在当前机器上实测不同
+(工作线程数, OpenMP线程数, 批次大小) 组合QPS、自动选择检索策略的工具
+
+用法:
+    python parallel_search.py --dataset nq --topk 10 --threads 64
+"""
+
+import os
+import time
+import argparse
+import numpy as np
+import faiss
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_BATCH_SIZES = [64, 256, 512, 2048]
+
+
+def _init_worker_threads(omp_threads):
+    """工作线程初始化：OpenMP线程数是线程级设置，需要在每个工作线程中分别设置"""
+    if omp_threads is not None and omp_threads > 0:
+        faiss.omp_set_num_threads(omp_threads)
+
+
+def parallel_search(index, query_embs, topk, num_workers=1, omp_threads=None, batch_size=512):
+    """线程池并行检索，返回 (distances, indices)，与 index.search 结果一致"""
+    query_embs = np.ascontiguousarray(query_embs, dtype=np.float32)
+    nq = query_embs.shape[0]
+    distances = np.empty((nq, topk), dtype=np.float32)
+    indices = np.empty((nq, topk), dtype=np.int64)
+
+    def search_batch(start):
+        end = min(start + batch_size, nq)
+        distances[start:end], indices[start:end] = index.search(query_embs[start:end], topk)
+
+    if num_workers <= 1:
+        _init_worker_threads(omp_threads)
+        for start in range(0, nq, batch_size):
+            search_batch(start)
+        return distances, indices
+
+    with ThreadPoolExecutor(max_workers=num_workers, initializer=_init_worker_threads,
+                            initargs=(omp_threads,)) as executor:
+        # list() 触发结果收集，使工作线程中的异常在此处抛出
+        list(executor.map(search_batch, range(0, nq, batch_size)))
+    return distances, indices
+
+
+def candidate_policies(total_threads, batch_sizes=None):
+    """枚举并行度拆分: 工作线程数 × 每线程OpenMP线程数 = 总线程数"""
+    policies = []
+    num_workers = 1
+    while num_workers <= total_threads:
+        omp_threads = max(1, total_threads // num_workers)
+        for batch_size in batch_sizes or DEFAULT_BATCH_SIZES:
+            policies.append({"num_workers": num_workers, "omp_threads": omp_threads, "batch_size": batch_size})
+        num_workers *= 2
+    return policies
+
+
+def benchmark_policies(index, query_embs, topk, policies, repeat=3, log=print):
+    """实测每种策略的QPS（取多次运行中的最佳耗时），返回按QPS降序排列的结果"""
+    results = []
+    main_threads = faiss.omp_get_max_threads()
+    for policy in policies:
+        best_seconds = float("inf")
+        for _ in range(repeat):
+            start = time.perf_counter()
+            parallel_search(index, query_embs, topk, **policy)
+            best_seconds = min(best_seconds, time.perf_counter() - start)
+        result = dict(policy)
+        result["seconds"] = best_seconds
+        result["qps"] = len(query_embs) / best_seconds if best_seconds > 0 else float("inf")
+        results.append(result)
+        if log is not None:
+            log(f"workers={policy['num_workers']:3d} omp={policy['omp_threads']:3d} "
+                f"batch={policy['batch_size']:5d}: {result['qps']:.1f} QPS")
+    # 单线程路径会修改主线程的OpenMP设置，测试结束后恢复
+    faiss.omp_set_num_threads(main_threads)
+    return sorted(results, key=lambda r: r["qps"], reverse=True)
+
+
+def tune_search_policy(index, query_embs, topk, total_threads=None, batch_sizes=None,
+                       sample_size=4096, repeat=2, log=print):
+    """在查询样本上测量各策略，返回 (最佳策略, 全部测量结果)"""
+    total_threads = total_threads or os.cpu_count() or 1
+    sample = query_embs[:sample_size]
+    results = benchmark_policies(index, sample, topk, candidate_policies(total_threads, batch_sizes),
+                                 repeat=repeat, log=log)
+    best = {key: results[0][key] for key in ("num_workers", "omp_threads", "batch_size")}
+    return best, results
+
+
+def write_policy_report(path, results, topk, num_queries):
+    """保存各策略的QPS表"""
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(f"查询数: {num_queries}, Top-k: {topk}, 主机CPU核数: {os.cpu_count()}\n")
+        f.write("workers,omp_threads,batch_size,seconds,qps\n")
+        for r in results:
+            f.write(f"{r['num_workers']},{r['omp_threads']},{r['batch_size']},{r['seconds']:.4f},{r['qps']:.1f}\n")
+        best = results[0]
+        f.write(f"\n最佳策略: workers={best['num_workers']}, omp_threads={best['omp_threads']}, "
+                f"batch_size={best['batch_size']} ({best['qps']:.1f} QPS)\n")
+
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description="faiss并行检索策略测量")
+    parser.add_argument("--dataset", type=str, default="mmlu", choices=["mmlu", "nq", "hotpotqa", "triviaqa"],
+                        help="选择查询数据集: mmlu, nq, hotpotqa, triviaqa")
+    parser.add_argument("--topk", type=int, default=10, help="检索的top-k值 (默认: 10)")
+    parser.add_argument("--index", type=str, default="hnsw_index_100k.bin", help="faiss索引文件")
+    parser.add_argument("--threads", type=int, default=0, help="总线程数，0表示CPU核数 (默认: 0)")
+    parser.add_argument("--sample", type=int, default=4096, help="用于测量的查询数 (默认: 4096)")
+    parser.add_argument("--repeat", type=int, default=3, help="每种策略的重复次数 (默认: 3)")
+    args = parser.parse_args()
+
+    query_embeddings_path = os.path.join("dataset_cache", f"query_embeddings_{args.dataset}.npy")
+    if not os.path.exists(query_embeddings_path):
+        raise FileNotFoundError(f"未找到查询嵌入 {query_embeddings_path}，请先运行 wikipead_all_degree.py 生成")
+
+    print(f"加载索引 {args.index} 和查询嵌入 {query_embeddings_path}...")
+    index = faiss.read_index(args.index)
+    query_embs = np.load(query_embeddings_path)[:args.sample]
+    total_threads = args.threads or os.cpu_count() or 1
+
+    results = benchmark_policies(index, query_embs, args.topk, candidate_policies(total_threads),
+                                 repeat=args.repeat)
+    report_path = f"search_policy_{args.dataset}_top{args.topk}.txt"
+    write_policy_report(report_path, results, args.topk, len(query_embs))
+    best = results[0]
+    print(f"最佳策略: workers={best['num_workers']}, omp_threads={best['omp_threads']}, "
+          f"batch_size={best['batch_size']} ({best['qps']:.1f} QPS)")
+    print(f"策略测量结果保存到 {report_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+基于共同检索统计的文档预取模拟
+把查询序列按顺序划分为训练段和留出段:
+1. 在训练段上从文档对统计学习"A => B"预取规则（置信度 = 次数(A,B) / 次数(A)），每个文档保留置信度最高的若干条
+   - co: 同一查询 top-k 中共同出现的文档对（co_retrieval.py）
+   - adjacent: 检索列表中相邻的有序文档对（hot_pair_in_seq.py 中的2-gram）
+2. 在留出段上重放文档访问，模拟带预取的LRU文档缓存（容量以文档数计），与不预取的LRU对比:
+   命中率提升、预取带宽浪费（取回后直到被淘汰或结束都没被用到的文档字节数）、预取准确率、
+   以及按单次缺失延迟估算的每个查询节省的取文档延迟
+
+触发方式:
+- query: 一个查询的 top-k 文档同时取回，取完后才按其中各文档的规则预取（只能帮助后续查询，保守估计）
+- doc: 按排名逐个取文档，每取一个立即预取其关联文档（可帮助同一查询中排名靠后的文档）
+
+用法:
+    python prefetch_sim.py --dataset nq --topk 10 --train_ratio 0.5 --fanout 2 --min_confidence 0.2
+"""
+
+import json
+import argparse
+from collections import OrderedDict
+import numpy as np
+import matplotlib.pyplot as plt
+import faiss
+
+from retrieval_store import add_retrieval_args, load_or_search
+from co_retrieval import build_co_retrieval
+from ngram_stats import count_ngrams, unpack_ngrams, key_width
+from cache_sim import load_doc_sizes, WIKI_DATA_PATH
+
+# 配置matplotlib中文字体支持
+plt.rcParams['font.sans-serif'] = ['SimHei', 'Microsoft YaHei', 'DejaVu Sans']
+plt.rcParams['axes.unicode_minus'] = False  # 正确显示负号
+
+DEFAULT_CAPACITIES = [0.001, 0.005, 0.01, 0.05]  # 占语料库文档数的比例
+RULE_SOURCES = ["co", "adjacent"]
+
+
+def split_queries(indices, train_ratio=0.5, shuffle=False, seed=0):
+    """按查询顺序（或打乱后）划分训练段和留出段"""
+    indices = np.asarray(indices)
+    if shuffle:
+        indices = indices[np.random.default_rng(seed).permutation(len(indices))]
+    cut = int(len(indices) * train_ratio)
+    return indices[:cut], indices[cut:]
+
+
+def doc_frequencies(indices, id_bound):
+    """每个文档在检索结果中出现的次数（-1填充位不计）"""
+    flat = np.asarray(indices).ravel()
+    return np.bincount(flat[flat >= 0], minlength=id_bound).astype(np.int64)
+
+
+def co_retrieval_pairs(indices, id_bound):
+    """同一查询中共同出现的文档对（两个方向），返回 (A, B, 次数)"""
+    matrix = build_co_retrieval([np.asarray(indices)], id_bound)
+    rows = np.repeat(np.arange(matrix.num_docs, dtype=np.int64), np.diff(matrix.indptr))
+    return rows, np.asarray(matrix.indices, dtype=np.int64), np.asarray(matrix.data, dtype=np.int64)
+
+
+def adjacent_pairs(indices, id_bound):
+    """检索列表中相邻的有序文档对 (A 排在 B 之前)，返回 (A, B, 次数)"""
+    keys, counts, _ = count_ngrams(indices, 2, id_bound)
+    pairs = unpack_ngrams(keys, 2, key_width(id_bound))
+    valid = (pairs[:, 0] >= 0) & (pairs[:, 1] >= 0) & (pairs[:, 0] != pairs[:, 1])
+    return pairs[valid, 0], pairs[valid, 1], counts[valid].astype(np.int64)
+
+
+PAIR_FUNCTIONS = {"co": co_retrieval_pairs, "adjacent": adjacent_pairs}
+
+
+def learn_rules(sources, targets, counts, doc_freq, min_support=2, min_confidence=0.1, fanout=2):
+    """
+    由文档对统计学习预取规则，每个源文档保留置信度最高的 fanout 条（同置信度按目标文档ID）
+    返回CSR形式的规则表 (indptr, targets, confidence)
+    """
+    confidence = counts / np.maximum(doc_freq[sources], 1)
+    keep = (counts >= min_support) & (confidence >= min_confidence)
+    sources, targets, confidence = sources[keep], targets[keep], confidence[keep]
+    order = np.lexsort((targets, -confidence, sources))
+    sources, targets, confidence = sources[order], targets[order], confidence[order]
+    # 组内名次: 当前位置 - 所在源文档组的起始位置
+    group_start = np.searchsorted(sources, sources, side="left")
+    top = np.arange(len(sources)) - group_start < fanout
+    sources, targets, confidence = sources[top], targets[top], confidence[top]
+    indptr = np.zeros(len(doc_freq) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(sources, minlength=len(doc_freq)), out=indptr[1:])
+    return indptr, targets, confidence
+
+
+def heldout_confidence(rule_indptr, rule_targets, indices, id_bound, pair_fn=co_retrieval_pairs):
+    """
+    规则在留出段上的平均置信度（按源文档出现次数加权）: 用与学习规则相同的文档对定义 pair_fn 统计留出段，
+    co 为源文档出现的查询中目标文档也出现的比例，adjacent 为源文档之后紧接着目标文档的比例
+    """
+    sources = np.repeat(np.arange(len(rule_indptr) - 1, dtype=np.int64), np.diff(rule_indptr))
+    if len(sources) == 0:
+        return 0.0
+    rows, cols, counts = pair_fn(indices, id_bound)
+    pair_keys = rows * id_bound + cols
+    order = np.argsort(pair_keys, kind="stable")
+    pair_keys, counts = pair_keys[order], counts[order]
+    rule_keys = sources * id_bound + rule_targets
+    pos = np.minimum(np.searchsorted(pair_keys, rule_keys), max(len(pair_keys) - 1, 0))
+    matched = np.where(pair_keys[pos] == rule_keys, counts[pos], 0) if len(pair_keys) else np.zeros(len(rule_keys))
+    freq = doc_frequencies(indices, id_bound)[sources]
+    return float(matched.sum() / freq.sum()) if freq.sum() else 0.0
+
+
+def simulate_prefetch(rows, capacity, doc_sizes, rule_indptr=None, rule_targets=None, trigger="query"):
+    """
+    带预取的LRU文档缓存（rule_indptr 为 None 时即不预取的基线）
+    预取的文档放入最近使用端；被访问前就被淘汰或到结束都没被访问的计为浪费
+    """
+    cache = OrderedDict()  # 文档 -> 是否为尚未被访问的预取文档
+    stats = {"accesses": 0, "hits": 0, "prefetch_hits": 0, "prefetches": 0, "prefetch_bytes": 0,
+             "wasted_prefetches": 0, "wasted_bytes": 0, "demand_bytes": 0}
+    indptr = rule_indptr.tolist() if rule_indptr is not None else None
+    targets = rule_targets.tolist() if rule_targets is not None else None
+
+    def insert(doc, prefetched):
+        cache[doc] = prefetched
+        if len(cache) > capacity:
+            victim, unused = cache.popitem(last=False)
+            if unused:
+                stats["wasted_prefetches"] += 1
+                stats["wasted_bytes"] += int(doc_sizes[victim])
+
+    def access(doc):
+        stats["accesses"] += 1
+        if doc in cache:
+            stats["hits"] += 1
+            if cache[doc]:
+                stats["prefetch_hits"] += 1
+                cache[doc] = False
+            cache.move_to_end(doc)
+        else:
+            stats["demand_bytes"] += int(doc_sizes[doc])
+            insert(doc, False)
+
+    def prefetch(doc):
+        for target in targets[indptr[doc]:indptr[doc + 1]]:
+            if target not in cache:
+                stats["prefetches"] += 1
+                stats["prefetch_bytes"] += int(doc_sizes[target])
+                insert(target, True)
+
+    for row in np.asarray(rows).tolist():
+        docs = [doc for doc in row if doc >= 0]
+        for doc in docs:
+            access(doc)
+            if indptr is not None and trigger == "doc":
+                prefetch(doc)
+        if indptr is not None and trigger == "query":
+            for doc in docs:
+                prefetch(doc)
+    # 结束时仍未被访问的预取文档同样计为浪费
+    for doc, unused in cache.items():
+        if unused:
+            stats["wasted_prefetches"] += 1
+            stats["wasted_bytes"] += int(doc_sizes[doc])
+    stats["num_queries"] = len(rows)
+    return stats
+
+
+def summarize(baseline, result, miss_latency_ms):
+    """预取相对基线的各项指标"""
+    accesses = max(result["accesses"], 1)
+    base_misses = baseline["accesses"] - baseline["hits"]
+    misses = result["accesses"] - result["hits"]
+    return {
+        "baseline_hit_ratio": baseline["hits"] / accesses,
+        "hit_ratio": result["hits"] / accesses,
+        "hit_gain": (result["hits"] - baseline["hits"]) / accesses,
+        "miss_reduction": (base_misses - misses) / base_misses if base_misses else 0.0,
+        "prefetches_per_query": result["prefetches"] / max(result["num_queries"], 1),
+        "accuracy": result["prefetch_hits"] / result["prefetches"] if result["prefetches"] else 0.0,
+        "wasted_bytes": result["wasted_bytes"],
+        "wasted_bandwidth_ratio": (result["wasted_bytes"] / (result["demand_bytes"] + result["prefetch_bytes"])
+                                   if result["demand_bytes"] + result["prefetch_bytes"] else 0.0),
+        "latency_saved_ms_per_query": (base_misses - misses) * miss_latency_ms / max(result["num_queries"], 1),
+    }
+
+
+def write_prefetch_report(path, dataset_name, topk, train_size, test_size, rule_info, results, capacities):
+    """保存每种规则来源、每个容量下的预取效果"""
+    lines = [f"共同检索预取模拟 - {dataset_name.upper()} Top-{topk}",
+             f"训练段查询数: {train_size}, 留出段查询数: {test_size}"]
+    for source, (num_rules, num_sources, confidence) in rule_info.items():
+        lines.append(f"规则来源 {source}: {num_rules} 条规则覆盖 {num_sources} 个源文档，留出段置信度 {confidence * 100:.2f}%")
+    lines.append(f"\n{'来源':<10}{'容量':>8}{'基线命中%':>10}{'预取命中%':>10}{'提升%':>8}{'缺失减少%':>10}"
+                 f"{'预取/查询':>10}{'准确率%':>9}{'浪费MB':>10}{'浪费带宽%':>10}{'省延迟ms/查询':>14}")
+    for r in results:
+        lines.append(f"{r['source']:<10}{r['capacity']:>8}{r['baseline_hit_ratio'] * 100:>10.2f}{r['hit_ratio'] * 100:>10.2f}"
+                     f"{r['hit_gain'] * 100:>8.2f}{r['miss_reduction'] * 100:>10.2f}{r['prefetches_per_query']:>10.2f}"
+                     f"{r['accuracy'] * 100:>9.2f}{r['wasted_bytes'] / 1e6:>10.2f}{r['wasted_bandwidth_ratio'] * 100:>10.2f}"
+                     f"{r['latency_saved_ms_per_query']:>14.3f}")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("\n".join(lines) + "\n")
+    for line in lines:
+        print(line)
+
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description="基于共同检索统计的文档预取模拟")
+    add_retrieval_args(parser)
+    parser.add_argument("--capacities", type=float, nargs="+", default=DEFAULT_CAPACITIES,
+                        help="缓存容量: <1 表示占语料库文档数的比例，>=1 表示文档数")
+    parser.add_argument("--sources", type=str, nargs="+", default=RULE_SOURCES, choices=RULE_SOURCES,
+                        help="规则来源: co（同查询共同检索）, adjacent（相邻文档对）")
+    parser.add_argument("--train_ratio", type=float, default=0.5, help="训练段占查询数的比例 (默认: 0.5)")
+    parser.add_argument("--shuffle", action="store_true", help="打乱查询顺序后再划分")
+    parser.add_argument("--seed", type=int, default=0, help="打乱顺序的随机种子 (默认: 0)")
+    parser.add_argument("--fanout", type=int, default=2, help="每个文档最多预取的关联文档数 (默认: 2)")
+    parser.add_argument("--min_support", type=int, default=2, help="规则的最小文档对次数 (默认: 2)")
+    parser.add_argument("--min_confidence", type=float, default=0.1, help="规则的最小置信度 (默认: 0.1)")
+    parser.add_argument("--trigger", type=str, default="query", choices=["query", "doc"], help="预取触发方式")
+    parser.add_argument("--miss_latency_ms", type=float, default=1.0, help="单次文档缺失的取回延迟（毫秒，默认: 1.0）")
+    parser.add_argument("--corpus", type=str, default=WIKI_DATA_PATH, help="语料库JSON（用于计算带宽）")
+    args = parser.parse_args()
+
+    dataset_name = args.dataset.lower()
+    topk = args.topk
+    print(f"加载索引 {args.index}...")
+    index = faiss.read_index(args.index)
+    _, _, indices = load_or_search(args.index, dataset_name, topk, index)
+
+    id_bound = index.ntotal
+    train, test = split_queries(indices, args.train_ratio, args.shuffle, args.seed)
+    doc_sizes = load_doc_sizes(id_bound, args.corpus)
+    doc_freq = doc_frequencies(train, id_bound)
+    capacities = sorted({int(c * id_bound) if c < 1 else int(c) for c in args.capacities} - {0})
+    baselines = {capacity: simulate_prefetch(test, capacity, doc_sizes) for capacity in capacities}
+
+    rule_info, results = {}, []
+    for source in args.sources:
+        pair_fn = PAIR_FUNCTIONS[source]
+        rule_indptr, rule_targets, _ = learn_rules(*pair_fn(train, id_bound), doc_freq, args.min_support,
+                                                   args.min_confidence, args.fanout)
+        rule_info[source] = (len(rule_targets), int(np.count_nonzero(np.diff(rule_indptr))),
+                             heldout_confidence(rule_indptr, rule_targets, test, id_bound, pair_fn))
+        for capacity in capacities:
+            stats = simulate_prefetch(test, capacity, doc_sizes, rule_indptr, rule_targets, args.trigger)
+            result = summarize(baselines[capacity], stats, args.miss_latency_ms)
+            result.update(source=source, capacity=capacity)
+            results.append(result)
+
+    report_path = f"prefetch_sim_{dataset_name}_top{topk}.txt"
+    write_prefetch_report(report_path, dataset_name, topk, len(train), len(test), rule_info, results, capacities)
+    with open(f"prefetch_sim_{dataset_name}_top{topk}.json", "w", encoding="utf-8") as f:
+        json.dump({"args": vars(args), "results": results}, f, ensure_ascii=False, indent=2)
+
+    plot_path = f"prefetch_sim_{dataset_name}_top{topk}.png"
+    plt.figure(figsize=(10, 6))
+    plt.plot(capacities, [results[i]["baseline_hit_ratio"] * 100 for i in range(len(capacities))],
+             marker='o', label="LRU（无预取）")
+    for source in args.sources:
+        plt.plot(capacities, [r["hit_ratio"] * 100 for r in results if r["source"] == source],
+                 marker='o', label=f"LRU + 预取 ({source})")
+    plt.xscale('log')
+    plt.title(f"预取对留出段命中率的影响 - {dataset_name.upper()} Top-{topk}")
+    plt.xlabel("缓存容量 (文档数)")
+    plt.ylabel("命中率 (%)")
+    plt.legend()
+    plt.grid(True)
+    plt.savefig(plot_path)
+    print(f"预取模拟结果保存到 {report_path}，命中率曲线保存为 {plot_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+批量检索引擎
+将整个查询列表一次性分批编码、分批检索，返回 (distances, indices) 矩阵，
+替代各分析脚本中逐条查询的 get_embedding([query]) + index.search 循环
+"""
+
+import os
+import json
+import numpy as np
+import faiss
+from parallel_search import parallel_search
+
+# 默认批次大小（编码受显存/内存限制，检索批次可以更大）
+DEFAULT_ENCODE_BATCH_SIZE = 256
+DEFAULT_SEARCH_BATCH_SIZE = 4096
+
+# 默认本地模型路径（与各分析脚本保持一致）
+DEFAULT_LOCAL_MODEL_PATHS = [
+    r"L:\huggingface\cache\hub",  # HuggingFace cache路径
+    "./models/BAAI_bge-large-en-v1.5",
+    "./BAAI_bge-large-en-v1.5",
+    "models/BAAI_bge-large-en-v1.5",
+    "BAAI_bge-large-en-v1.5"
+]
+DEFAULT_MODEL_NAME = "BAAI/bge-large-en-v1.5"
+
+# 查询数据集配置 (HuggingFace名称, 配置, split, 查询字段)
+DATASET_SOURCES = {
+    "mmlu": ("cais/mmlu", "all", "validation", "question"),
+    "nq": ("google-research-datasets/nq_open", None, "validation", "question"),
+    "hotpotqa": ("hotpot_qa", "fullwiki", "validation", "question"),
+    "triviaqa": ("mandarjoshi/trivia_qa", "rc", "validation", "question")
+}
+
+
+def set_search_threads(num_threads):
+    """设置faiss检索使用的OpenMP线程数 (None或<=0表示保持默认)"""
+    if num_threads is not None and num_threads > 0:
+        faiss.omp_set_num_threads(num_threads)
+
+
+def load_embedding_model(local_model_paths=None, model_name=DEFAULT_MODEL_NAME, log=print):
+    """优先从本地路径加载嵌入模型，失败时从Hugging Face下载"""
+    from sentence_transformers import SentenceTransformer
+
+    for local_path in local_model_paths or DEFAULT_LOCAL_MODEL_PATHS:
+        if os.path.exists(local_path):
+            try:
+                log(f"使用本地缓存模型: {local_path}")
+                return SentenceTransformer(local_path)
+            except Exception as e:
+                log(f"加载本地模型失败 {local_path}: {e}")
+                continue
+    log("未找到本地缓存模型，从Hugging Face下载...")
+    return SentenceTransformer(model_name)
+
+
+def load_queries(dataset_name, cache_dir="dataset_cache", log=print):
+    """加载查询数据集（优先读取 dataset_cache 下的本地缓存）"""
+    dataset_cache_path = os.path.join(cache_dir, f"{dataset_name}_validation.json")
+    if os.path.exists(dataset_cache_path):
+        log(f"找到本地缓存数据集 {dataset_cache_path}，加载中...")
+        with open(dataset_cache_path, "r", encoding="utf-8") as f:
+            query_data = json.load(f)
+        return [item["question"] for item in query_data]
+
+    if dataset_name not in DATASET_SOURCES:
+        raise ValueError(f"未知数据集: {dataset_name}")
+    from datasets import load_dataset
+
+    log("未找到本地缓存数据集，从Hugging Face下载...")
+    dataset_path, config, split, query_key = DATASET_SOURCES[dataset_name]
+    query_dataset = load_dataset(dataset_path, config, split=split)
+    query_data = [{"question": item[query_key]} for item in query_dataset]
+    os.makedirs(cache_dir, exist_ok=True)
+    with open(dataset_cache_path, "w", encoding="utf-8") as f:
+        json.dump(query_data, f, ensure_ascii=False)
+    log(f"数据集保存到 {dataset_cache_path}")
+    return [item["question"] for item in query_data]
+
+
+def encode_queries(model, queries, batch_size=DEFAULT_ENCODE_BATCH_SIZE, log=print):
+    """分批编码查询，返回标准化后的 float32 嵌入矩阵"""
+    dim = model.get_sentence_embedding_dimension()
+    embeddings = np.empty((len(queries), dim), dtype=np.float32)
+    for start in range(0, len(queries), batch_size):
+        batch = queries[start:start + batch_size]
+        embeddings[start:start + len(batch)] = model.encode(
+            batch, batch_size=batch_size, normalize_embeddings=True, show_progress_bar=False)
+        if log is not None:
+            log(f"查询嵌入进度: {start + len(batch)} / {len(queries)}")
+    return embeddings
+
+
+def load_query_embeddings(dataset_name, cache_dir="dataset_cache", model=None, log=print):
+    """加载缓存的查询嵌入 (query_embeddings_{dataset}.npy)，不存在时编码并保存"""
+    query_embeddings_path = os.path.join(cache_dir, f"query_embeddings_{dataset_name}.npy")
+    if os.path.exists(query_embeddings_path):
+        log(f"找到查询嵌入文件 {query_embeddings_path}，加载中...")
+        return np.load(query_embeddings_path)
+    log("未找到查询嵌入文件，生成嵌入...")
+    queries = load_queries(dataset_name, cache_dir=cache_dir, log=log)
+    query_embs = encode_queries(model or load_embedding_model(log=log), queries, log=log)
+    np.save(query_embeddings_path, query_embs)
+    log(f"查询嵌入保存到 {query_embeddings_path}")
+    return query_embs
+
+
+def search_batched(index, query_embs, topk, batch_size=DEFAULT_SEARCH_BATCH_SIZE, num_threads=None,
+                   num_workers=1):
+    """分批调用 index.search，结果写入预分配的 (distances, indices) 矩阵
+
+    num_workers > 1 时交给线程池并行检索，num_threads 此时为每个工作线程的OpenMP线程数
+    """
+    if num_workers > 1:
+        return parallel_search(index, query_embs, topk, num_workers=num_workers,
+                               omp_threads=num_threads, batch_size=batch_size)
+    set_search_threads(num_threads)
+    query_embs = np.ascontiguousarray(query_embs, dtype=np.float32)
+    nq = query_embs.shape[0]
+    distances = np.empty((nq, topk), dtype=np.float32)
+    indices = np.empty((nq, topk), dtype=np.int64)
+    for start in range(0, nq, batch_size):
+        end = min(start + batch_size, nq)
+        distances[start:end], indices[start:end] = index.search(query_embs[start:end], topk)
+    return distances, indices
+
+
+def retrieve(model, index, queries, topk,
+             encode_batch_size=DEFAULT_ENCODE_BATCH_SIZE,
+             search_batch_size=DEFAULT_SEARCH_BATCH_SIZE,
+             num_threads=None, num_workers=1, log=print):
+    """编码整个查询列表并批量检索，返回 (distances, indices)，形状均为 (len(queries), topk)"""
+    query_embs = encode_queries(model, queries, batch_size=encode_batch_size, log=log)
+    return search_batched(index, query_embs, topk, batch_size=search_batch_size,
+                          num_threads=num_threads, num_workers=num_workers)
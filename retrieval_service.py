@@ -0,0 +1,291 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+本地异步检索服务（动态微批处理）
+基于 asyncio 的轻量HTTP服务（可选Unix socket），接收单条查询，按批次大小和
+最长等待时间聚合成微批，在线程池中批量编码+检索（不阻塞事件循环），返回top-k文档ID和分数。
+有界队列满时直接拒绝请求（HTTP 503），并提供基本延迟指标。无需任何外部服务。
+
+用法:
+    python retrieval_service.py --index hnsw_index_100k.bin --port 8000
+    curl -X POST localhost:8000/search -d '{"query": "who wrote hamlet", "topk": 5}'
+    curl localhost:8000/metrics
+"""
+
+import time
+import json
+import asyncio
+import argparse
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import faiss
+
+from retrieval_engine import load_embedding_model, search_batched, set_search_threads
+
+MAX_TOPK = 100
+MAX_BODY_BYTES = 1 << 20
+HTTP_REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+                413: "Payload Too Large", 500: "Internal Server Error", 503: "Service Unavailable"}
+
+
+class ServiceOverloaded(Exception):
+    """请求队列已满，请求被拒绝（负载削减）"""
+
+
+class LatencyMetrics:
+    """保存最近若干请求的延迟，按需计算分位数"""
+
+    def __init__(self, window=10000):
+        self.queue_wait_ms = deque(maxlen=window)
+        self.batch_ms = deque(maxlen=window)
+        self.total_ms = deque(maxlen=window)
+        self.batch_sizes = deque(maxlen=window)
+        self.served = 0
+        self.shed = 0
+        self.errors = 0
+
+    @staticmethod
+    def _percentiles(values):
+        if not values:
+            return {"p50": None, "p95": None, "p99": None, "max": None}
+        arr = np.fromiter(values, dtype=np.float64)
+        p50, p95, p99 = np.percentile(arr, [50, 95, 99])
+        return {"p50": round(p50, 3), "p95": round(p95, 3), "p99": round(p99, 3), "max": round(arr.max(), 3)}
+
+    def snapshot(self, queue_depth):
+        """返回当前指标快照"""
+        return {
+            "served": self.served,
+            "shed": self.shed,
+            "errors": self.errors,
+            "queue_depth": queue_depth,
+            "mean_batch_size": round(float(np.mean(self.batch_sizes)), 2) if self.batch_sizes else None,
+            "queue_wait_ms": self._percentiles(self.queue_wait_ms),
+            "batch_ms": self._percentiles(self.batch_ms),
+            "total_ms": self._percentiles(self.total_ms)
+        }
+
+
+class MicroBatcher:
+    """将单条查询聚合为微批：满 max_batch_size 或等待超过 max_wait_ms 即触发一次批量检索"""
+
+    def __init__(self, batch_fn, max_batch_size=64, max_wait_ms=5.0, max_queue=1024, metrics=None, threads=0):
+        self.batch_fn = batch_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.queue = asyncio.Queue(maxsize=max_queue)
+        self.metrics = metrics or LatencyMetrics()
+        # 批量编码和检索在单独线程执行，事件循环只负责收发请求；
+        # omp_set_num_threads 只对调用线程生效，因此在工作线程内设置faiss线程数
+        self.executor = ThreadPoolExecutor(max_workers=1, initializer=set_search_threads, initargs=(threads,))
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self.executor.shutdown(wait=False)
+
+    async def submit(self, query, topk):
+        """提交单条查询，返回 (ids, scores)；队列已满时抛出 ServiceOverloaded"""
+        future = asyncio.get_running_loop().create_future()
+        try:
+            self.queue.put_nowait((query, topk, time.perf_counter(), future))
+        except asyncio.QueueFull:
+            self.metrics.shed += 1
+            raise ServiceOverloaded()
+        return await future
+
+    async def _collect_batch(self):
+        """阻塞等待第一条查询，然后在截止时间内尽量凑满批次"""
+        batch = [await self.queue.get()]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._collect_batch()
+            batch = [item for item in batch if not item[3].cancelled()]
+            if not batch:
+                continue
+            queries = [item[0] for item in batch]
+            batch_k = max(item[1] for item in batch)
+            batch_start = time.perf_counter()
+            try:
+                distances, indices = await loop.run_in_executor(self.executor, self.batch_fn, queries, batch_k)
+            except Exception as e:
+                self.metrics.errors += len(batch)
+                for item in batch:
+                    if not item[3].done():
+                        item[3].set_exception(e)
+                continue
+            done = time.perf_counter()
+            self.metrics.batch_sizes.append(len(batch))
+            self.metrics.batch_ms.append((done - batch_start) * 1000)
+            for row, (_, topk, enqueued, future) in enumerate(batch):
+                if future.done():
+                    continue
+                # 索引为L2距离，查询和文档嵌入均已标准化，余弦相似度 = 1 - d/2
+                ids = indices[row, :topk].tolist()
+                scores = (1.0 - distances[row, :topk].astype(np.float64) / 2.0).round(6).tolist()
+                future.set_result((ids, scores))
+                self.metrics.served += 1
+                self.metrics.queue_wait_ms.append((batch_start - enqueued) * 1000)
+                self.metrics.total_ms.append((done - enqueued) * 1000)
+
+
+def make_batch_fn(model, index):
+    """构造批量编码+检索函数（在工作线程中执行）"""
+    def batch_fn(queries, topk):
+        query_embs = model.encode(queries, batch_size=len(queries), normalize_embeddings=True,
+                                  show_progress_bar=False).astype(np.float32)
+        return search_batched(index, query_embs, topk, batch_size=len(queries))
+    return batch_fn
+
+
+class RetrievalService:
+    """极简HTTP/1.1协议处理：POST /search, GET /metrics, GET /health"""
+
+    def __init__(self, batcher, default_topk=10):
+        self.batcher = batcher
+        self.default_topk = default_topk
+
+    async def _read_request(self, reader):
+        request_line = await reader.readline()
+        if not request_line:
+            return None
+        method, path, _ = request_line.decode("latin-1").split(" ", 2)
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            key, _, value = line.decode("latin-1").partition(":")
+            headers[key.strip().lower()] = value.strip()
+        length = int(headers.get("content-length", 0))
+        if length > MAX_BODY_BYTES:
+            return method, path, headers, None
+        body = await reader.readexactly(length) if length else b""
+        return method, path, headers, body
+
+    @staticmethod
+    async def _write_response(writer, status, payload, keep_alive):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        head = (f"HTTP/1.1 {status} {HTTP_REASONS.get(status, '')}\r\n"
+                f"Content-Type: application/json; charset=utf-8\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n")
+        writer.write(head.encode("latin-1") + body)
+        await writer.drain()
+
+    async def _dispatch(self, method, path, body):
+        if path == "/health":
+            return 200, {"status": "ok"}
+        if path == "/metrics":
+            return 200, self.batcher.metrics.snapshot(self.batcher.queue.qsize())
+        if path != "/search":
+            return 404, {"error": f"未知路径: {path}"}
+        if method != "POST":
+            return 405, {"error": "请使用POST提交查询"}
+        try:
+            request = json.loads(body or b"{}")
+            query = request["query"]
+            topk = int(request.get("topk", self.default_topk))
+        except (ValueError, KeyError, TypeError):
+            return 400, {"error": "请求体需为JSON: {\"query\": str, \"topk\": int}"}
+        if not isinstance(query, str) or not query or not 1 <= topk <= MAX_TOPK:
+            return 400, {"error": f"query不能为空，topk需在1到{MAX_TOPK}之间"}
+        try:
+            ids, scores = await self.batcher.submit(query, topk)
+        except ServiceOverloaded:
+            return 503, {"error": "服务繁忙，请稍后重试"}
+        except Exception as e:
+            return 500, {"error": f"检索失败: {e}"}
+        return 200, {"ids": ids, "scores": scores}
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                try:
+                    request = await self._read_request(reader)
+                except (ValueError, asyncio.IncompleteReadError):
+                    await self._write_response(writer, 400, {"error": "无法解析的HTTP请求"}, False)
+                    break
+                if request is None:
+                    break
+                method, path, headers, body = request
+                keep_alive = headers.get("connection", "").lower() != "close"
+                if body is None:
+                    await self._write_response(writer, 413, {"error": "请求体过大"}, False)
+                    break
+                status, payload = await self._dispatch(method, path.split("?", 1)[0], body)
+                await self._write_response(writer, status, payload, keep_alive)
+                if not keep_alive:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+
+async def serve(args):
+    """加载模型和索引并启动服务"""
+    print("加载本地嵌入模型...")
+    model = load_embedding_model()
+    print(f"加载索引 {args.index}...")
+    index = faiss.read_index(args.index)
+
+    batcher = MicroBatcher(make_batch_fn(model, index), max_batch_size=args.max_batch_size,
+                           max_wait_ms=args.max_wait_ms, max_queue=args.max_queue, threads=args.threads)
+    batcher.start()
+    service = RetrievalService(batcher, default_topk=args.topk)
+    if args.unix_socket:
+        server = await asyncio.start_unix_server(service.handle, path=args.unix_socket)
+        print(f"检索服务已启动: unix:{args.unix_socket}")
+    else:
+        server = await asyncio.start_server(service.handle, host=args.host, port=args.port)
+        print(f"检索服务已启动: http://{args.host}:{args.port}")
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        await batcher.stop()
+
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description="本地异步检索服务（动态微批处理）")
+    parser.add_argument("--index", type=str, default="hnsw_index_100k.bin", help="faiss索引文件")
+    parser.add_argument("--topk", type=int, default=10, help="默认top-k值 (默认: 10)")
+    parser.add_argument("--host", type=str, default="127.0.0.1", help="监听地址 (默认: 127.0.0.1)")
+    parser.add_argument("--port", type=int, default=8000, help="监听端口 (默认: 8000)")
+    parser.add_argument("--unix_socket", type=str, default=None, help="改为监听Unix socket路径")
+    parser.add_argument("--max_batch_size", type=int, default=64, help="微批最大查询数 (默认: 64)")
+    parser.add_argument("--max_wait_ms", type=float, default=5.0, help="微批最长等待毫秒数 (默认: 5)")
+    parser.add_argument("--max_queue", type=int, default=1024, help="等待队列上限，超出即拒绝 (默认: 1024)")
+    parser.add_argument("--threads", type=int, default=0, help="faiss检索线程数，0表示默认值 (默认: 0)")
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        print("检索服务已停止")
+
+
+if __name__ == "__main__":
+    main()
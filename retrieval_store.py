@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+检索结果矩阵持久化
+每个 (索引, 数据集) 只在最大k下检索一次，以 int32 文档ID和 float16 距离分块保存，
+更小的top-k通过前缀切片得到，供频率、组合、N-gram、层级、度等各统计阶段复用
+
+注意: efSearch 固定时，faiss HNSW 的检索路径与 k 无关（结果和距离计算次数都不随 k 变化），
+因此前缀切片与单独以小k检索的结果完全相同
+"""
+
+import os
+import json
+import glob
+import hashlib
+import numpy as np
+import faiss
+
+from retrieval_engine import DATASET_SOURCES, load_queries, load_query_embeddings, search_batched
+
+RETRIEVAL_STORE_DIR = "retrieval_cache"
+DEFAULT_INDEX_PATH = "hnsw_index_100k.bin"
+DEFAULT_MAX_K = 32          # commands.txt 中最大的top-k
+DEFAULT_CHUNK_SIZE = 65536  # 每个分块保存的查询数
+META_FILENAME = "meta.json"
+
+
+def store_path(index_path, dataset_name, root=RETRIEVAL_STORE_DIR):
+    """返回 (索引, 数据集) 对应的存储目录，如 retrieval_cache/hnsw_index_100k_nq"""
+    index_tag = os.path.splitext(os.path.basename(index_path))[0]
+    return os.path.join(root, f"{index_tag}_{dataset_name}")
+
+
+class RetrievalStoreWriter:
+    """按块追加写入检索结果，支持百万级查询而无需整体驻留内存"""
+
+    def __init__(self, store_dir, max_k, chunk_size=DEFAULT_CHUNK_SIZE, extra_meta=None):
+        self.store_dir = store_dir
+        self.max_k = max_k
+        self.chunk_size = chunk_size
+        self.extra_meta = extra_meta or {}
+        self.num_queries = 0
+        self.num_chunks = 0
+        self._pending_distances = []
+        self._pending_indices = []
+        self._pending_rows = 0
+        os.makedirs(store_dir, exist_ok=True)
+        # 清理旧的分块和元数据，避免新旧结果混杂
+        for old_file in glob.glob(os.path.join(store_dir, "*.npy")) + [os.path.join(store_dir, META_FILENAME)]:
+            if os.path.exists(old_file):
+                os.remove(old_file)
+
+    def append(self, distances, indices):
+        """追加一批 (distances, indices)，形状为 (n, max_k)"""
+        if indices.shape[1] != self.max_k:
+            raise ValueError(f"检索结果列数 {indices.shape[1]} 与 max_k={self.max_k} 不一致")
+        self._pending_distances.append(np.asarray(distances, dtype=np.float16))
+        self._pending_indices.append(np.asarray(indices, dtype=np.int32))
+        self._pending_rows += indices.shape[0]
+        while self._pending_rows >= self.chunk_size:
+            self._flush(self.chunk_size)
+
+    def _flush(self, rows):
+        distances = np.concatenate(self._pending_distances)
+        indices = np.concatenate(self._pending_indices)
+        np.save(os.path.join(self.store_dir, f"indices_{self.num_chunks:05d}.npy"), indices[:rows])
+        np.save(os.path.join(self.store_dir, f"distances_{self.num_chunks:05d}.npy"), distances[:rows])
+        self._pending_distances = [distances[rows:]]
+        self._pending_indices = [indices[rows:]]
+        self._pending_rows -= rows
+        self.num_queries += rows
+        self.num_chunks += 1
+
+    def close(self):
+        """写出剩余数据和元数据（元数据最后写入，作为存储完整的标志）"""
+        if self._pending_rows > 0:
+            self._flush(self._pending_rows)
+        meta = dict(self.extra_meta)
+        meta.update({
+            "max_k": self.max_k,
+            "num_queries": self.num_queries,
+            "num_chunks": self.num_chunks,
+            "chunk_size": self.chunk_size,
+            "indices_dtype": "int32",
+            "distances_dtype": "float16"
+        })
+        with open(os.path.join(self.store_dir, META_FILENAME), "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False, indent=2)
+        return meta
+
+
+def save_retrieval(store_dir, distances, indices, chunk_size=DEFAULT_CHUNK_SIZE, extra_meta=None):
+    """一次性保存完整的检索结果矩阵"""
+    writer = RetrievalStoreWriter(store_dir, indices.shape[1], chunk_size=chunk_size, extra_meta=extra_meta)
+    writer.append(distances, indices)
+    return writer.close()
+
+
+def load_meta(store_dir):
+    """读取存储元数据，不存在时返回None"""
+    meta_path = os.path.join(store_dir, META_FILENAME)
+    if not os.path.exists(meta_path):
+        return None
+    with open(meta_path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def iter_retrieval_chunks(store_dir, topk=None, with_distances=False):
+    """逐块读取（mmap）检索结果并按top-k前缀切片，用于流式处理大规模查询日志"""
+    meta = load_meta(store_dir)
+    if meta is None:
+        raise FileNotFoundError(f"未找到检索结果存储: {store_dir}")
+    topk = topk or meta["max_k"]
+    if topk > meta["max_k"]:
+        raise ValueError(f"请求的top-k={topk} 超过存储的最大k={meta['max_k']}")
+    for chunk_id in range(meta["num_chunks"]):
+        indices = np.load(os.path.join(store_dir, f"indices_{chunk_id:05d}.npy"), mmap_mode="r")[:, :topk]
+        if with_distances:
+            distances = np.load(os.path.join(store_dir, f"distances_{chunk_id:05d}.npy"), mmap_mode="r")[:, :topk]
+            yield distances, indices
+        else:
+            yield indices
+
+
+def load_retrieval(store_dir, topk=None):
+    """读取完整的 (distances, indices) 矩阵（top-k前缀切片）"""
+    distances_list, indices_list = [], []
+    for distances, indices in iter_retrieval_chunks(store_dir, topk, with_distances=True):
+        distances_list.append(np.asarray(distances))
+        indices_list.append(np.asarray(indices))
+    if not indices_list:
+        meta = load_meta(store_dir)
+        k = topk or meta["max_k"]
+        return np.empty((0, k), dtype=np.float16), np.empty((0, k), dtype=np.int32)
+    return np.concatenate(distances_list), np.concatenate(indices_list)
+
+
+def index_fingerprint(index_path):
+    """索引文件的大小和修改时间，文件不存在时返回None"""
+    if index_path is None or not os.path.exists(index_path):
+        return None
+    stat = os.stat(index_path)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def query_fingerprint(queries):
+    """
+    查询文本列表按换行拼接后的 sha1
+    所有调用方都传查询文本（而不是嵌入），共用同一存储目录的脚本才能得到相同的指纹
+    """
+    if queries is None:
+        return None
+    return hashlib.sha1("\n".join(queries).encode("utf-8")).hexdigest()
+
+
+def ensure_retrieval(store_dir, topk, search_fn, num_queries, index_ntotal, index_path=None, queries=None,
+                     max_k=DEFAULT_MAX_K, log=print):
+    """
+    确保存储中有可复用的检索结果并返回元数据；若不存在、k不足、查询数/索引规模不一致，
+    或给出的索引文件（大小、修改时间）/查询文本与保存时不同，则调用 search_fn(k) 在 max(topk, max_k) 下重新检索并保存
+    """
+    meta = load_meta(store_dir)
+    fingerprint = {"index_ntotal": index_ntotal}
+    if index_path is not None:
+        fingerprint["index_file"] = index_fingerprint(index_path)
+    if queries is not None:
+        fingerprint["query_sha1"] = query_fingerprint(queries)
+    if (meta is not None and meta["max_k"] >= topk and meta["num_queries"] == num_queries
+            and all(meta.get(key) == value for key, value in fingerprint.items())):
+        log(f"复用已保存的检索结果 {store_dir} (max_k={meta['max_k']})")
+        return meta
+    search_k = max(topk, max_k)
+    log(f"未找到可复用的检索结果，以 k={search_k} 检索并保存到 {store_dir}...")
+    distances, indices = search_fn(search_k)
+    return save_retrieval(store_dir, distances, indices, extra_meta=fingerprint)
+
+
+def get_or_create_retrieval(store_dir, topk, search_fn, num_queries, index_ntotal, index_path=None, queries=None,
+                            max_k=DEFAULT_MAX_K, log=print):
+    """读取可复用的检索结果（见 ensure_retrieval），必要时重新检索"""
+    ensure_retrieval(store_dir, topk, search_fn, num_queries, index_ntotal, index_path, queries, max_k, log)
+    return load_retrieval(store_dir, topk)
+
+
+def add_retrieval_args(parser, default_topk=10, multi_dataset=False):
+    """各分析脚本共用的 --dataset（multi_dataset 时为 --datasets）、--topk、--index 参数"""
+    datasets = list(DATASET_SOURCES)
+    if multi_dataset:
+        parser.add_argument("--datasets", type=str, nargs="+", default=datasets, choices=datasets,
+                            help="参与统计的查询数据集（可多选，默认全部）")
+    else:
+        parser.add_argument("--dataset", type=str, default="mmlu", choices=datasets,
+                            help="选择查询数据集: mmlu, nq, hotpotqa, triviaqa")
+    parser.add_argument("--topk", type=int, default=default_topk, help=f"检索的top-k值 (默认: {default_topk})")
+    parser.add_argument("--index", type=str, default=DEFAULT_INDEX_PATH, help="faiss索引文件")
+
+
+def prepare_retrieval(index_path, dataset_name, topk, index=None, log=print):
+    """
+    加载查询嵌入并确保 (索引, 数据集) 的检索结果已保存（必要时检索），不读入结果矩阵；
+    返回 (store_dir, query_embs)，供 iter_retrieval_chunks 流式读取
+    """
+    index = index if index is not None else faiss.read_index(index_path)
+    store_dir = store_path(index_path, dataset_name)
+    query_embs = load_query_embeddings(dataset_name, log=log)
+    ensure_retrieval(store_dir, topk, lambda k: search_batched(index, query_embs, k),
+                     num_queries=len(query_embs), index_ntotal=index.ntotal, index_path=index_path,
+                     queries=load_queries(dataset_name, log=log), log=log)
+    return store_dir, query_embs
+
+
+def load_or_search(index_path, dataset_name, topk, index=None, log=print):
+    """读取 (索引, 数据集) 的 top-k 检索结果，必要时检索并保存；返回 (query_embs, distances, indices)"""
+    store_dir, query_embs = prepare_retrieval(index_path, dataset_name, topk, index, log)
+    distances, indices = load_retrieval(store_dir, topk)
+    return query_embs, distances, indices
@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+检索访问流的重用距离（LRU栈距离）分析
+按查询顺序展开检索结果为访问序列（与 cache_sim.py 相同），用树状数组（Fenwick树）在 O(n log n) 内
+求出每次访问的LRU栈距离: 上次访问同一文档以来访问过的不同文档数 + 1（首次访问记为0，即冷启动缺失）
+
+LRU 是栈算法: 容量为 C 的LRU命中当且仅当栈距离 <= C，因此栈距离直方图的前缀和一次给出所有容量的LRU命中率曲线；
+另在一组容量上模拟 Belady/OPT（淘汰下次使用最远的文档）作为命中率上限对照
+
+用法:
+    python reuse_distance.py --dataset nq --topk 10 --workers 8
+"""
+
+import os
+import json
+import heapq
+import argparse
+import numpy as np
+import matplotlib.pyplot as plt
+import faiss
+
+from retrieval_store import add_retrieval_args, load_or_search
+from cache_sim import build_trace, simulate_lru, map_with_shared_state, worker_state, DEFAULT_CAPACITIES
+
+# 配置matplotlib中文字体支持
+plt.rcParams['font.sans-serif'] = ['SimHei', 'Microsoft YaHei', 'DejaVu Sans']
+plt.rcParams['axes.unicode_minus'] = False  # 正确显示负号
+
+
+def previous_occurrence(trace):
+    """每次访问的同一文档上一次访问位置（没有则为-1）"""
+    trace = np.asarray(trace)
+    order = np.argsort(trace, kind="stable")
+    prev = np.full(len(trace), -1, dtype=np.int64)
+    same = trace[order[1:]] == trace[order[:-1]]
+    prev[order[1:][same]] = order[:-1][same]
+    return prev
+
+
+def next_occurrence(trace):
+    """每次访问的同一文档下一次访问位置（没有则为访问序列长度）"""
+    trace = np.asarray(trace)
+    order = np.argsort(trace, kind="stable")
+    nxt = np.full(len(trace), len(trace), dtype=np.int64)
+    same = trace[order[1:]] == trace[order[:-1]]
+    nxt[order[:-1][same]] = order[1:][same]
+    return nxt
+
+
+def stack_distances(trace):
+    """
+    每次访问的LRU栈距离（首次访问为0）
+    树状数组在每个文档最近一次访问的位置上记1: 位置 > 上次访问位置的标记数即期间访问过的不同文档数
+    """
+    n = len(trace)
+    prev = previous_occurrence(trace).tolist()
+    tree = [0] * (n + 1)
+    distances = [0] * n
+    distinct = 0
+    for i in range(n):
+        p = prev[i]
+        if p < 0:
+            distinct += 1
+        else:
+            # 前缀和: 位置 <= p 的标记数（含该文档自身）
+            marked, j = 0, p + 1
+            while j > 0:
+                marked += tree[j]
+                j &= j - 1
+            distances[i] = distinct - marked + 1
+            j = p + 1
+            while j <= n:
+                tree[j] -= 1
+                j += j & -j
+        j = i + 1
+        while j <= n:
+            tree[j] += 1
+            j += j & -j
+    return np.asarray(distances, dtype=np.int64)
+
+
+def lru_hit_curve(distances):
+    """所有容量的LRU命中率: 返回数组第 C 项为容量 C（文档数）时的命中率，C 取 0..不同文档数"""
+    if len(distances) == 0:
+        return np.zeros(1)
+    histogram = np.bincount(distances)
+    histogram[0] = 0  # 冷启动缺失在任何容量下都不命中
+    return np.cumsum(histogram) / len(distances)
+
+
+def simulate_opt(trace, next_use, capacity):
+    """Belady/OPT: 满时淘汰下次使用最远的文档；新文档比缓存内所有文档都更晚再用时不缓存，返回命中次数"""
+    hits = 0
+    if capacity <= 0:
+        return hits
+    cache = {}  # 文档 -> 下次使用位置
+    heap = []   # (-下次使用位置, 文档)，过期条目在弹出时跳过
+    for i, key in enumerate(trace):
+        nxt = next_use[i]
+        if key in cache:
+            hits += 1
+        elif len(cache) >= capacity:
+            while cache.get(heap[0][1]) != -heap[0][0]:
+                heapq.heappop(heap)
+            if -heap[0][0] <= nxt:
+                continue
+            _, victim = heapq.heappop(heap)
+            del cache[victim]
+        cache[key] = nxt
+        heapq.heappush(heap, (-nxt, key))
+    return hits
+
+
+def _run_opt(capacity):
+    """在一个容量下模拟OPT（访问序列由 map_with_shared_state 传入）"""
+    state = worker_state()
+    trace = state["trace"]
+    return simulate_opt(trace, state["next_use"], capacity) / len(trace) if trace else 0.0
+
+
+def opt_hit_ratios(trace, capacities, workers=1):
+    """在每个容量下模拟 Belady/OPT，返回命中率列表"""
+    trace_list = np.asarray(trace).tolist()
+    next_use = next_occurrence(trace).tolist()
+    return map_with_shared_state(_run_opt, capacities, {"trace": trace_list, "next_use": next_use}, workers)
+
+
+def curve_at(curve, capacity):
+    """从全容量LRU曲线上取某容量的命中率（超过不同文档数时取最大值）"""
+    return float(curve[min(capacity, len(curve) - 1)])
+
+
+def write_reuse_report(path, dataset_name, topk, trace, distances, curve, capacities, opt_ratios, verified=None):
+    """保存栈距离统计和 LRU/OPT 命中率对照表"""
+    reused = distances[distances > 0]
+    lines = [f"重用距离分析 - {dataset_name.upper()} Top-{topk}",
+             f"访问次数: {len(trace)}, 不同文档数(冷启动缺失): {len(distances) - len(reused)}, "
+             f"无限容量命中率上限: {curve[-1] * 100:.2f}%"]
+    if len(reused):
+        p50, p90, p99 = np.percentile(reused, [50, 90, 99])
+        lines.append(f"栈距离(不含首次访问): 均值 {reused.mean():.1f}, 中位数 {p50:.0f}, P90 {p90:.0f}, P99 {p99:.0f}")
+    lines.append(f"\n{'容量(文档数)':<14}{'LRU(%)':>10}{'OPT(%)':>10}{'差距(%)':>10}")
+    for capacity, opt in zip(capacities, opt_ratios):
+        lru = curve_at(curve, capacity)
+        lines.append(f"{capacity:<14}{lru * 100:>10.2f}{opt * 100:>10.2f}{(opt - lru) * 100:>10.2f}")
+    if verified is not None:
+        lines.append(f"\n与 cache_sim.simulate_lru 逐容量模拟结果{'一致' if verified else '不一致'}")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("\n".join(lines) + "\n")
+    for line in lines:
+        print(line)
+
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description="检索访问流的重用距离分析")
+    add_retrieval_args(parser)
+    parser.add_argument("--capacities", type=float, nargs="+", default=DEFAULT_CAPACITIES,
+                        help="模拟OPT的缓存容量: <1 表示占语料库文档数的比例，>=1 表示文档数")
+    parser.add_argument("--workers", type=int, default=0, help="OPT模拟的并行进程数，0表示CPU核数 (默认: 0)")
+    parser.add_argument("--verify", action="store_true", help="用逐容量LRU模拟校验栈距离得到的命中率")
+    args = parser.parse_args()
+
+    dataset_name = args.dataset.lower()
+    topk = args.topk
+    print(f"加载索引 {args.index}...")
+    index = faiss.read_index(args.index)
+    _, _, indices = load_or_search(args.index, dataset_name, topk, index)
+
+    trace = build_trace(indices)
+    print(f"计算 {len(trace)} 次访问的栈距离...")
+    distances = stack_distances(trace)
+    curve = lru_hit_curve(distances)
+    capacities = sorted({int(c * index.ntotal) if c < 1 else int(c) for c in args.capacities} - {0})
+    workers = args.workers or os.cpu_count() or 1
+    print(f"在 {len(capacities)} 种容量下模拟 Belady/OPT...")
+    opt_ratios = opt_hit_ratios(trace, capacities, workers)
+
+    verified = None
+    if args.verify:
+        trace_list = trace.tolist()
+        verified = all(sum(simulate_lru(trace_list, capacity)) == round(curve_at(curve, capacity) * len(trace))
+                       for capacity in capacities)
+
+    report_path = f"reuse_distance_{dataset_name}_top{topk}.txt"
+    write_reuse_report(report_path, dataset_name, topk, trace, distances, curve, capacities, opt_ratios, verified)
+    np.savez_compressed(f"reuse_distance_{dataset_name}_top{topk}.npz",
+                        histogram=np.bincount(distances), lru_hit_ratio=curve)
+    with open(f"reuse_distance_{dataset_name}_top{topk}.json", "w", encoding="utf-8") as f:
+        json.dump({"num_accesses": int(len(trace)),
+                   "results": [{"capacity": c, "lru_hit_ratio": curve_at(curve, c), "opt_hit_ratio": o}
+                               for c, o in zip(capacities, opt_ratios)]}, f, ensure_ascii=False, indent=2)
+
+    plot_path = f"reuse_distance_{dataset_name}_top{topk}.png"
+    plt.figure(figsize=(10, 6))
+    plt.plot(np.arange(1, len(curve)), curve[1:] * 100, label="LRU（栈距离，全部容量）")
+    plt.plot(capacities, [o * 100 for o in opt_ratios], marker='o', label="Belady/OPT")
+    plt.xscale('log')
+    plt.title(f"LRU vs OPT 命中率 - {dataset_name.upper()} Top-{topk}")
+    plt.xlabel("缓存容量 (文档数)")
+    plt.ylabel("命中率 (%)")
+    plt.legend()
+    plt.grid(True)
+    plt.savefig(plot_path)
+    print(f"重用距离分析保存到 {report_path}，命中率曲线保存为 {plot_path}")
+
+
+if __name__ == "__main__":
+    main()
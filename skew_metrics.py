@@ -0,0 +1,346 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+检索热度偏斜分析
+在文档检索频率上计算:
+- 覆盖曲线: 覆盖X%检索流量所需的最少文档数（X = 1..100，相对已检索文档数和语料库规模）
+- 基尼系数（已检索文档 / 整个语料库）、香农熵及归一化熵
+- 离散幂律 MLE: 频率分布 P(x) ∝ x^-alpha (x >= xmin)，xmin 按KS距离最小选取 (Clauset et al. 2009)
+- Zipf MLE: 排名-频率 f(r) ∝ r^-s 的有限支撑Zipf分布
+- 自助法置信区间: 有放回地重采样各文档的检索频率，在每个重采样上重新计算全部指标（幂律重新选取 xmin），
+  百分位区间，批量向量化计算，多进程并行
+
+结果以JSON保存，供缓存容量规划使用
+
+用法:
+    python skew_metrics.py --dataset nq --topk 10 --bootstrap 1000 --workers 8
+"""
+
+import os
+import json
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import matplotlib.pyplot as plt
+import faiss
+
+from retrieval_store import add_retrieval_args, load_or_search
+from hotness_stats import frequency_curve, top_percent_share, HOT_PERCENT
+from heavy_hitters import synthetic_retrievals
+
+# 配置matplotlib中文字体支持
+plt.rcParams['font.sans-serif'] = ['SimHei', 'Microsoft YaHei', 'DejaVu Sans']
+plt.rcParams['axes.unicode_minus'] = False  # 正确显示负号
+
+ALPHA_GRID = np.arange(1.05, 6.0, 0.005)   # 幂律指数搜索网格
+ZIPF_GRID = np.arange(0.01, 4.0, 0.005)    # Zipf指数搜索网格
+COVERAGE_PERCENTS = np.arange(1, 101)
+MIN_TAIL = 50                               # 拟合幂律尾部至少需要的文档数
+MAX_XMIN_CANDIDATES = 200
+BOOTSTRAP_CHUNK = 50                        # 每个任务一次向量化处理的重采样数
+
+
+def hurwitz_zeta(s, q, terms=50):
+    """Hurwitz zeta ζ(s, q) = Σ_k (q + k)^-s，前 terms 项直接求和，余项用 Euler-Maclaurin 展开（s > 1）"""
+    s, q = np.broadcast_arrays(np.asarray(s, dtype=np.float64), np.asarray(q, dtype=np.float64))
+    k = np.arange(terms, dtype=np.float64)
+    head = ((q[..., None] + k) ** -s[..., None]).sum(axis=-1)
+    a = q + terms
+    tail = a ** (1 - s) / (s - 1) + 0.5 * a ** -s
+    tail += s * a ** (-s - 1) / 12
+    tail -= s * (s + 1) * (s + 2) * a ** (-s - 3) / 720
+    tail += s * (s + 1) * (s + 2) * (s + 3) * (s + 4) * a ** (-s - 5) / 30240
+    return head + tail
+
+
+def _grid_argmax(loglik, grid):
+    """对每行的对数似然在网格上取最大值，并用抛物线插值细化"""
+    loglik = np.atleast_2d(loglik)
+    best = np.clip(np.argmax(loglik, axis=1), 1, len(grid) - 2)
+    rows = np.arange(loglik.shape[0])
+    left, mid, right = loglik[rows, best - 1], loglik[rows, best], loglik[rows, best + 1]
+    denom = left - 2 * mid + right
+    with np.errstate(divide="ignore", invalid="ignore"):
+        offset = np.where(denom < 0, 0.5 * (left - right) / denom, 0.0)
+    return grid[best] + np.clip(offset, -1, 1) * (grid[1] - grid[0])
+
+
+def log_harmonic(num_ranks, grid=ZIPF_GRID, block=32):
+    """ln H(N, s) = ln Σ_{r=1..N} r^-s，对网格上每个 s 分块计算"""
+    log_ranks = np.log(np.arange(1, num_ranks + 1, dtype=np.float64))
+    out = np.empty(len(grid))
+    for start in range(0, len(grid), block):
+        s = grid[start:start + block, None]
+        out[start:start + block] = np.log(np.exp(-s * log_ranks).sum(axis=1))
+    return out
+
+
+def fit_zipf(sorted_freqs, log_h=None, grid=ZIPF_GRID):
+    """
+    排名-频率 Zipf MLE，sorted_freqs 为 (N,) 或每行降序的 (B, N)
+    对数似然 = -s Σ f_r ln r - T ln H(N, s)
+    """
+    counts = np.atleast_2d(sorted_freqs).astype(np.float64)
+    if log_h is None:
+        log_h = log_harmonic(counts.shape[1], grid)
+    log_ranks = np.log(np.arange(1, counts.shape[1] + 1, dtype=np.float64))
+    weighted = counts @ log_ranks
+    totals = counts.sum(axis=1)
+    loglik = -np.outer(weighted, grid) - np.outer(totals, log_h)
+    return _grid_argmax(loglik, grid)
+
+
+def fit_alpha(num_tail, sum_log, xmin, grid=ALPHA_GRID, log_zeta=None):
+    """固定 xmin 的离散幂律 MLE: 对数似然 = -n ln ζ(alpha, xmin) - alpha Σ ln x（可对多组样本向量化）"""
+    if log_zeta is None:
+        log_zeta = np.log(hurwitz_zeta(grid, xmin))
+    num_tail = np.atleast_1d(num_tail).astype(np.float64)
+    sum_log = np.atleast_1d(sum_log).astype(np.float64)
+    loglik = -np.outer(num_tail, log_zeta) - np.outer(sum_log, grid)
+    return _grid_argmax(loglik, grid)
+
+
+def fit_power_law(freqs, grid=ALPHA_GRID, min_tail=MIN_TAIL, max_candidates=MAX_XMIN_CANDIDATES):
+    """
+    离散幂律拟合: 对候选 xmin 分别做 MLE，取模型与经验CCDF的KS距离最小者
+    返回 {"alpha", "xmin", "ks", "num_tail"}
+    """
+    x = np.sort(np.asarray(freqs, dtype=np.int64))
+    values = np.unique(x)
+    tail_sizes = len(x) - np.searchsorted(x, values)
+    candidates = values[tail_sizes >= min(min_tail, len(x))]
+    if len(candidates) > max_candidates:
+        candidates = candidates[np.unique(np.linspace(0, len(candidates) - 1, max_candidates).astype(int))]
+    best = None
+    for xmin in candidates:
+        tail = x[np.searchsorted(x, xmin):]
+        alpha = float(fit_alpha(len(tail), np.log(tail).sum(), xmin, grid)[0])
+        tail_values = np.unique(tail)
+        empirical = (len(tail) - np.searchsorted(tail, tail_values)) / len(tail)
+        model = hurwitz_zeta(alpha, tail_values) / hurwitz_zeta(alpha, xmin)
+        ks = float(np.max(np.abs(empirical - model)))
+        if best is None or ks < best["ks"]:
+            best = {"alpha": alpha, "xmin": int(xmin), "ks": ks, "num_tail": int(len(tail))}
+    return best
+
+
+def coverage_curve(sorted_freqs, total, percents=COVERAGE_PERCENTS):
+    """覆盖 percents% 检索流量所需的最少文档数"""
+    cumulative = np.cumsum(sorted_freqs)
+    targets = np.asarray(percents, dtype=np.float64) / 100 * total
+    return np.minimum(np.searchsorted(cumulative, targets - 1e-9 * total, side="left") + 1, len(sorted_freqs))
+
+
+def gini_rows(sorted_asc, num_zeros=0):
+    """基尼系数（每行升序）；num_zeros 为额外的零次文档数（如未被检索到的语料库文档）"""
+    counts = np.atleast_2d(sorted_asc).astype(np.float64)
+    n = counts.shape[1] + num_zeros
+    ranks = np.arange(1, counts.shape[1] + 1, dtype=np.float64) + num_zeros
+    totals = counts.sum(axis=1)
+    return 2 * (counts @ ranks) / (n * totals) - (n + 1) / n
+
+
+def entropy_rows(counts):
+    """香农熵（bit）"""
+    counts = np.atleast_2d(counts).astype(np.float64)
+    p = counts / counts.sum(axis=1, keepdims=True)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return -np.where(p > 0, p * np.log2(p), 0.0).sum(axis=1)
+
+
+def skew_point_estimates(sorted_freqs, total, corpus_size):
+    """全部点估计指标"""
+    num_docs = len(sorted_freqs)
+    coverage = coverage_curve(sorted_freqs, total)
+    entropy = float(entropy_rows(sorted_freqs)[0])
+    power_law = fit_power_law(sorted_freqs)
+    return {
+        "total_retrievals": int(total),
+        "num_docs": int(num_docs),
+        "corpus_size": int(corpus_size),
+        "top10_percent_share": float(top_percent_share(sorted_freqs, total, HOT_PERCENT)),
+        "gini": float(gini_rows(sorted_freqs[::-1])[0]),
+        "gini_corpus": float(gini_rows(sorted_freqs[::-1], corpus_size - num_docs)[0]),
+        "entropy_bits": entropy,
+        "normalized_entropy": float(entropy / np.log2(num_docs)) if num_docs > 1 else 0.0,
+        "zipf_s": float(fit_zipf(sorted_freqs)[0]),
+        "power_law": power_law,
+        "coverage": {
+            "percents": COVERAGE_PERCENTS.tolist(),
+            "num_docs": coverage.tolist(),
+            "fraction_of_retrieved": (coverage / num_docs).tolist(),
+            "fraction_of_corpus": (coverage / corpus_size).tolist()
+        }
+    }
+
+
+BOOTSTRAP_KEYS = ("gini", "gini_corpus", "entropy_bits", "top10_percent_share", "zipf_s", "alpha")
+
+
+def bootstrap_point_values(point):
+    """点估计中参与自助法的各指标"""
+    values = {key: point[key] for key in BOOTSTRAP_KEYS if key != "alpha"}
+    values["alpha"] = point["power_law"]["alpha"]
+    return values
+
+
+def _bootstrap_task(args):
+    """
+    一个工作进程处理一批重采样: 对每个文档的检索频率有放回地重采样（文档数不变），
+    基尼系数、熵、Top 10%占比、Zipf 指数按行向量化计算，幂律对每个重采样重新选取 xmin 后拟合
+    """
+    sorted_freqs, corpus_size, log_h, num_resamples, seed = args
+    rng = np.random.default_rng(seed)
+    num_docs = len(sorted_freqs)
+    hot_index = int(HOT_PERCENT * num_docs) - 1  # 与 top_percent_share 的取法一致
+    results = {key: [] for key in BOOTSTRAP_KEYS}
+    for start in range(0, num_resamples, BOOTSTRAP_CHUNK):
+        size = min(BOOTSTRAP_CHUNK, num_resamples - start)
+        resampled = np.sort(sorted_freqs[rng.integers(0, num_docs, size=(size, num_docs))], axis=1)  # 每行升序
+        descending = resampled[:, ::-1]
+        totals = resampled.sum(axis=1)
+        results["gini"].append(gini_rows(resampled))
+        results["gini_corpus"].append(gini_rows(resampled, corpus_size - num_docs))
+        results["entropy_bits"].append(entropy_rows(resampled))
+        results["top10_percent_share"].append(np.cumsum(descending, axis=1)[:, hot_index] / totals * 100)
+        results["zipf_s"].append(fit_zipf(descending, log_h))
+        results["alpha"].append(np.array([fit_power_law(row)["alpha"] for row in resampled]))
+    return {key: np.concatenate(values) for key, values in results.items()}
+
+
+def bootstrap(sorted_freqs, corpus_size, point, num_resamples=1000, workers=None, seed=0, confidence=0.95):
+    """
+    自助法百分位置信区间: 把每个文档的检索频率作为样本有放回地重采样 (Clauset et al. 2009)，
+    在每个重采样上重新计算全部指标（幂律重新选取 xmin），同时给出偏差和标准差估计
+    重采样分成多个任务，workers > 1 时用多进程并行，各任务使用独立的随机数流
+    """
+    point_values = bootstrap_point_values(point)
+    workers = workers or os.cpu_count() or 1
+    sorted_freqs = np.asarray(sorted_freqs, dtype=np.int64)
+    log_h = log_harmonic(len(sorted_freqs))
+    num_tasks = min(num_resamples, max(workers, 1) * 4)
+    sizes = [len(part) for part in np.array_split(np.arange(num_resamples), num_tasks)]
+    seeds = np.random.SeedSequence(seed).spawn(num_tasks)
+    tasks = [(sorted_freqs, corpus_size, log_h, size, task_seed)
+             for size, task_seed in zip(sizes, seeds) if size > 0]
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            parts = list(executor.map(_bootstrap_task, tasks))
+    else:
+        parts = [_bootstrap_task(task) for task in tasks]
+    lower, upper = (1 - confidence) / 2 * 100, (1 + confidence) / 2 * 100
+    intervals = {}
+    for key in BOOTSTRAP_KEYS:
+        samples = np.concatenate([part[key] for part in parts])
+        q_low, q_high = np.percentile(samples, [lower, upper])
+        intervals[key] = {"low": float(q_low), "high": float(q_high),
+                          "bias": float(samples.mean() - point_values[key]), "std": float(samples.std(ddof=1))}
+    return intervals
+
+
+def self_check(num_resamples=200, workers=1, seed=0):
+    """
+    在合成Zipf检索结果上计算点估计和自助法区间，要求每个95%区间都包含自身的点估计
+    返回 (点估计, 区间)
+    """
+    indices = synthetic_retrievals(seed=seed)
+    sorted_freqs = frequency_curve(indices)
+    point = skew_point_estimates(sorted_freqs, int(sorted_freqs.sum()), int(indices.max()) + 1)
+    intervals = bootstrap(sorted_freqs, int(indices.max()) + 1, point, num_resamples, workers, seed)
+    for key, value in bootstrap_point_values(point).items():
+        ci = intervals[key]
+        assert ci["low"] <= value <= ci["high"], f"{key}: 点估计 {value:.4f} 不在区间 [{ci['low']:.4f}, {ci['high']:.4f}] 内"
+    return point, intervals
+
+
+def write_skew_report(path, dataset_name, topk, metrics, intervals=None):
+    """保存文本报告"""
+    def with_ci(key, value, fmt):
+        if intervals is None or key not in intervals:
+            return format(value, fmt)
+        ci = intervals[key]
+        return f"{format(value, fmt)} [{format(ci['low'], fmt)}, {format(ci['high'], fmt)}]"
+
+    coverage = metrics["coverage"]
+    pl = metrics["power_law"]
+    lines = [f"检索热度偏斜分析 - {dataset_name.upper()} Top-{topk}",
+             f"总检索次数: {metrics['total_retrievals']}, 已检索文档数: {metrics['num_docs']}, 语料库规模: {metrics['corpus_size']}",
+             f"Top 10% 文档占总检索的 {with_ci('top10_percent_share', metrics['top10_percent_share'], '.2f')}%",
+             f"基尼系数(已检索文档): {with_ci('gini', metrics['gini'], '.4f')}",
+             f"基尼系数(整个语料库): {with_ci('gini_corpus', metrics['gini_corpus'], '.4f')}",
+             f"香农熵: {with_ci('entropy_bits', metrics['entropy_bits'], '.4f')} bit (归一化 {metrics['normalized_entropy']:.4f})",
+             f"Zipf 指数 s (排名-频率): {with_ci('zipf_s', metrics['zipf_s'], '.4f')}"]
+    if pl is not None:
+        lines.append(f"离散幂律 alpha (频率分布): {with_ci('alpha', pl['alpha'], '.4f')}, xmin = {pl['xmin']}, "
+                     f"KS = {pl['ks']:.4f}, 尾部文档数 {pl['num_tail']}")
+    if intervals is not None:
+        lines.append("(方括号内为百分位自助法95%置信区间)")
+    lines.append("\n覆盖曲线（覆盖X%检索流量所需文档数）:")
+    for percent in (10, 25, 50, 75, 80, 90, 95, 99, 100):
+        i = percent - 1
+        lines.append(f"{percent}%: {coverage['num_docs'][i]} 篇 (已检索文档的 {coverage['fraction_of_retrieved'][i] * 100:.2f}%, "
+                     f"语料库的 {coverage['fraction_of_corpus'][i] * 100:.2f}%)")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("\n".join(lines) + "\n")
+    for line in lines:
+        print(line)
+
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description="检索热度偏斜分析")
+    add_retrieval_args(parser)
+    parser.add_argument("--bootstrap", type=int, default=1000, help="自助法重采样次数，0表示不计算置信区间 (默认: 1000)")
+    parser.add_argument("--workers", type=int, default=0, help="自助法并行进程数，0表示CPU核数 (默认: 0)")
+    parser.add_argument("--seed", type=int, default=0, help="随机种子 (默认: 0)")
+    parser.add_argument("--self_check", action="store_true",
+                        help="在合成Zipf检索结果上检查自助法区间是否包含点估计后退出（不需要索引）")
+    args = parser.parse_args()
+
+    if args.self_check:
+        point, intervals = self_check(workers=args.workers or None, seed=args.seed)
+        for key, value in bootstrap_point_values(point).items():
+            ci = intervals[key]
+            print(f"{key}: {value:.4f} [{ci['low']:.4f}, {ci['high']:.4f}] (偏差 {ci['bias']:.4f}, 标准差 {ci['std']:.4f})")
+        print("自检通过")
+        return
+
+    dataset_name = args.dataset.lower()
+    topk = args.topk
+    print(f"加载索引 {args.index}...")
+    index = faiss.read_index(args.index)
+    _, _, indices = load_or_search(args.index, dataset_name, topk, index)
+
+    # 只统计有效文档（排除faiss的-1填充位）
+    sorted_freqs = frequency_curve(indices[indices >= 0])
+    total = int(sorted_freqs.sum())
+    print("计算偏斜指标...")
+    metrics = skew_point_estimates(sorted_freqs, total, index.ntotal)
+    intervals = None
+    if args.bootstrap > 0 and metrics["power_law"] is not None:
+        print(f"自助法重采样 {args.bootstrap} 次...")
+        intervals = bootstrap(sorted_freqs, index.ntotal, metrics,
+                              args.bootstrap, workers=args.workers or None, seed=args.seed)
+        metrics["bootstrap"] = {"num_resamples": args.bootstrap, "confidence": 0.95, "method": "percentile",
+                                "resample": "doc_frequencies",
+                                "intervals": intervals}
+
+    json_path = f"skew_metrics_{dataset_name}_top{topk}.json"
+    with open(json_path, "w", encoding="utf-8") as f:
+        json.dump(metrics, f, ensure_ascii=False, indent=2)
+    report_path = f"skew_metrics_{dataset_name}_top{topk}.txt"
+    write_skew_report(report_path, dataset_name, topk, metrics, intervals)
+
+    plot_path = f"coverage_curve_{dataset_name}_top{topk}.png"
+    plt.figure(figsize=(10, 6))
+    plt.plot(np.asarray(metrics["coverage"]["fraction_of_corpus"]) * 100, COVERAGE_PERCENTS, marker='.')
+    plt.title(f"检索流量覆盖曲线 - {dataset_name.upper()} Top-{topk}")
+    plt.xlabel("缓存文档占语料库比例 (%)")
+    plt.ylabel("覆盖的检索流量 (%)")
+    plt.grid(True)
+    plt.savefig(plot_path)
+    print(f"偏斜指标保存到 {json_path} 和 {report_path}，覆盖曲线保存为 {plot_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+按热度分层的混合精度向量存储
+热门文档（按训练段查询的检索频率）保留 float32 向量，放在内存中的稠密数组里；
+其余冷文档只保存 int8 标量量化或 PQ 编码，存为 .npy 文件并通过 mmap 读取。
+检索时先由HNSW索引取出候选文档，再按各文档可用的精度重排（热文档精确距离，冷文档解码后的近似距离）
+
+在不同热层大小下对比内存占用和召回率损失（以候选集合全部按 float32 精确重排的 top-k 为基准）
+
+用法:
+    python tiered_store.py --dataset nq --topk 10 --codec int8 --candidates 40
+    python tiered_store.py --dataset nq --topk 10 --codec pq --pq_m 64 --hot_fractions 0.01 0.05 0.1
+"""
+
+import os
+import json
+import argparse
+import numpy as np
+import matplotlib.pyplot as plt
+import faiss
+
+from retrieval_store import add_retrieval_args, load_or_search
+from hotness_stats import doc_frequency_table
+from page_io_sim import EMBEDDINGS_PATH
+
+# 配置matplotlib中文字体支持
+plt.rcParams['font.sans-serif'] = ['SimHei', 'Microsoft YaHei', 'DejaVu Sans']
+plt.rcParams['axes.unicode_minus'] = False  # 正确显示负号
+
+DEFAULT_HOT_FRACTIONS = [0.0, 0.001, 0.005, 0.01, 0.05, 0.1, 0.2, 0.5, 1.0]
+DEFAULT_OUT_DIR = "tiered_store"
+CODECS = ["int8", "pq"]
+
+
+def train_codec(kind, vectors, pq_m=64, train_size=50000, seed=0):
+    """训练冷层编码器（faiss的 IndexScalarQuantizer 或 IndexPQ，只用其 sa_encode/sa_decode）"""
+    d = vectors.shape[1]
+    if kind == "int8":
+        codec = faiss.IndexScalarQuantizer(d, faiss.ScalarQuantizer.QT_8bit)
+    elif kind == "pq":
+        codec = faiss.IndexPQ(d, pq_m, 8)
+    else:
+        raise ValueError(f"未知编码方式: {kind}")
+    rng = np.random.default_rng(seed)
+    sample = np.sort(rng.choice(len(vectors), min(train_size, len(vectors)), replace=False))
+    codec.train(np.ascontiguousarray(vectors[sample], dtype=np.float32))
+    return codec
+
+
+def encode_all(codec, vectors, batch_size=65536):
+    """分批编码全部向量"""
+    codes = np.empty((len(vectors), codec.sa_code_size()), dtype=np.uint8)
+    for start in range(0, len(vectors), batch_size):
+        codes[start:start + batch_size] = codec.sa_encode(
+            np.ascontiguousarray(vectors[start:start + batch_size], dtype=np.float32))
+    return codes
+
+
+def codec_nbytes(codec):
+    """编码器码本/量化参数的字节数"""
+    if isinstance(codec, faiss.IndexPQ):
+        return int(codec.pq.centroids.size()) * 4
+    return int(codec.sq.trained.size()) * 4
+
+
+def hot_ranking(indices, ntotal):
+    """按检索频率降序（同频按ID）排列的全部文档ID，未被检索到的文档按ID排在后面"""
+    doc_ids, _, _ = doc_frequency_table(indices)
+    ranked = doc_ids[doc_ids >= 0]
+    seen = np.zeros(ntotal, dtype=bool)
+    seen[ranked] = True
+    return np.concatenate((ranked, np.flatnonzero(~seen)))
+
+
+class TieredVectorStore:
+    """热层 float32 稠密数组 + 冷层编码（可为mmap数组）；hot_slot/cold_slot 把文档ID映射到各层的行号"""
+
+    def __init__(self, hot_ids, hot_vectors, cold_ids, cold_codes, codec, ntotal):
+        self.hot_ids = np.asarray(hot_ids, dtype=np.int64)
+        self.hot_vectors = hot_vectors
+        self.cold_ids = np.asarray(cold_ids, dtype=np.int64)
+        self.cold_codes = cold_codes
+        self.codec = codec
+        self.ntotal = ntotal
+        self.hot_slot = np.full(ntotal, -1, dtype=np.int32)
+        self.hot_slot[self.hot_ids] = np.arange(len(self.hot_ids))
+        self.cold_slot = np.full(ntotal, -1, dtype=np.int32)
+        self.cold_slot[self.cold_ids] = np.arange(len(self.cold_ids))
+
+    @classmethod
+    def build(cls, vectors, codes, hot_ids, codec):
+        """由全部向量和全部编码构建: hot_ids 之外的文档进入冷层"""
+        ntotal = len(vectors)
+        is_hot = np.zeros(ntotal, dtype=bool)
+        is_hot[hot_ids] = True
+        cold_ids = np.flatnonzero(~is_hot)
+        hot_vectors = np.ascontiguousarray(vectors[np.sort(hot_ids)], dtype=np.float32)
+        return cls(np.sort(hot_ids), hot_vectors, cold_ids, codes[cold_ids], codec, ntotal)
+
+    def memory_bytes(self):
+        """各部分字节数: 热层向量、冷层编码、码本、ID映射（hot_slot/cold_slot）"""
+        return {"hot": int(self.hot_vectors.nbytes), "cold": int(np.prod(self.cold_codes.shape)),
+                "codebook": codec_nbytes(self.codec), "id_map": int(self.hot_slot.nbytes + self.cold_slot.nbytes)}
+
+    def distances(self, queries, ids):
+        """
+        每个查询与其候选文档的L2平方距离，ids 形状为 (查询数, 候选数):
+        热文档用 float32 精确计算，冷文档用解码向量近似，-1 填充位为 inf
+        """
+        ids = np.asarray(ids)
+        dist = np.full(ids.shape, np.inf, dtype=np.float32)
+        valid = ids >= 0
+        hot = valid & (self.hot_slot[np.where(valid, ids, 0)] >= 0)
+        cold = valid & ~hot
+        if hot.any():
+            diff = self.hot_vectors[self.hot_slot[ids[hot]]] - queries[np.nonzero(hot)[0]]
+            dist[hot] = np.einsum("ij,ij->i", diff, diff)
+        if cold.any():
+            decoded = self.codec.sa_decode(np.ascontiguousarray(self.cold_codes[self.cold_slot[ids[cold]]]))
+            diff = decoded - queries[np.nonzero(cold)[0]]
+            dist[cold] = np.einsum("ij,ij->i", diff, diff)
+        return dist
+
+    def rerank(self, query_embs, candidates, topk, batch_size=256):
+        """按可用精度重排每个查询的候选文档，返回 (distances, indices, 结果中来自冷层的比例)"""
+        query_embs = np.ascontiguousarray(query_embs, dtype=np.float32)
+        candidates = np.asarray(candidates)
+        topk = min(topk, candidates.shape[1])
+        out_dist = np.empty((len(candidates), topk), dtype=np.float32)
+        out_ids = np.empty((len(candidates), topk), dtype=np.int64)
+        for start in range(0, len(candidates), batch_size):
+            ids = candidates[start:start + batch_size]
+            dist = self.distances(query_embs[start:start + batch_size], ids)
+            order = np.argsort(dist, axis=1, kind="stable")[:, :topk]
+            out_dist[start:start + len(ids)] = np.take_along_axis(dist, order, axis=1)
+            out_ids[start:start + len(ids)] = np.take_along_axis(ids, order, axis=1)
+        valid = out_ids >= 0
+        cold_share = float(np.mean(self.hot_slot[out_ids[valid]] < 0)) if valid.any() else 0.0
+        return out_dist, out_ids, cold_share
+
+    def save(self, out_dir):
+        """保存: 热层向量、冷层编码（可mmap读取）、两层的文档ID和编码器"""
+        os.makedirs(out_dir, exist_ok=True)
+        np.save(os.path.join(out_dir, "hot_ids.npy"), self.hot_ids)
+        np.save(os.path.join(out_dir, "hot_vectors.npy"), self.hot_vectors)
+        np.save(os.path.join(out_dir, "cold_ids.npy"), self.cold_ids)
+        np.save(os.path.join(out_dir, "cold_codes.npy"), np.asarray(self.cold_codes))
+        faiss.write_index(self.codec, os.path.join(out_dir, "codec.index"))
+
+    @classmethod
+    def load(cls, out_dir, mmap_mode="r"):
+        """加载: 热层读入内存，冷层编码以mmap方式打开"""
+        hot_ids = np.load(os.path.join(out_dir, "hot_ids.npy"))
+        hot_vectors = np.load(os.path.join(out_dir, "hot_vectors.npy"))
+        cold_ids = np.load(os.path.join(out_dir, "cold_ids.npy"))
+        cold_codes = np.load(os.path.join(out_dir, "cold_codes.npy"), mmap_mode=mmap_mode)
+        codec = faiss.read_index(os.path.join(out_dir, "codec.index"))
+        return cls(hot_ids, hot_vectors, cold_ids, cold_codes, codec, len(hot_ids) + len(cold_ids))
+
+
+def recall_at_k(result_ids, reference_ids):
+    """每个查询结果与基准 top-k 的平均重合率（-1填充位不计）"""
+    overlaps = [len(np.intersect1d(a[a >= 0], b[b >= 0])) / max(np.count_nonzero(b >= 0), 1)
+                for a, b in zip(result_ids, reference_ids)]
+    return float(np.mean(overlaps)) if overlaps else 0.0
+
+
+def sweep_hot_sizes(vectors, codes, codec, ranking, query_embs, candidates, topk, hot_fractions, log=print):
+    """在各热层大小下重排候选集合，返回内存占用与召回率"""
+    ntotal = len(vectors)
+    reference = TieredVectorStore.build(vectors, codes, ranking, codec)
+    _, reference_ids, _ = reference.rerank(query_embs, candidates, topk)
+    full_bytes = ntotal * vectors.shape[1] * 4
+    results = []
+    for fraction in hot_fractions:
+        num_hot = int(round(fraction * ntotal))
+        store = TieredVectorStore.build(vectors, codes, ranking[:num_hot], codec)
+        _, ids, cold_share = store.rerank(query_embs, candidates, topk)
+        memory = store.memory_bytes()
+        total = sum(memory.values())
+        result = {"hot_fraction": fraction, "num_hot": num_hot, "memory": memory, "total_bytes": total,
+                  "in_memory_bytes": memory["hot"] + memory["codebook"] + memory["id_map"],
+                  "memory_saved": 1 - total / full_bytes, "recall": recall_at_k(ids, reference_ids),
+                  "cold_result_share": cold_share}
+        results.append(result)
+        log(f"热层 {fraction * 100:g}% ({num_hot} 个文档): 总字节 {total / 1e6:.1f}MB, "
+            f"召回率 {result['recall'] * 100:.2f}%")
+    return results, full_bytes
+
+
+def write_tiered_report(path, dataset_name, topk, codec_kind, code_size, num_eval, candidates_k, full_bytes, results):
+    """保存各热层大小下的内存占用和召回率"""
+    lines = [f"混合精度分层向量存储 - {dataset_name.upper()} Top-{topk}",
+             f"冷层编码: {codec_kind} ({code_size} 字节/向量), 候选数 {candidates_k}, 评估查询数 {num_eval}",
+             f"全部 float32 存储: {full_bytes / 1e6:.1f}MB",
+             f"\n{'热层%':>8}{'热文档数':>10}{'热层MB':>10}{'冷层MB':>10}{'总MB':>10}{'常驻内存MB':>12}{'节省%':>8}"
+             f"{'召回率%':>9}{'冷层结果占比%':>14}"]
+    for r in results:
+        m = r["memory"]
+        lines.append(f"{r['hot_fraction'] * 100:>8g}{r['num_hot']:>10}{m['hot'] / 1e6:>10.1f}{m['cold'] / 1e6:>10.1f}"
+                     f"{r['total_bytes'] / 1e6:>10.1f}{r['in_memory_bytes'] / 1e6:>12.1f}{r['memory_saved'] * 100:>8.2f}"
+                     f"{r['recall'] * 100:>9.2f}{r['cold_result_share'] * 100:>14.2f}")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("\n".join(lines) + "\n")
+    for line in lines:
+        print(line)
+
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description="按热度分层的混合精度向量存储")
+    add_retrieval_args(parser)
+    parser.add_argument("--embeddings", type=str, default=EMBEDDINGS_PATH, help="文档嵌入 .npy 文件")
+    parser.add_argument("--codec", type=str, default="int8", choices=CODECS, help="冷层编码: int8 标量量化或 PQ")
+    parser.add_argument("--pq_m", type=int, default=64, help="PQ子空间数（每个向量的编码字节数，默认: 64）")
+    parser.add_argument("--candidates", type=int, default=40, help="重排的HNSW候选数 (默认: 40)")
+    parser.add_argument("--hot_fractions", type=float, nargs="+", default=DEFAULT_HOT_FRACTIONS,
+                        help="热层占文档总数的比例")
+    parser.add_argument("--train_ratio", type=float, default=0.5,
+                        help="前多少比例的查询用于统计热度，其余用于评估召回率 (默认: 0.5)")
+    parser.add_argument("--save_fraction", type=float, default=0.1,
+                        help="保存到 --out_dir 的热层比例，负数表示不保存 (默认: 0.1)")
+    parser.add_argument("--out_dir", type=str, default=DEFAULT_OUT_DIR, help="分层存储输出目录")
+    args = parser.parse_args()
+
+    dataset_name = args.dataset.lower()
+    topk = args.topk
+    print(f"加载索引 {args.index}...")
+    index = faiss.read_index(args.index)
+    candidates_k = max(args.candidates, topk)
+    query_embs, _, candidates = load_or_search(args.index, dataset_name, candidates_k, index)
+
+    if os.path.exists(args.embeddings):
+        vectors = np.load(args.embeddings, mmap_mode="r")
+    else:
+        print(f"未找到嵌入文件 {args.embeddings}，从索引重建向量")
+        vectors = index.reconstruct_n(0, index.ntotal)
+
+    cut = int(len(candidates) * args.train_ratio)
+    ranking = hot_ranking(candidates[:cut, :topk], index.ntotal)
+    print(f"训练 {args.codec} 编码器并编码 {len(vectors)} 个向量...")
+    codec = train_codec(args.codec, vectors, args.pq_m)
+    codes = encode_all(codec, vectors)
+
+    eval_queries, eval_candidates = query_embs[cut:], candidates[cut:]
+    results, full_bytes = sweep_hot_sizes(vectors, codes, codec, ranking, eval_queries, eval_candidates, topk,
+                                          sorted(args.hot_fractions))
+
+    report_path = f"tiered_store_{dataset_name}_top{topk}_{args.codec}.txt"
+    write_tiered_report(report_path, dataset_name, topk, args.codec, codec.sa_code_size(), len(eval_queries),
+                        candidates_k, full_bytes, results)
+    with open(f"tiered_store_{dataset_name}_top{topk}_{args.codec}.json", "w", encoding="utf-8") as f:
+        json.dump({"args": vars(args), "full_bytes": full_bytes, "results": results}, f, ensure_ascii=False, indent=2)
+
+    if args.save_fraction >= 0:
+        store = TieredVectorStore.build(vectors, codes, ranking[:int(round(args.save_fraction * index.ntotal))], codec)
+        store.save(args.out_dir)
+        print(f"热层 {args.save_fraction * 100:g}% 的分层存储保存到 {args.out_dir}")
+
+    plot_path = f"tiered_store_{dataset_name}_top{topk}_{args.codec}.png"
+    plt.figure(figsize=(10, 6))
+    plt.plot([r["total_bytes"] / 1e6 for r in results], [r["recall"] * 100 for r in results], marker='o')
+    for r in results:
+        plt.annotate(f"{r['hot_fraction'] * 100:g}%", (r["total_bytes"] / 1e6, r["recall"] * 100))
+    plt.title(f"向量存储内存 vs 召回率 - {dataset_name.upper()} Top-{topk} ({args.codec})")
+    plt.xlabel("向量存储总内存 (MB)")
+    plt.ylabel(f"召回率@{topk} (%)")
+    plt.grid(True)
+    plt.savefig(plot_path)
+    print(f"分层存储结果保存到 {report_path}，内存-召回率曲线保存为 {plot_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -4,10 +4,14 @@ import json
 import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
-from collections import Counter
 from datasets import load_dataset
 from sentence_transformers import SentenceTransformer
 import faiss
+from retrieval_engine import retrieve
+from retrieval_store import store_path, get_or_create_retrieval
+from hotness_stats import doc_frequency_table, top_percent_share, hot_docs
+from hnsw_graph_stats import hnsw_layers, level_node_counts, high_level_stats, hot_level_distribution
+from ngram_stats import ngram_frequency_curve
 
 # 配置matplotlib中文字体支持
 plt.rcParams['font.sans-serif'] = ['SimHei', 'Microsoft YaHei', 'DejaVu Sans']
@@ -29,6 +33,10 @@ parser.add_argument("--dataset", type=str, default="mmlu", choices=["mmlu", "nq"
                     help="选择查询数据集: mmlu, nq, hotpotqa, triviaqa")
 parser.add_argument("--topk", type=int, default=10,
                     help="检索的top-k值 (默认: 10)")
+parser.add_argument("--search_workers", type=int, default=1,
+                    help="并行检索的工作线程数 (默认: 1)")
+parser.add_argument("--threads", type=int, default=0,
+                    help="每个检索工作线程的OpenMP线程数，0表示默认值 (默认: 0)")
 args = parser.parse_args()
 
 dataset_name = args.dataset.lower()
@@ -120,23 +128,21 @@ print("HNSW索引准备完成.")
 
 # 新功能: 提取HNSW节点层级信息
 hnsw = index.hnsw
-levels = faiss.vector_to_array(hnsw.levels)
+layers = hnsw_layers(index)  # 每个节点的最高层下标 (hnsw.levels - 1，第0层为0)
 entry_point = hnsw.entry_point
 max_level = hnsw.max_level
 print(f"最大层级: {max_level} (共 {max_level + 1} 层)")
 print(f"入口节点ID: {entry_point}")
 
-# 统计每层节点数
+# 统计每层节点数 (直方图逆序累加，一次扫描得到 layers >= level 的节点数)
 level_counts = {}
-for level in range(max_level + 1):
-    count = sum(1 for l in levels if l >= level)
+for level, count in enumerate(level_node_counts(layers, max_level).tolist()):
     level_counts[level] = count
     print(f"层级 {level}: {count} 个节点")
 
-# 高层节点数 (level > 0)
-high_level_nodes = sum(1 for l in levels if l > 0)
-high_level_ratio = (high_level_nodes / len(levels)) * 100 if len(levels) > 0 else 0
-print(f"高层节点 (level > 0) 总数: {high_level_nodes} ({high_level_ratio:.2f}% of total nodes)")
+# 高层节点数 (层级 >= 1)
+high_level_nodes, high_level_ratio = high_level_stats(layers)
+print(f"高层节点 (层级 >= 1) 总数: {high_level_nodes} ({high_level_ratio:.2f}% of total nodes)")
 
 # 步骤4: 加载查询数据集（本地缓存或从Hugging Face下载）
 print(f"加载 {dataset_name.upper()} 数据集...")
@@ -168,33 +174,26 @@ else:
     print(f"数据集保存到 {dataset_cache_path}")
     queries = [item["question"] for item in query_data]
 
-# 步骤5: 对于每个查询，进行检索并统计（top-k，但统计频率基于所有检索结果）
-retrieved_docs = []
-retrieved_sequences = []
-for query in queries:
-    query_emb = get_embedding([query])[0]
-    distances, indices = index.search(np.array([query_emb]), k=topk)
-    seq = list(indices[0])
-    retrieved_sequences.append(seq)
-    for idx in seq:
-        retrieved_docs.append(idx)
+# 步骤5: 对所有查询批量检索并统计（top-k，但统计频率基于所有检索结果）
+# 每个(索引, 数据集)只在最大k下检索一次，之后各top-k直接读取保存的结果矩阵
+distances, indices = get_or_create_retrieval(
+    store_path(INDEX_PATH, dataset_name), topk,
+    lambda k: retrieve(model, index, queries, k, num_threads=args.threads, num_workers=args.search_workers),
+    num_queries=len(queries), index_ntotal=index.ntotal, index_path=INDEX_PATH, queries=queries)
 
-# 步骤6: 统计频率分布
-doc_freq = Counter(retrieved_docs)
-freq_sorted = sorted(doc_freq.items(), key=lambda x: x[1], reverse=True)
+# 步骤6: 统计频率分布（按频率降序的 doc_id 和 freq）
+hot_doc_ids, freq_sorted, total_retrievals = doc_frequency_table(indices)
 
 # 打印并保存top-10热门文档频率
 print("Top-10热门文档频率:")
 with open(FREQ_STATS_PATH, "w") as f:
-    for rank, (doc_id, freq) in enumerate(freq_sorted[:10], 1):
+    for rank, (doc_id, freq) in enumerate(zip(hot_doc_ids[:10], freq_sorted[:10]), 1):
         stat = f"Rank {rank}: Doc {doc_id} - {freq} 次"
         print(stat)
         f.write(stat + "\n")
 
 # 计算累积分布
-total_retrievals = len(retrieved_docs)
-cumulative = np.cumsum([f[1] for f in freq_sorted]) / total_retrievals
-top10_percent = cumulative[int(0.1 * len(freq_sorted)) - 1] * 100 if len(freq_sorted) > 0 else 0
+top10_percent = top_percent_share(freq_sorted, total_retrievals, 0.1)
 print(f"Top 10% 文档占总检索的 {top10_percent:.2f}%")
 with open(FREQ_STATS_PATH, "a") as f:
     f.write(f"Top 10% 文档占总检索的 {top10_percent:.2f}%\n")
@@ -202,7 +201,7 @@ print(f"频率统计保存到 {FREQ_STATS_PATH}")
 
 # 步骤7: 绘制频率分布图
 plt.figure(figsize=(10, 6))
-plt.plot(range(1, len(freq_sorted) + 1), [f[1] for f in freq_sorted], marker='o')
+plt.plot(range(1, len(freq_sorted) + 1), freq_sorted, marker='o')
 plt.xscale('log')
 plt.yscale('log')
 plt.title(f"检索到的文章频率分布 (Log-Log Scale) - {dataset_name.upper()} Top-{topk}")
@@ -213,18 +212,8 @@ plt.savefig(DIST_PLOT_PATH)
 print(f"频率分布图保存为 {DIST_PLOT_PATH}")
 
 # 新功能: 统计连续的2,3,4个文章对（n-gram）
-def extract_ngrams(sequences, n):
-    ngrams = []
-    for seq in sequences:
-        for i in range(len(seq) - n + 1):
-            ngram = tuple(seq[i:i+n])
-            ngrams.append(ngram)
-    return ngrams
-
 for n in [2, 3, 4]:
-    ngrams = extract_ngrams(retrieved_sequences, n)
-    ngram_freq = Counter(ngrams)
-    ngram_freq_sorted = sorted(ngram_freq.values(), reverse=True)
+    ngram_freq_sorted, total_ngrams = ngram_frequency_curve(indices, n, id_bound=index.ntotal)
     
     # 输出文件命名
     NGRAM_STATS_PATH = NGRAM_STATS_PATH_BASE.format(n)
@@ -239,7 +228,6 @@ for n in [2, 3, 4]:
             f.write(stat + "\n")
     
     # 计算累积分布
-    total_ngrams = len(ngrams)
     ngram_cumulative = np.cumsum(ngram_freq_sorted) / total_ngrams
     ngram_top10_percent = ngram_cumulative[int(0.1 * len(ngram_freq_sorted)) - 1] * 100 if len(ngram_freq_sorted) > 0 else 0
     print(f"Top 10% {n}-gram 占总访问的 {ngram_top10_percent:.2f}%")
@@ -259,19 +247,17 @@ for n in [2, 3, 4]:
     plt.savefig(NGRAM_PLOT_PATH)
     print(f"{n}-gram 分布图保存为 {NGRAM_PLOT_PATH}")
 
-# 新功能: 探索top10%热门文章中HNSW高层节点占比 (level > 0)
-num_top10 = max(1, int(0.1 * len(freq_sorted)))
-top10_docs = [doc_id for doc_id, freq in freq_sorted[:num_top10]]
+# 新功能: 探索top10%热门文章中HNSW高层节点占比 (层级 >= 1)
+top10_docs = hot_docs(hot_doc_ids, 0.1)
 
-high_level_count = sum(1 for doc_id in top10_docs if levels[doc_id] > 0)
-high_level_ratio = high_level_count / len(top10_docs) * 100 if top10_docs else 0
+_, high_level_count, high_level_ratio = hot_level_distribution(layers, top10_docs)
 
 # 打印示例 (前10热门是否高层)
-print("\nTop-10热门文章中高层节点 (level > 0):")
+print("\nTop-10热门文章中高层节点 (层级 >= 1):")
 with open(HIGH_LEVEL_STATS_PATH, "w") as f:
-    for rank, (doc_id, freq) in enumerate(freq_sorted[:10], 1):
-        is_high_level = levels[doc_id] > 0
-        level = levels[doc_id]
+    for rank, (doc_id, freq) in enumerate(zip(hot_doc_ids[:10], freq_sorted[:10]), 1):
+        is_high_level = layers[doc_id] > 0
+        level = layers[doc_id]
         stat = f"Rank {rank}: Doc {doc_id} (Freq {freq}) - 高层节点: {is_high_level} (层级 {level})"
         print(stat)
         f.write(stat + "\n")
@@ -281,8 +267,8 @@ print(f"高层节点统计保存到 {HIGH_LEVEL_STATS_PATH}")
 
 # 绘制热门文章层级分布图
 plt.figure(figsize=(10, 6))
-hot_levels = [levels[doc_id] for doc_id in top10_docs]
-plt.hist(hot_levels, bins=range(max(hot_levels)+2), edgecolor='black')
+hot_layers = layers[top10_docs]
+plt.hist(hot_layers, bins=range(max(hot_layers)+2), edgecolor='black')
 plt.title(f"Top 10% 热门文章层级分布 - {dataset_name.upper()} Top-{topk}")
 plt.xlabel("层级")
 plt.ylabel("文章数")
@@ -9,7 +9,13 @@ from collections import Counter
 from datasets import load_dataset
 from sentence_transformers import SentenceTransformer
 import faiss
+from parallel_search import parallel_search, tune_search_policy, write_policy_report
+from retrieval_store import store_path, get_or_create_retrieval
+from hotness_stats import doc_frequency_table, top_percent_share, hot_docs
+from hnsw_graph_stats import (hnsw_layers, level_node_counts, high_level_stats, hot_level_distribution,
+                              hnsw_degrees, total_out_degree, layer_degree_summary)
 import logging
+import time
 
 # 配置matplotlib中文字体支持
 plt.rcParams['font.sans-serif'] = ['SimHei', 'Microsoft YaHei', 'DejaVu Sans']
@@ -23,6 +29,12 @@ parser.add_argument("--topk", type=int, default=10,
                     help="检索的top-k值 (默认: 10)")
 parser.add_argument("--batch_size", type=int, default=512,
                     help="批次大小 (默认: 512)")
+parser.add_argument("--search_workers", type=int, default=1,
+                    help="并行检索的工作线程数 (默认: 1)")
+parser.add_argument("--omp_threads", type=int, default=0,
+                    help="每个检索工作线程的OpenMP线程数，0表示默认值 (默认: 0)")
+parser.add_argument("--tune_search", action="store_true",
+                    help="在当前机器上实测并自动选择批次大小和并行度拆分")
 args = parser.parse_args()
 
 dataset_name = args.dataset.lower()
@@ -62,6 +74,7 @@ logging.info("=== 实验配置 ===")
 logging.info(f"数据集: {dataset_name}")
 logging.info(f"Top-k值: {topk}")
 logging.info(f"批次大小: {args.batch_size}")
+logging.info(f"检索工作线程数: {args.search_workers}, 每线程OpenMP线程数: {args.omp_threads or '默认'}")
 logging.info("================")
 
 # 步骤1: 加载Wikipedia知识库（使用Wikipedia 100K子集）
@@ -142,29 +155,31 @@ logging.info("HNSW索引准备完成.")
 
 # 新功能: 提取HNSW节点层级信息
 hnsw = index.hnsw
-levels = faiss.vector_to_array(hnsw.levels)  # 转换为NumPy数组
+layers = hnsw_layers(index)  # 每个节点的最高层下标 (hnsw.levels - 1，第0层为0)
 entry_point = hnsw.entry_point  # 入口节点
 max_level = hnsw.max_level
 logging.info(f"最大层级: {max_level} (共 {max_level + 1} 层)")
 logging.info(f"入口节点ID: {entry_point}")
 
-# 统计每层节点数
+# 统计每层节点数 (直方图逆序累加，一次扫描得到 layers >= level 的节点数)
 level_counts = {}
-for level in range(max_level + 1):
-    count = sum(1 for l in levels if l >= level)  # l >= level 表示在该层或更高
+for level, count in enumerate(level_node_counts(layers, max_level).tolist()):
     level_counts[level] = count
     logging.info(f"层级 {level}: {count} 个节点")
 
-# 高层节点数 (level > 0)
-high_level_nodes = sum(1 for l in levels if l > 0)
-high_level_ratio = (high_level_nodes / len(levels)) * 100 if len(levels) > 0 else 0
-logging.info(f"高层节点 (level > 0) 总数: {high_level_nodes} ({high_level_ratio:.2f}% of total nodes)")
+# 高层节点数 (层级 >= 1)
+high_level_nodes, high_level_ratio = high_level_stats(layers)
+logging.info(f"高层节点 (层级 >= 1) 总数: {high_level_nodes} ({high_level_ratio:.2f}% of total nodes)")
 
-# 新功能: 统计HNSW中各个节点的度 (总邻居数)
-offsets = faiss.vector_to_array(hnsw.offsets)
-neighbors = faiss.vector_to_array(hnsw.neighbors)
-ntotal = len(levels)
-degrees = [int(offsets[i+1] - offsets[i]) for i in range(ntotal)]
+# 新功能: 统计HNSW中各个节点的度 (各层有效邻居数之和，不计 -1 填充位)
+layer_stats = hnsw_degrees(index)  # 按层的 (节点, 出度, 入度)
+degrees = total_out_degree(layer_stats).tolist()
+in_degree = layer_stats[0][2]  # 第0层入度，按 doc_id 对齐
+
+logging.info("\nHNSW各层出度/入度:")
+for row in layer_degree_summary(layer_stats):
+    logging.info(f"第{row['layer']}层: {row['nodes']} 个节点, 平均出度 {row['avg_out_degree']:.2f}, "
+                 f"最大入度 {row['max_in_degree']}, 入度为0的节点 {row['zero_in_degree']}")
 
 # 统计度分布
 degree_freq = Counter(degrees)
@@ -225,32 +240,44 @@ else:
     np.save(QUERY_EMBEDDINGS_PATH, query_embs)
     logging.info(f"查询嵌入保存到 {QUERY_EMBEDDINGS_PATH}")
 
-# 步骤6: 对于每个查询，进行检索并统计（top-k，但统计频率基于所有检索结果）
-retrieved_docs = []
-for i in range(0, len(query_embs), args.batch_size):
-    batch_embs = query_embs[i:i + args.batch_size]
-    distances, indices = index.search(batch_embs, k=topk)  # 批量检索
-    for idx_batch in indices:
-        for idx in idx_batch:
-            retrieved_docs.append(idx)
-logging.info(f"检索完成，总检索文档数: {len(retrieved_docs)}")
+# 步骤6: 对所有查询批量检索并统计（top-k，但统计频率基于所有检索结果）
+def run_search(k):
+    """按命令行给定或实测选出的策略并行检索"""
+    if args.tune_search:
+        policy, policy_results = tune_search_policy(index, query_embs, k, log=logging.info)
+        write_policy_report(f"search_policy_{dataset_name}_top{k}.txt", policy_results, k,
+                            min(len(query_embs), 4096))
+        logging.info(f"自动选择检索策略: {policy}")
+    else:
+        policy = {"num_workers": args.search_workers, "omp_threads": args.omp_threads,
+                  "batch_size": args.batch_size}
+    start = time.perf_counter()
+    result = parallel_search(index, query_embs, k, **policy)
+    elapsed = time.perf_counter() - start
+    logging.info(f"检索完成: {len(query_embs)} 个查询, 耗时 {elapsed:.2f}s, {len(query_embs) / elapsed:.1f} QPS")
+    return result
+
+# 每个(索引, 数据集)只在最大k下检索一次，之后各top-k直接读取保存的结果矩阵
+distances, indices = get_or_create_retrieval(
+    store_path(INDEX_PATH, dataset_name), topk,
+    run_search,  # 并行批量检索
+    num_queries=len(query_embs), index_ntotal=index.ntotal,
+    index_path=INDEX_PATH, queries=queries, log=logging.info)
+logging.info(f"检索完成，总检索文档数: {indices.size}")
 
 # 步骤7: 统计频率分布
-doc_freq = Counter(retrieved_docs)
-freq_sorted = sorted(doc_freq.items(), key=lambda x: x[1], reverse=True)  # (doc_id, freq) 降序
+hot_doc_ids, freq_sorted, total_retrievals = doc_frequency_table(indices)  # 按频率降序的 doc_id 和 freq
 
 # 打印并保存top-10热门文档频率
 logging.info("\nTop-10热门文档频率:")
 with open(FREQ_STATS_PATH, "w") as f:
-    for rank, (doc_id, freq) in enumerate(freq_sorted[:10], 1):
+    for rank, (doc_id, freq) in enumerate(zip(hot_doc_ids[:10], freq_sorted[:10]), 1):
         stat = f"Rank {rank}: Doc {doc_id} - {freq} 次"
         logging.info(stat)
         f.write(stat + "\n")
 
 # 计算累积分布（验证热门现象）
-total_retrievals = len(retrieved_docs)  # 注意：现在是top-k的总检索次数
-cumulative = np.cumsum([f[1] for f in freq_sorted]) / total_retrievals
-top10_percent = cumulative[int(0.1 * len(freq_sorted)) - 1] * 100 if len(freq_sorted) > 0 else 0
+top10_percent = top_percent_share(freq_sorted, total_retrievals, 0.1)  # total_retrievals 是top-k的总检索次数
 logging.info(f"Top 10% 文档占总检索的 {top10_percent:.2f}%")
 with open(FREQ_STATS_PATH, "a") as f:
     f.write(f"Top 10% 文档占总检索的 {top10_percent:.2f}%\n")
@@ -259,7 +286,7 @@ logging.info(f"频率统计保存到 {FREQ_STATS_PATH}")
 
 # 步骤8: 绘制频率分布图
 plt.figure(figsize=(10, 6))
-plt.plot(range(1, len(freq_sorted) + 1), [f[1] for f in freq_sorted], marker='o')
+plt.plot(range(1, len(freq_sorted) + 1), freq_sorted, marker='o')
 plt.xscale('log')
 plt.yscale('log')
 plt.title(f"检索到的文章频率分布 (Log-Log Scale) - {dataset_name.upper()} Top-{topk}")
@@ -269,19 +296,17 @@ plt.grid(True)
 plt.savefig(DIST_PLOT_PATH)
 logging.info(f"频率分布图保存为 {DIST_PLOT_PATH}")
 
-# 新功能: 探索top10%热门文章中HNSW高层节点占比 (level > 0)
-num_top10 = max(1, int(0.1 * len(freq_sorted)))  # top10%文章数
-top10_docs = [doc_id for doc_id, freq in freq_sorted[:num_top10]]  # top10% doc_ids
+# 新功能: 探索top10%热门文章中HNSW高层节点占比 (层级 >= 1)
+top10_docs = hot_docs(hot_doc_ids, 0.1)  # top10% doc_ids
 
-high_level_count = sum(1 for doc_id in top10_docs if levels[doc_id] > 0)
-high_level_ratio = high_level_count / len(top10_docs) * 100 if top10_docs else 0
+_, high_level_count, high_level_ratio = hot_level_distribution(layers, top10_docs)
 
 # 打印示例 (前10热门是否高层)
-logging.info("\nTop-10热门文章中高层节点 (level > 0):")
+logging.info("\nTop-10热门文章中高层节点 (层级 >= 1):")
 with open(HIGH_LEVEL_STATS_PATH, "w") as f:
-    for rank, (doc_id, freq) in enumerate(freq_sorted[:10], 1):
-        is_high_level = levels[doc_id] > 0
-        level = levels[doc_id]
+    for rank, (doc_id, freq) in enumerate(zip(hot_doc_ids[:10], freq_sorted[:10]), 1):
+        is_high_level = layers[doc_id] > 0
+        level = layers[doc_id]
         stat = f"Rank {rank}: Doc {doc_id} (Freq {freq}) - 高层节点: {is_high_level} (层级 {level})"
         logging.info(stat)
         f.write(stat + "\n")
@@ -291,8 +316,8 @@ logging.info(f"高层节点统计保存到 {HIGH_LEVEL_STATS_PATH}")
 
 # 绘制热门文章层级分布图
 plt.figure(figsize=(10, 6))
-hot_levels = [levels[doc_id] for doc_id in top10_docs]
-plt.hist(hot_levels, bins=range(int(min(hot_levels)-1), int(max(hot_levels)+2)), edgecolor='black')
+hot_layers = layers[top10_docs]
+plt.hist(hot_layers, bins=range(int(min(hot_layers)-1), int(max(hot_layers)+2)), edgecolor='black')
 plt.title(f"Top 10% 热门文章层级分布 - {dataset_name.upper()} Top-{topk}")
 plt.xlabel("层级")
 plt.ylabel("文章数")
@@ -300,18 +325,7 @@ plt.grid(True)
 plt.savefig(HIGH_LEVEL_PLOT_PATH)
 logging.info(f"高层节点分布图保存为 {HIGH_LEVEL_PLOT_PATH}")
 
-# 新功能: 统计HNSW中各个节点的度 (总邻居数)
-offsets = faiss.vector_to_array(hnsw.offsets)
-neighbors = faiss.vector_to_array(hnsw.neighbors)
-ntotal = len(levels)
-degrees = []
-for i in range(ntotal):
-    start = offsets[i]
-    end = offsets[i+1]
-    valid_neighbors = [n for n in neighbors[start:end] if n != -1]
-    degrees.append(len(valid_neighbors))
-
-# 统计度分布
+# 统计度分布 (degrees 为前面按层计算的有效邻居总数)
 degree_freq = Counter(degrees)
 degree_freq_sorted = sorted(degree_freq.items(), key=lambda x: x[0])  # 按度升序
 
@@ -326,7 +340,7 @@ with open(DEGREE_STATS_PATH, "w") as f:
 hot_degrees = [degrees[doc_id] for doc_id in top10_docs]
 
 logging.info("\nTop-10热门文章的度:")
-for rank, (doc_id, freq) in enumerate(freq_sorted[:10], 1):
+for rank, (doc_id, freq) in enumerate(zip(hot_doc_ids[:10], freq_sorted[:10]), 1):
     deg = degrees[doc_id]
     logging.info(f"Rank {rank}: Doc {doc_id} (Freq {freq}) - 度: {deg}")
 
@@ -341,6 +355,11 @@ with open(DEGREE_STATS_PATH, "a") as f:
     f.write(f"\n整体平均度: {avg_degree_all:.2f}\n")
     f.write(f"Top 10% 热门文章平均度: {avg_degree_hot:.2f}\n")
     f.write(f"热门文章平均度是否高于整体: {avg_degree_hot > avg_degree_all}\n")
+    # 第0层入度: 被多少节点列为邻居，faiss本身不保存
+    avg_in_degree_all = in_degree.mean()
+    avg_in_degree_hot = in_degree[top10_docs].mean()
+    f.write(f"\n第0层整体平均入度: {avg_in_degree_all:.2f}\n")
+    f.write(f"Top 10% 热门文章第0层平均入度: {avg_in_degree_hot:.2f}\n")
 
 logging.info(f"度统计保存到 {DEGREE_STATS_PATH}")
 
@@ -365,15 +384,12 @@ plt.savefig(HOT_DEGREE_PLOT_PATH)
 logging.info(f"热门文章度分布图保存为 {HOT_DEGREE_PLOT_PATH}")
 
 # 新功能: 保存top10%热门文章数据 (rank, id, 度, 层级)
-num_top10 = max(1, int(0.1 * len(freq_sorted)))
-top10_docs = [doc_id for doc_id, freq in freq_sorted[:num_top10]]  # top10% doc_ids
-
 logging.info("\n保存Top 10% 热门文章数据...")
 with open(TOP10_HOT_DOCS_PATH, "w") as f:
     f.write("Rank,ID,度,层级\n")
-    for rank, (doc_id, freq) in enumerate(freq_sorted[:num_top10], 1):
+    for rank, doc_id in enumerate(top10_docs, 1):
         deg = degrees[doc_id]
-        level = levels[doc_id]
+        level = layers[doc_id]
         stat = f"{rank},{doc_id},{deg},{level}\n"
         f.write(stat)
 
@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+查询流滑动窗口热度分析
+按查询数在检索结果矩阵上滑动窗口（查询顺序即数据集顺序），逐窗口统计:
+- 热门集合大小: 窗口内检索频率前 X% 的文档数（以及窗口内不同文档数）
+- 热门集合变化: 相邻窗口热门集合的 Jaccard 相似度，以及与全局热门集合的 Jaccard 相似度
+- Top X% 占比: 窗口内热门文档占窗口检索次数的比例
+- 热门集合延续命中率: 上一个窗口的热门集合在本窗口命中的检索比例（近似"按上一窗口缓存"的命中率）
+
+窗口滑动时只对移出和移入的行增减计数，不重新统计整个窗口；热门集合只在窗口内文档上部分选择，
+同频文档按窗口内首次出现顺序（与全局热门集合的 doc_frequency_table 一致）
+可用 --shuffle 打乱查询顺序作为无时间局部性的对照
+
+用法:
+    python window_hotness.py --dataset nq --topk 10 --window 1000 --step 250
+"""
+
+import argparse
+import numpy as np
+import matplotlib.pyplot as plt
+import faiss
+
+from retrieval_store import add_retrieval_args, load_or_search
+from hotness_stats import doc_frequency_table, hot_docs, HOT_PERCENT
+from reuse_distance import next_occurrence
+
+# 配置matplotlib中文字体支持
+plt.rcParams['font.sans-serif'] = ['SimHei', 'Microsoft YaHei', 'DejaVu Sans']
+plt.rcParams['axes.unicode_minus'] = False  # 正确显示负号
+
+
+class WindowCounter:
+    """
+    窗口内文档计数，按行区间增减（-1填充位不计入）
+    同时维护窗口内的文档列表和每个文档在窗口内首次出现的位置: 热门集合只在窗口内文档上部分选择，
+    频率降序、同频按窗口内首次出现顺序，与 hotness_stats.doc_frequency_table 的规则一致
+    """
+
+    def __init__(self, indices, ntotal):
+        indices = np.asarray(indices)
+        self.width = indices.shape[1] if indices.ndim == 2 else 1
+        self.flat = indices.reshape(-1)
+        self.next_pos = next_occurrence(self.flat)
+        self.counts = np.zeros(ntotal, dtype=np.int64)
+        self.first_pos = np.zeros(ntotal, dtype=np.int64)
+        self.members = np.empty(0, dtype=np.int64)
+        self.total = 0
+
+    @property
+    def num_distinct(self):
+        return len(self.members)
+
+    def add(self, row_start, row_end):
+        """加入 [row_start, row_end) 行"""
+        begin = row_start * self.width
+        docs = self.flat[begin:row_end * self.width]
+        valid = np.flatnonzero(docs >= 0)
+        if valid.size == 0:
+            return
+        uniq, first, cnt = np.unique(docs[valid], return_index=True, return_counts=True)
+        new = self.counts[uniq] == 0
+        self.first_pos[uniq[new]] = begin + valid[first[new]]
+        self.counts[uniq] += cnt
+        self.members = np.concatenate((self.members, uniq[new]))
+        self.total += int(valid.size)
+
+    def remove(self, row_start, row_end):
+        """移除 [row_start, row_end) 行（必须是窗口最前面的行）"""
+        begin, end = row_start * self.width, row_end * self.width
+        docs = self.flat[begin:end]
+        valid = docs >= 0
+        if not valid.any():
+            return
+        uniq, cnt = np.unique(docs[valid], return_counts=True)
+        self.counts[uniq] -= cnt
+        self.total -= int(cnt.sum())
+        # 仍在窗口内的文档: 在移除块内最后一次出现的下一次出现位置即新的首次出现位置
+        nxt = self.next_pos[begin:end]
+        last = valid & (nxt >= end)
+        moved, moved_next = docs[last], nxt[last]
+        still = self.counts[moved] > 0
+        self.first_pos[moved[still]] = moved_next[still]
+        if not self.counts[uniq].all():
+            self.members = self.members[self.counts[self.members] > 0]
+
+    def hot_set(self, percent=HOT_PERCENT):
+        """
+        窗口内热门集合（按文档ID排序）及 Top percent 占比(%)，口径同 hot_docs / top_percent_share:
+        热门集合至少1个文档，占比按前 int(percent × 不同文档数) 个文档计算（为0时即全部）
+        """
+        n = len(self.members)
+        if n == 0:
+            return np.empty(0, dtype=np.int64), 0
+        key = self.first_pos[self.members] - self.counts[self.members] * (len(self.flat) + 1)
+        num_hot = max(1, int(percent * n))
+        num_share = int(percent * n) or n
+        size = max(num_hot, num_share)
+        top = np.argpartition(key, size - 1)[:size] if size < n else np.arange(n)
+        top = top[np.argsort(key[top])]
+        hot = np.sort(self.members[top[:num_hot]])
+        share = self.counts[self.members[top[:num_share]]].sum() / self.total * 100
+        return hot, share
+
+
+def jaccard(a, b):
+    """两个有序文档集合的 Jaccard 相似度"""
+    if len(a) == 0 and len(b) == 0:
+        return 1.0
+    inter = len(np.intersect1d(a, b, assume_unique=True))
+    return inter / (len(a) + len(b) - inter)
+
+
+def sliding_window_hotness(indices, ntotal, window, step, percent=HOT_PERCENT, global_hot=None):
+    """
+    在检索结果矩阵上滑动窗口，返回每个窗口的统计数组字典
+    相邻窗口之间只移除 [上一窗口起点, 本窗口起点) 的行并加入 [上一窗口终点, 本窗口终点) 的行
+    """
+    num_queries = len(indices)
+    window = min(window, num_queries)
+    starts = np.arange(0, num_queries - window + 1, step)
+    counter = WindowCounter(indices, ntotal)
+    fields = ("start", "num_distinct", "hot_size", "top_share", "jaccard_prev", "jaccard_global", "carryover_hit")
+    stats = {name: np.zeros(len(starts), dtype=np.float64) for name in fields}
+    prev_start, prev_end, prev_hot = 0, 0, None
+    for i, start in enumerate(starts):
+        end = start + window
+        counter.remove(prev_start, min(prev_end, start))
+        counter.add(max(prev_end, start), end)
+        hot, top_share = counter.hot_set(percent)
+        stats["start"][i] = start
+        stats["num_distinct"][i] = counter.num_distinct
+        stats["hot_size"][i] = len(hot)
+        stats["top_share"][i] = top_share
+        stats["jaccard_prev"][i] = jaccard(prev_hot, hot) if prev_hot is not None else np.nan
+        stats["jaccard_global"][i] = jaccard(global_hot, hot) if global_hot is not None else np.nan
+        stats["carryover_hit"][i] = (counter.counts[prev_hot].sum() / counter.total * 100
+                                     if prev_hot is not None and counter.total else np.nan)
+        prev_start, prev_end, prev_hot = start, end, hot
+    return stats
+
+
+def summarize_windows(stats):
+    """各窗口指标的均值/最小值/最大值"""
+    summary = {}
+    for name in ("num_distinct", "hot_size", "top_share", "jaccard_prev", "jaccard_global", "carryover_hit"):
+        values = stats[name][~np.isnan(stats[name])]
+        if len(values):
+            summary[name] = (float(values.mean()), float(values.min()), float(values.max()))
+    return summary
+
+
+def write_window_stats(path, dataset_name, topk, window, step, stats, label=""):
+    """保存逐窗口统计和汇总"""
+    labels = {"num_distinct": "窗口内不同文档数", "hot_size": "热门集合大小", "top_share": "Top 10% 占比(%)",
+              "jaccard_prev": "相邻窗口热门集合Jaccard", "jaccard_global": "与全局热门集合Jaccard",
+              "carryover_hit": "上一窗口热门集合命中率(%)"}
+    lines = [f"滑动窗口热度分析{label} - {dataset_name.upper()} Top-{topk} (窗口 {window} 个查询, 步长 {step}, 共 {len(stats['start'])} 个窗口)"]
+    for name, (mean, low, high) in summarize_windows(stats).items():
+        lines.append(f"{labels[name]}: 均值 {mean:.4f}, 最小 {low:.4f}, 最大 {high:.4f}")
+    lines.append("\n窗口起点\t不同文档数\t热门集合大小\tTop10%占比\t相邻Jaccard\t全局Jaccard\t延续命中率")
+    for i in range(len(stats["start"])):
+        lines.append(f"{int(stats['start'][i])}\t{int(stats['num_distinct'][i])}\t{int(stats['hot_size'][i])}\t"
+                     f"{stats['top_share'][i]:.2f}\t{stats['jaccard_prev'][i]:.4f}\t{stats['jaccard_global'][i]:.4f}\t"
+                     f"{stats['carryover_hit'][i]:.2f}")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("\n".join(lines) + "\n")
+    for line in lines[:7]:
+        print(line)
+
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description="查询流滑动窗口热度分析")
+    add_retrieval_args(parser)
+    parser.add_argument("--window", type=int, default=1000, help="窗口大小（查询数，默认: 1000）")
+    parser.add_argument("--step", type=int, default=250, help="窗口步长（查询数，默认: 250）")
+    parser.add_argument("--shuffle", action="store_true", help="额外在打乱顺序的查询流上计算作为对照")
+    parser.add_argument("--seed", type=int, default=0, help="打乱顺序的随机种子 (默认: 0)")
+    args = parser.parse_args()
+    if args.window <= 0 or args.step <= 0:
+        parser.error("--window 和 --step 必须为正整数")
+
+    dataset_name = args.dataset.lower()
+    topk = args.topk
+    print(f"加载索引 {args.index}...")
+    index = faiss.read_index(args.index)
+    _, _, indices = load_or_search(args.index, dataset_name, topk, index)
+
+    # 全局热门集合（与各频率统计脚本的定义一致）
+    doc_ids, _, _ = doc_frequency_table(indices)
+    global_hot = np.sort(hot_docs(doc_ids[doc_ids >= 0], HOT_PERCENT))
+
+    runs = [("", indices)]
+    if args.shuffle:
+        rng = np.random.default_rng(args.seed)
+        runs.append(("_shuffled", indices[rng.permutation(len(indices))]))
+
+    plt.figure(figsize=(12, 6))
+    for suffix, stream in runs:
+        stats = sliding_window_hotness(stream, index.ntotal, args.window, args.step, global_hot=global_hot)
+        label = "（打乱顺序对照）" if suffix else ""
+        stats_path = f"window_hotness{suffix}_{dataset_name}_top{topk}.txt"
+        write_window_stats(stats_path, dataset_name, topk, args.window, args.step, stats, label)
+        np.savez_compressed(f"window_hotness{suffix}_{dataset_name}_top{topk}.npz", **stats)
+        print(f"滑动窗口统计保存到 {stats_path}")
+        plt.plot(stats["start"], stats["jaccard_prev"], label=f"相邻窗口Jaccard{label}")
+        plt.plot(stats["start"], stats["carryover_hit"] / 100, label=f"上一窗口热门集合命中率{label}")
+
+    plot_path = f"window_hotness_{dataset_name}_top{topk}.png"
+    plt.title(f"滑动窗口热门集合变化 - {dataset_name.upper()} Top-{topk} (窗口 {args.window}, 步长 {args.step})")
+    plt.xlabel("窗口起点（查询序号）")
+    plt.ylabel("比例")
+    plt.legend()
+    plt.grid(True)
+    plt.savefig(plot_path)
+    print(f"滑动窗口变化图保存为 {plot_path}")
+
+
+if __name__ == "__main__":
+    main()